@@ -7,6 +7,7 @@ from anonlink import serialization
 from anonlink import similarities
 from anonlink import solving
 from anonlink import stats
+from anonlink import tracing
 from anonlink import typechecking
 
 __version__ = pkg_resources.get_distribution('anonlink').version
@@ -0,0 +1,20 @@
+"""Benchmarks of anonlink.
+
+Scenarios benchmark one part of anonlink each: the popcount and Dice
+kernels, candidate generation with and without blocking, merging,
+serialisation, the solvers and statistics. `run_benchmarks` sweeps
+them over their parameters and writes a JSON report, and
+`compare_results` compares the reports of two versions.
+
+Run ``python -m anonlink.benchmark --help`` for the command line.
+"""
+
+from anonlink.benchmark._data import (generate_candidate_graph,
+                                      generate_random_bitarrays,
+                                      generate_random_clks)
+from anonlink.benchmark._legacy import (benchmark, compute_comparison_speed,
+                                        print_comparison_header,
+                                        solver_benchmark, some_filters)
+from anonlink.benchmark._runner import (compare_results, load_report,
+                                        print_comparisons, run_benchmarks)
+from anonlink.benchmark._scenarios import SCENARIOS, Scenario, scenario, sweep
@@ -0,0 +1,105 @@
+"""Command line of the benchmarks.
+
+    python -m anonlink.benchmark
+    python -m anonlink.benchmark solvers [output.json]
+    python -m anonlink.benchmark list
+    python -m anonlink.benchmark run [options] [scenario ...]
+    python -m anonlink.benchmark compare baseline.json current.json
+"""
+
+import argparse
+import json
+import sys
+
+from anonlink.benchmark._legacy import benchmark, solver_benchmark
+from anonlink.benchmark._runner import (compare_results, load_report,
+                                        print_comparisons, run_benchmarks)
+from anonlink.benchmark._scenarios import SCENARIOS
+
+
+def _param(argument):
+    # name=value,value,... with every value parsed as JSON if possible.
+    name, sep, values = argument.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(
+            f'expected name=value[,value...] (got {argument!r})')
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(json.loads(value))
+        except ValueError:
+            parsed.append(value)
+    return name, parsed
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m anonlink.benchmark',
+        description='Benchmark anonlink. Without a command, print the '
+                    'comparison throughput tables.')
+    commands = parser.add_subparsers(dest='command')
+
+    solvers = commands.add_parser(
+        'solvers', help='time the solvers on synthetic candidate graphs')
+    solvers.add_argument('output', nargs='?',
+                         help='file to write the results to as JSON '
+                              '(default stdout)')
+
+    commands.add_parser('list', help='list the scenarios')
+
+    run = commands.add_parser(
+        'run', help='run scenarios over their sweeps of parameters')
+    run.add_argument('scenarios', nargs='*', metavar='scenario',
+                     help='scenarios to run (default all)')
+    run.add_argument('-p', '--param', action='append', type=_param,
+                     default=[], metavar='NAME=VALUE[,VALUE...]',
+                     help='values to sweep a parameter over instead')
+    run.add_argument('-q', '--quick', action='store_true',
+                     help='sweep over small values only')
+    run.add_argument('-r', '--repeat', type=int, default=5,
+                     help='timed runs of every benchmark (default 5)')
+    run.add_argument('-w', '--warmup', type=int, default=1,
+                     help='untimed runs before the timed ones (default 1)')
+    run.add_argument('--seed', type=int, default=0,
+                     help='seed for generating the data (default 0)')
+    run.add_argument('-o', '--output',
+                     help='file to write the report to as JSON')
+
+    compare = commands.add_parser(
+        'compare',
+        help='compare two reports; fail if the current one regressed')
+    compare.add_argument('baseline', help='report to compare against')
+    compare.add_argument('current', help='report to compare')
+    compare.add_argument('-t', '--tolerance', type=float, default=.1,
+                         help='proportion by which a time may exceed its '
+                              'baseline (default 0.1)')
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    if args.command is None:
+        benchmark(4000)
+    elif args.command == 'solvers':
+        solver_benchmark(output=args.output or sys.stdout)
+    elif args.command == 'list':
+        for name, scenario in SCENARIOS.items():
+            params = ', '.join(scenario.params)
+            print(f'{name}: {scenario.description} ({params})')
+    elif args.command == 'run':
+        run_benchmarks(args.scenarios or None, params=dict(args.param),
+                       repeat=args.repeat, warmup=args.warmup,
+                       quick=args.quick, seed=args.seed,
+                       output=args.output, log=sys.stderr)
+    elif args.command == 'compare':
+        comparisons = compare_results(load_report(args.baseline),
+                                      load_report(args.current),
+                                      tolerance=args.tolerance)
+        print_comparisons(comparisons)
+        if any(comparison['regression'] for comparison in comparisons):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Synthetic data to benchmark with."""
+
+import itertools
+import os
+from array import array
+
+import bitarray
+import numpy as np
+
+
+def generate_random_bitarrays(length=1024, *, seed=None):
+    """Generate random bitarrays forever.
+
+    :param length: The number of bits of every bitarray. A multiple of
+        8.
+    :param seed: Seed for the random number generator. Default None
+        (use `os.urandom`).
+    """
+    rng = None if seed is None else np.random.default_rng(seed)
+    while True:
+        a = bitarray.bitarray()
+        if rng is None:
+            a.frombytes(os.urandom(length//8))
+        else:
+            a.frombytes(rng.bytes(length//8))
+        yield a
+
+
+def generate_random_clks(count, length=1024, *, seed=None):
+    return tuple(itertools.islice(
+        generate_random_bitarrays(length, seed=seed), count))
+
+
+def generate_candidate_graph(entities, parties=2, *,
+                             presence=.8, sparsity=.1, noise=.5,
+                             threshold=.5, seed=None):
+    """Generate candidate pairs resembling those of a real linkage.
+
+    Each entity is present in every dataset with probability `presence`,
+    giving groups of records of varying size. Pairs of records within a
+    group are candidate pairs, with high similarity, except that a
+    proportion `sparsity` of them is missing. On top of those, noise
+    edges join random records of different datasets with similarities
+    just above `threshold`.
+
+    :param entities: The number of entities.
+    :param parties: The number of datasets.
+    :param presence: The probability that an entity has a record in any
+        given dataset.
+    :param sparsity: The proportion of pairs within a group that are not
+        candidate pairs.
+    :param noise: The number of noise edges per record.
+    :param threshold: The lowest similarity of any candidate pair.
+    :param seed: Seed for the random number generator.
+
+    :return: Candidate pairs, sorted like those returned by
+        `find_candidate_pairs`.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Record indices are assigned in order of entity in every dataset.
+    present = rng.random((entities, parties)) < presence
+    rec_is = np.cumsum(present, axis=0) - 1
+    dataset_sizes = present.sum(axis=0)
+
+    dset_is0 = []
+    dset_is1 = []
+    rec_is0 = []
+    rec_is1 = []
+    sims = []
+    for dset_i0, dset_i1 in itertools.combinations(range(parties), 2):
+        both = present[:, dset_i0] & present[:, dset_i1]
+        both &= rng.random(entities) >= sparsity
+        count = int(both.sum())
+        dset_is0.append(np.full(count, dset_i0))
+        dset_is1.append(np.full(count, dset_i1))
+        rec_is0.append(rec_is[both, dset_i0])
+        rec_is1.append(rec_is[both, dset_i1])
+        sims.append(rng.uniform(threshold + (1 - threshold) / 2, 1, count))
+
+    noise_count = int(noise * dataset_sizes.sum())
+    noise_dset_is = np.sort(np.stack([
+        rng.choice(parties, noise_count, replace=True) for _ in range(2)]),
+        axis=0)
+    different = noise_dset_is[0] != noise_dset_is[1]
+    noise_dset_is = noise_dset_is[:, different]
+    nonempty = dataset_sizes[noise_dset_is].min(axis=0) > 0
+    noise_dset_is = noise_dset_is[:, nonempty]
+    noise_rec_is = (rng.random(noise_dset_is.shape)
+                    * dataset_sizes[noise_dset_is]).astype(np.int64)
+    dset_is0.append(noise_dset_is[0])
+    dset_is1.append(noise_dset_is[1])
+    rec_is0.append(noise_rec_is[0])
+    rec_is1.append(noise_rec_is[1])
+    sims.append(rng.uniform(threshold, threshold + (1 - threshold) / 2,
+                            noise_dset_is.shape[1]))
+
+    dset_is0, dset_is1, rec_is0, rec_is1, sims = map(
+        np.concatenate, (dset_is0, dset_is1, rec_is0, rec_is1, sims))
+
+    # Noise may duplicate true edges. Keep the first occurrence.
+    keys = np.stack([dset_is0, dset_is1, rec_is0, rec_is1], axis=1)
+    _, first = np.unique(keys, axis=0, return_index=True)
+    order = first[np.lexsort((rec_is1[first], rec_is0[first],
+                              dset_is1[first], dset_is0[first],
+                              -sims[first]))]
+
+    def to_array(typecode, values):
+        return array(typecode, values[order].astype(typecode).tobytes())
+
+    return (to_array('d', sims),
+            (to_array('I', dset_is0), to_array('I', dset_is1)),
+            (to_array('I', rec_is0), to_array('I', rec_is1)))
@@ -0,0 +1,192 @@
+"""The benchmarks that print tables and time the solvers."""
+
+import concurrent.futures
+import itertools
+import json
+import random
+import os
+from timeit import default_timer as timer
+
+import anonlink
+from anonlink.tracing import _peak_rss_bytes, _reset_peak_rss
+from anonlink.benchmark._data import (generate_candidate_graph,
+                                      generate_random_clks)
+
+
+some_filters = generate_random_clks(10000)
+
+
+def print_comparison_header(headline):
+    print()
+    print(headline)
+    print("Size 1 | Size 2 | Comparisons      | Total Time (s)          | Throughput")
+    print("       |        |        (match %) | (comparisons / matching)|  (1e6 cmp/s)")
+    print("-------+--------+------------------+-------------------------+-------------")
+
+
+def compute_comparison_speed(n1, n2, threshold, k=None):
+    """
+    Using the greedy solver, how fast can hashes be computed using one core.
+    """
+
+    assert n1 != 0 and n2 != 0
+
+    filters1 = [some_filters[random.randrange(0, 8000)] for _ in range(n1)]
+    filters2 = [some_filters[random.randrange(2000, 10000)] for _ in range(n2)]
+
+    start = timer()
+    sparse_matrix = anonlink.candidate_generation.find_candidate_pairs(
+        (filters1, filters2),
+        anonlink.similarities.dice_coefficient,
+        threshold,
+        k=k
+    )
+    t1 = timer()
+    anonlink.solving.greedy_solve(sparse_matrix)
+    end = timer()
+
+    similarity_time = t1 - start
+    solver_time = end - t1
+    elapsed_time = end - start
+
+    inv_similarity_time = 1 / similarity_time if similarity_time > 0 else float('inf')
+    inv_elapsed_time = 1 / elapsed_time if elapsed_time > 0 else float('inf')
+
+    print("{:6d} | {:6d} | {:4d}e6  ({:5.2f}%) | {:6.3f}  ({:4.1f}% / {:4.1f}%) |  {:8.3f}".format(
+        n1, n2, n1*n2 // 1000000,
+        100.0*len(sparse_matrix[0])/(n1*n2),
+        elapsed_time,
+        100.0*similarity_time * inv_elapsed_time,
+        100.0*solver_time * inv_elapsed_time,
+        (n1*n2 / 1e6) * inv_similarity_time))
+    return elapsed_time
+
+
+def benchmark(size):
+
+    print("Anonlink benchmark -- see README for explanation")
+    print("------------------------------------------------")
+
+    print(f"using '{anonlink.solving.greedy_solve.__name__}' as solver and "
+          f"'{anonlink.similarities.dice_coefficient.__name__}' as similarity metric")
+
+    possible_test_sizes = [
+        1000, 2000, 3000, 4000,
+        5000, 6000, 7000, 8000, 9000,
+        10000,
+        20000, 30000, 40000, 50000, 60000, 70000, 80000, 90000,
+        1000000,
+        2000000
+    ]
+
+    thld = 0.5
+    print_comparison_header(f"Threshold: {thld}, All results returned")
+    for test_size in possible_test_sizes:
+        if test_size <= size:
+            compute_comparison_speed(test_size, test_size, thld, k=None)
+
+    size *= 5
+    thld = 0.5
+    print_comparison_header(f"Threshold: {thld}, Top 100 matches per record returned")
+    for test_size in possible_test_sizes:
+        if test_size <= size:
+            compute_comparison_speed(test_size, test_size, thld, k=100)
+
+    thld = 0.7
+    print_comparison_header(f"Threshold: {thld}, All results returned")
+    for test_size in possible_test_sizes:
+        if test_size <= size:
+            compute_comparison_speed(test_size, test_size, thld, k=None)
+
+    print_comparison_header(f"Threshold: {thld}, Top 100 matches per record returned")
+    for test_size in possible_test_sizes:
+        if test_size <= size:
+            compute_comparison_speed(test_size, test_size, thld, k=100)
+
+
+def _solvers(parties):
+    solvers = {
+        'greedy_solve_python': anonlink.solving.greedy_solve_python,
+        'probabilistic_greedy_solve_python':
+            anonlink.solving.probabilistic_greedy_solve_python,
+    }
+    try:
+        solvers['greedy_solve_native'] = anonlink.solving.greedy_solve_native
+        solvers['probabilistic_greedy_solve_native'] = \
+            anonlink.solving.probabilistic_greedy_solve_native
+    except AttributeError:
+        pass
+    if parties == 2:
+        solvers['bipartite_optimal_solve'] = \
+            anonlink.solving.bipartite_optimal_solve
+    return solvers
+
+
+def _time_solver(solver_name, candidates, parties, repeat):
+    solve = _solvers(parties)[solver_name]
+    baseline = _peak_rss_bytes()
+    _reset_peak_rss()
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        groups = solve(candidates)
+        times.append(timer() - start)
+    peak = _peak_rss_bytes()
+    return {
+        'seconds': min(times),
+        'groups': len(groups),
+        'peak_rss_bytes': peak,
+        'peak_rss_increase_bytes': (None if peak is None or baseline is None
+                                    else max(peak - baseline, 0)),
+    }
+
+
+def solver_benchmark(sizes=(10000, 100000), parties_options=(2, 3),
+                     *, noise=.5, sparsity=.1, repeat=3, solvers=None,
+                     seed=0, output=None):
+    """Time every solver on synthetic candidate graphs.
+
+    Every solver runs in a fresh process so its peak memory usage is
+    not hidden by earlier runs. The time reported is the best of
+    `repeat` runs.
+
+    :param sizes: Numbers of entities to generate graphs for.
+    :param parties_options: Numbers of datasets to generate graphs for.
+    :param noise: Noise edges per record, as in
+        `generate_candidate_graph`.
+    :param sparsity: Proportion of missing pairs within groups, as in
+        `generate_candidate_graph`.
+    :param repeat: The number of times to run every solver.
+    :param solvers: Names of the solvers to run. Default all.
+    :param seed: Seed for generating the graphs.
+    :param output: A path or a text file to write the results to as
+        JSON. Default None (do not write).
+
+    :return: A list of results, one for every solver and graph.
+    """
+    results = []
+    for parties, size in itertools.product(parties_options, sizes):
+        candidates = generate_candidate_graph(
+            size, parties, noise=noise, sparsity=sparsity, seed=seed)
+        candidates_n = len(candidates[0])
+        for solver_name in _solvers(parties):
+            if solvers is not None and solver_name not in solvers:
+                continue
+            with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                result = executor.submit(_time_solver, solver_name,
+                                         candidates, parties, repeat).result()
+            seconds = result['seconds']
+            result.update(
+                solver=solver_name, entities=size, parties=parties,
+                noise=noise, sparsity=sparsity, candidates=candidates_n,
+                candidates_per_second=(candidates_n / seconds if seconds
+                                       else float('inf')))
+            results.append(result)
+
+    if output is not None:
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, 'w') as f:
+                json.dump(results, f, indent=2)
+        else:
+            json.dump(results, output, indent=2)
+    return results
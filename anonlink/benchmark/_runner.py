@@ -0,0 +1,207 @@
+"""Running scenarios and comparing their results between versions."""
+
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from timeit import default_timer as timer
+
+import anonlink
+from anonlink.benchmark._scenarios import SCENARIOS, sweep
+
+
+def _native():
+    try:
+        from anonlink.similarities import _dice  # noqa: F401
+        from anonlink.solving import _multiparty_solving  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _time(run, repeat, warmup):
+    for _ in range(warmup):
+        run()
+    # Like timeit, keep the garbage collector from interrupting runs.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        seconds = []
+        for _ in range(repeat):
+            start = timer()
+            items = run()
+            seconds.append(timer() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return seconds, items
+
+
+def _write_json(report, output):
+    if isinstance(output, (str, os.PathLike)):
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, output, indent=2)
+
+
+def run_benchmarks(scenarios=None, *, params=None, repeat=5, warmup=1,
+                   quick=False, seed=0, output=None, log=None):
+    """Run scenarios over their sweeps of parameters.
+
+    Every combination of parameters is set up once, run `warmup` times
+    untimed, then timed `repeat` times.
+
+    :param scenarios: Names of the scenarios to run. Default all.
+    :param params: A dictionary mapping names of parameters to the
+        sequences of values to sweep over instead of the scenarios'
+        own. Scenarios without the parameter ignore it.
+    :param repeat: The number of timed runs.
+    :param warmup: The number of untimed runs before the timed ones.
+    :param quick: Whether to sweep over the small values meant for a
+        quick run instead.
+    :param seed: Seed for generating the data.
+    :param output: A path or a text file to write the report to as
+        JSON. Default None (do not write).
+    :param log: A text file to write a line to after every result.
+        Default None (do not write).
+
+    :return: The report, a dictionary with the keys 'anonlink_version',
+        'python_version', 'platform', 'native' (whether the native
+        extensions are available), 'timestamp', 'repeat', 'warmup' and
+        'results'. The results are dictionaries with the keys
+        'scenario', 'params', 'seconds' (of every timed run), 'best',
+        'median', 'items' (processed in one run) and 'items_per_second'
+        (in the best run).
+    """
+    if repeat < 1:
+        raise ValueError(f'repeat must be positive (got {repeat})')
+    if scenarios is None:
+        scenarios = list(SCENARIOS)
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise ValueError(f'unknown scenarios: {", ".join(unknown)}')
+
+    results = []
+    for name in scenarios:
+        registered = SCENARIOS[name]
+        sweep_params = dict(registered.quick_params if quick
+                            else registered.params)
+        for param, values in (params or {}).items():
+            if param in sweep_params:
+                sweep_params[param] = values
+        for scenario_params in sweep(sweep_params):
+            run = registered.setup(seed=seed, **scenario_params)
+            if run is None:
+                continue
+            seconds, items = _time(run, repeat, warmup)
+            best = min(seconds)
+            result = {
+                'scenario': name,
+                'params': scenario_params,
+                'seconds': seconds,
+                'best': best,
+                'median': statistics.median(seconds),
+                'items': items,
+                'items_per_second': items / best if best else float('inf'),
+            }
+            results.append(result)
+            if log is not None:
+                print(f'{name} {json.dumps(scenario_params)}: '
+                      f'{best:.6f} s, {result["items_per_second"]:.4g} '
+                      f'items/s', file=log)
+
+    report = {
+        'anonlink_version': anonlink.__version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'native': _native(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': repeat,
+        'warmup': warmup,
+        'results': results,
+    }
+    if output is not None:
+        _write_json(report, output)
+    return report
+
+
+def _result_key(result):
+    return result['scenario'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare_results(baseline, current, *, tolerance=.1):
+    """Compare the results of two reports of `run_benchmarks`.
+
+    Results are matched by scenario and parameters, and compared by
+    their best time. Results in only one of the reports are left out.
+
+    :param baseline: The report to compare against, e.g., of the last
+        release.
+    :param current: The report to compare.
+    :param tolerance: The proportion by which the current time may
+        exceed the baseline's before it is a regression.
+
+    :return: A list of comparisons, dictionaries with the keys
+        'scenario', 'params', 'baseline' and 'current' (the best
+        times), 'ratio' (of the current time to the baseline's) and
+        'regression'.
+    """
+    baseline_results = {_result_key(result): result
+                        for result in baseline['results']}
+    comparisons = []
+    for result in current['results']:
+        baseline_result = baseline_results.get(_result_key(result))
+        if baseline_result is None:
+            continue
+        before = baseline_result['best']
+        after = result['best']
+        ratio = after / before if before else float('inf')
+        comparisons.append({
+            'scenario': result['scenario'],
+            'params': result['params'],
+            'baseline': before,
+            'current': after,
+            'ratio': ratio,
+            'regression': ratio > 1 + tolerance,
+        })
+    return comparisons
+
+
+def load_report(f):
+    """Load a report written by `run_benchmarks`.
+
+    :param f: A path or a text file.
+
+    :return: The report.
+    """
+    if isinstance(f, (str, os.PathLike)):
+        with open(f) as f:
+            return json.load(f)
+    return json.load(f)
+
+
+def print_comparisons(comparisons, file=None):
+    """Print comparisons made by `compare_results` as a table.
+
+    :param comparisons: The comparisons.
+    :param file: The text file to print to. Default stdout.
+    """
+    if file is None:
+        file = sys.stdout
+    print('Scenario               | Baseline (s) | Current (s) | Ratio  '
+          '| Parameters', file=file)
+    print('-----------------------+--------------+-------------+--------'
+          '+-----------', file=file)
+    for comparison in comparisons:
+        print('{:22s} | {:12.6f} | {:11.6f} | {:5.2f}{} | {}'.format(
+                comparison['scenario'],
+                comparison['baseline'],
+                comparison['current'],
+                comparison['ratio'],
+                '!' if comparison['regression'] else ' ',
+                json.dumps(comparison['params'], sort_keys=True)),
+              file=file)
@@ -0,0 +1,323 @@
+"""The benchmark scenarios.
+
+A scenario is a function that sets up one benchmark from keyword
+parameters and returns a callable with no arguments. The callable runs
+the code being benchmarked once and returns the number of items it
+processed; only the callable is timed. A scenario may return None
+instead, when the combination of parameters does not apply. Scenarios
+are registered with the `scenario` decorator, together with the values
+of their parameters to sweep over.
+"""
+
+import array as _array
+import io as _io
+import itertools as _itertools
+import typing as _typing
+
+import anonlink
+from anonlink.benchmark._data import (generate_candidate_graph,
+                                      generate_random_clks)
+from anonlink.benchmark._legacy import _solvers
+
+try:
+    from anonlink.similarities import _dice
+except ImportError:
+    _dice = None  # type: ignore
+
+Params = _typing.Dict[str, _typing.Any]
+Setup = _typing.Callable[
+    ..., _typing.Optional[_typing.Callable[[], int]]]
+
+
+class Scenario(_typing.NamedTuple):
+    """A registered scenario.
+
+    :ivar name: The name of the scenario.
+    :ivar setup: The function that sets up the benchmark. It accepts the
+        parameters and `seed` as keyword arguments.
+    :ivar params: A dictionary mapping the name of every parameter to
+        the sequence of values to sweep over.
+    :ivar quick_params: The values to sweep over for a quick run.
+    :ivar description: A one-line description.
+    """
+    name: str
+    setup: Setup
+    params: _typing.Dict[str, _typing.Sequence[_typing.Any]]
+    quick_params: _typing.Dict[str, _typing.Sequence[_typing.Any]]
+    description: str
+
+
+SCENARIOS: _typing.Dict[str, Scenario] = {}
+
+
+def scenario(
+    name: str,
+    *,
+    params: _typing.Dict[str, _typing.Sequence[_typing.Any]],
+    quick_params: _typing.Optional[
+        _typing.Dict[str, _typing.Sequence[_typing.Any]]] = None
+) -> _typing.Callable[[Setup], Setup]:
+    """Register a scenario.
+
+    Use as a decorator of the function that sets up the benchmark. The
+    first line of its docstring is the description of the scenario.
+
+    :param name: The name of the scenario. A scenario registered with
+        the same name is replaced.
+    :param params: A dictionary mapping the name of every parameter to
+        the sequence of values to sweep over. Every combination of
+        values is benchmarked.
+    :param quick_params: The values to sweep over for a quick run.
+        Parameters missing from it take their first value in `params`.
+
+    :return: The decorator.
+    """
+    def register(setup: Setup) -> Setup:
+        quick = {param: values[:1] for param, values in params.items()}
+        quick.update(quick_params or {})
+        description = (setup.__doc__ or '').strip().split('\n')[0]
+        SCENARIOS[name] = Scenario(name, setup, params, quick, description)
+        return setup
+    return register
+
+
+def sweep(
+    params: _typing.Dict[str, _typing.Sequence[_typing.Any]]
+) -> _typing.List[Params]:
+    """Every combination of the values of the parameters.
+
+    :param params: A dictionary mapping the name of every parameter to
+        the sequence of its values.
+
+    :return: A list of dictionaries mapping the name of every parameter
+        to one of its values.
+    """
+    names = list(params)
+    return [dict(zip(names, values))
+            for values in _itertools.product(*params.values())]
+
+
+def _datasets(sizes, length, seed):
+    return [generate_random_clks(size, length, seed=(seed, i))
+            for i, size in enumerate(sizes)]
+
+
+def _chunk_results(datasets, threshold, chunks):
+    sizes = [len(dataset) for dataset in datasets]
+    chunk_size_aim = sizes[0] * sizes[1] / chunks
+    return [anonlink.concurrency.process_chunk(
+                chunk,
+                [datasets[c['datasetIndex']][slice(*c['range'])]
+                 for c in chunk],
+                anonlink.similarities.dice_coefficient, threshold)
+            for chunk in anonlink.concurrency.split_to_chunks(
+                chunk_size_aim, dataset_sizes=sizes)]
+
+
+def _packed(records):
+    # The native kernels take records as contiguous signed chars.
+    data = _array.array('b')
+    data.frombytes(b''.join(memoryview(record) for record in records))
+    return data
+
+
+def _dump(candidate_pairs):
+    f = _io.BytesIO()
+    anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+    return f.getvalue()
+
+
+if _dice is not None:
+    @scenario('popcount',
+              params={'length': [512, 1024, 2048],
+                      'size': [10000, 100000]},
+              quick_params={'length': [1024], 'size': [1000]})
+    def popcount(*, length, size, seed):
+        """Popcounts of packed records with the native kernel."""
+        data = _packed(generate_random_clks(size, length, seed=seed))
+
+        def run():
+            _dice.popcount_arrays(data, length // 8)
+            return size
+        return run
+
+    @scenario('dice_one_to_many',
+              params={'length': [512, 1024, 2048],
+                      'threshold': [.5, .7, .9],
+                      'k': [None, 10],
+                      'size': [10000, 100000]},
+              quick_params={'threshold': [.7], 'size': [1000]})
+    def dice_one_to_many(*, length, threshold, k, size, seed):
+        """One record against many with the native Dice kernel."""
+        one, *many = generate_random_clks(size + 1, length, seed=seed)
+        one = _packed([one])
+        many = _packed(many)
+        popcounts = _dice.popcount_arrays(many, length // 8)
+        k = size if k is None else k
+        indices = _array.array('I', bytes(4 * k))
+        scores = _array.array('d', bytes(8 * k))
+
+        def run():
+            _dice.match_one_to_many_dice_preallocated_output(
+                one, many, popcounts, size, length // 8, k, threshold,
+                indices, scores)
+            return size
+        return run
+
+
+@scenario('dice_many_to_many',
+          params={'length': [512, 1024, 2048],
+                  'threshold': [.5, .7, .9],
+                  'k': [None, 10],
+                  'size': [1000, 4000]},
+          quick_params={'threshold': [.7], 'size': [100]})
+def dice_many_to_many(*, length, threshold, k, size, seed):
+    """Two datasets with the fastest Dice coefficient similarity."""
+    datasets = _datasets((size, size), length, seed)
+
+    def run():
+        anonlink.similarities.dice_coefficient(datasets, threshold, k)
+        return size * size
+    return run
+
+
+@scenario('blocking',
+          params={'g': [4, 16],
+                  'r': [4, 8],
+                  'threshold': [.7],
+                  'size': [1000, 4000]},
+          quick_params={'size': [100]})
+def blocking(*, g, r, threshold, size, seed):
+    """Candidate generation with bit blocking."""
+    datasets = _datasets((size, size), 1024, seed)
+    blocking_f = anonlink.blocking.bit_blocking(g, r, seed=seed)
+
+    def run():
+        anonlink.candidate_generation.find_candidate_pairs(
+            datasets, anonlink.similarities.dice_coefficient, threshold,
+            blocking_f=blocking_f)
+        return size * size
+    return run
+
+
+@scenario('merge_candidate_pairs',
+          params={'chunks': [4, 16],
+                  'threshold': [.5, .7],
+                  'size': [1000, 2000]},
+          quick_params={'size': [100]})
+def merge_candidate_pairs(*, chunks, threshold, size, seed):
+    """Merging the candidate pairs of chunks in memory."""
+    results = _chunk_results(_datasets((size, size), 1024, seed),
+                             threshold, chunks)
+    candidates = sum(len(result[0]) for result in results)
+
+    def run():
+        anonlink.concurrency.merge_candidate_pairs(results)
+        return candidates
+    return run
+
+
+@scenario('serialization_dump',
+          params={'entities': [10000, 100000]},
+          quick_params={'entities': [100]})
+def serialization_dump(*, entities, seed):
+    """Dumping candidate pairs to a file."""
+    candidate_pairs = generate_candidate_graph(entities, seed=seed)
+
+    def run():
+        anonlink.serialization.dump_candidate_pairs(
+            candidate_pairs, _io.BytesIO())
+        return len(candidate_pairs[0])
+    return run
+
+
+@scenario('serialization_load',
+          params={'entities': [10000, 100000]},
+          quick_params={'entities': [100]})
+def serialization_load(*, entities, seed):
+    """Loading candidate pairs from a file."""
+    candidate_pairs = generate_candidate_graph(entities, seed=seed)
+    dump = _dump(candidate_pairs)
+
+    def run():
+        anonlink.serialization.load_candidate_pairs(_io.BytesIO(dump))
+        return len(candidate_pairs[0])
+    return run
+
+
+@scenario('serialization_merge',
+          params={'chunks': [4, 16],
+                  'threshold': [.5, .7],
+                  'size': [1000, 2000]},
+          quick_params={'size': [100]})
+def serialization_merge(*, chunks, threshold, size, seed):
+    """Merging files of the candidate pairs of chunks."""
+    results = _chunk_results(_datasets((size, size), 1024, seed),
+                             threshold, chunks)
+    dumps = list(map(_dump, results))
+    candidates = sum(len(result[0]) for result in results)
+
+    def run():
+        anonlink.serialization.merge_streams(
+            list(map(_io.BytesIO, dumps)), _io.BytesIO())
+        return candidates
+    return run
+
+
+@scenario('solve',
+          params={'solver': sorted(_solvers(2)),
+                  'parties': [2, 3],
+                  'entities': [10000, 100000]},
+          quick_params={'solver': sorted(_solvers(2)),
+                        'entities': [100]})
+def solve(*, solver, parties, entities, seed):
+    """A solver on a synthetic candidate graph."""
+    solvers = _solvers(parties)
+    if solver not in solvers:
+        return None
+    solve_f = solvers[solver]
+    candidate_pairs = generate_candidate_graph(entities, parties, seed=seed)
+
+    def run():
+        solve_f(candidate_pairs)
+        return len(candidate_pairs[0])
+    return run
+
+
+_STATS_FUNCTIONS = {
+    'similarities_hist': anonlink.stats.similarities_hist,
+    'matches_nonmatches_hist': anonlink.stats.matches_nonmatches_hist,
+    'cumul_number_matches_vs_threshold':
+        anonlink.stats.cumul_number_matches_vs_threshold,
+    'nonmatch_index_score': anonlink.stats.nonmatch_index_score,
+}
+
+
+@scenario('stats',
+          params={'function': sorted(_STATS_FUNCTIONS),
+                  'entities': [10000, 100000]},
+          quick_params={'function': sorted(_STATS_FUNCTIONS),
+                        'entities': [100]})
+def stats(*, function, entities, seed):
+    """A statistic of two-party candidate pairs."""
+    stats_f = _STATS_FUNCTIONS[function]
+    candidate_pairs = generate_candidate_graph(entities, seed=seed)
+
+    def run():
+        stats_f(candidate_pairs)
+        return len(candidate_pairs[0])
+    return run
+
+
+@scenario('popcount_profile',
+          params={'length': [512, 1024, 2048],
+                  'size': [10000, 100000]},
+          quick_params={'length': [1024], 'size': [1000]})
+def popcount_profile(*, length, size, seed):
+    """Profiling the popcounts and bits of a dataset."""
+    dataset = generate_random_clks(size, length, seed=seed)
+
+    def run():
+        anonlink.stats.popcount_profile(dataset)
+        return size
+    return run
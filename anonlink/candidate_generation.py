@@ -6,6 +6,7 @@ import heapq as _heapq
 import itertools as _itertools
 import typing as _typing
 
+import anonlink.tracing as _tracing
 import anonlink.typechecking as _typechecking
 
 _Block = _typing.Tuple[_typing.List[int], ...]
@@ -135,19 +136,27 @@ def find_candidate_pairs(
             return None,
     assert blocking_f is not None  # This is for Mypy.
 
-    blocks: _typing.DefaultDict[_typing.Hashable, _Block] \
-        = _collections.defaultdict(lambda: tuple([] for _ in datasets))
-    for i, dataset in enumerate(datasets):
-        for j, record in enumerate(dataset):
-            for block_id in blocking_f(i, j, record):
-                blocks[block_id][i].append(j)
-
-    similarities = tuple(_itertools.chain.from_iterable(
-        map(_block_similarities,
-            blocks.values(),
-            _itertools.repeat(datasets),
-            _itertools.repeat(similarity_f),
-            _itertools.repeat(threshold),
-            _itertools.repeat(k))))
-
-    return _merge_similarities(similarities, k)
+    with _tracing.stage('find_candidate_pairs', threshold=threshold,
+                        k=k) as span:
+        blocks: _typing.DefaultDict[_typing.Hashable, _Block] \
+            = _collections.defaultdict(lambda: tuple([] for _ in datasets))
+        with _tracing.stage('blocking') as blocking_span:
+            for i, dataset in enumerate(datasets):
+                for j, record in enumerate(dataset):
+                    for block_id in blocking_f(i, j, record):
+                        blocks[block_id][i].append(j)
+            blocking_span.items = len(blocks)
+
+        with _tracing.stage('similarity'):
+            similarities = tuple(_itertools.chain.from_iterable(
+                map(_block_similarities,
+                    blocks.values(),
+                    _itertools.repeat(datasets),
+                    _itertools.repeat(similarity_f),
+                    _itertools.repeat(threshold),
+                    _itertools.repeat(k))))
+
+        with _tracing.stage('merging') as merging_span:
+            candidate_pairs = _merge_similarities(similarities, k)
+            merging_span.items = span.items = len(candidate_pairs[0])
+        return candidate_pairs
@@ -0,0 +1,14 @@
+"""Helpers for concurrency."""
+
+from anonlink.concurrency._asyncio import (
+    find_candidate_pairs_async, process_chunk_async, process_chunks_async)
+from anonlink.concurrency._chunking import (
+    default_cache_budget, detect_cache_sizes, process_chunk, split_to_chunks,
+    split_to_chunks_by_cost)
+from anonlink.concurrency._checkpoint import ChunkManifest, run_resumable
+from anonlink.concurrency._merging import merge_candidate_pairs
+from anonlink.concurrency._parallel import run_parallel
+from anonlink.concurrency._planning import plan_chunks
+from anonlink.concurrency._scheduling import WorkStealingScheduler
+from anonlink.concurrency._shared import SharedDatasets
+from anonlink.concurrency._spilling import process_chunk_to_file
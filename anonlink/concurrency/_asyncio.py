@@ -0,0 +1,172 @@
+"""Processing chunks from asyncio without blocking the event loop."""
+
+import asyncio as _asyncio
+import concurrent.futures as _futures
+import functools as _functools
+import os as _os
+import typing as _typing
+
+import anonlink.typechecking as _typechecking
+from anonlink.candidate_generation import find_candidate_pairs
+from anonlink.concurrency._chunking import _chunk_datasets, process_chunk
+
+
+async def process_chunk_async(
+    chunk: _typechecking.ChunkInfo,
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None,
+    *,
+    executor: _typing.Optional[_futures.Executor] = None
+) -> _typechecking.CandidatePairs:
+    """Find candidate pairs for the chunk in an executor.
+
+    This is `process_chunk`, run with `loop.run_in_executor` so that the
+    event loop is free while the chunk is processed. If the coroutine is
+    cancelled before the chunk has started, it is never processed.
+
+    :param chunk: Chunk to process, as in `process_chunk`.
+    :param datasets: A sequence of datasets, one for every dataset in
+        `chunk`, as in `process_chunk`.
+    :param similarity_f: A function that computes a similarity matrix
+        between two sequences of hashes and finds candidates above the
+        threshold.
+    :param threshold: The similarity threshold. We accept pairs that
+        have similarity of at least this value.
+    :param k: Only permit this many candidate pairs per dataset pair per
+        record. Set to `None` to permit all pairs above with similarity
+        at least `threshold`.
+    :param blocking_f: A function returning all block IDs for a record,
+        as in `process_chunk`.
+    :param executor: The `concurrent.futures.Executor` to process the
+        chunk on. With a `ProcessPoolExecutor`, all arguments must be
+        picklable. Default None (the event loop's default executor).
+
+    :return: The candidate pairs, as returned by `process_chunk`.
+    """
+    loop = _asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        _functools.partial(process_chunk, chunk, datasets, similarity_f,
+                           threshold, k=k, blocking_f=blocking_f))
+
+
+async def find_candidate_pairs_async(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None,
+    *,
+    executor: _typing.Optional[_futures.Executor] = None
+) -> _typechecking.CandidatePairs:
+    """Find candidate pairs of multiple datasets in an executor.
+
+    This is `find_candidate_pairs`, run with `loop.run_in_executor` so
+    that the event loop is free while the datasets are compared.
+
+    :param datasets: A sequence of datasets, as in
+        `find_candidate_pairs`.
+    :param similarity_f: A function that computes a similarity matrix
+        between two sequences of hashes and finds candidates above the
+        threshold.
+    :param threshold: The similarity threshold. We accept pairs that
+        have similarity of at least this value.
+    :param k: Only permit this many candidate pairs per dataset pair per
+        record. Set to `None` to permit all pairs above with similarity
+        at least `threshold`.
+    :param blocking_f: A function returning all block IDs for a record,
+        as in `find_candidate_pairs`.
+    :param executor: The `concurrent.futures.Executor` to run on, as in
+        `process_chunk_async`.
+
+    :return: The candidate pairs, as returned by `find_candidate_pairs`.
+    """
+    loop = _asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        _functools.partial(find_candidate_pairs, datasets, similarity_f,
+                           threshold, k=k, blocking_f=blocking_f))
+
+
+async def process_chunks_async(
+    chunks: _typing.Iterable[_typechecking.ChunkInfo],
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None,
+    *,
+    executor: _typing.Optional[_futures.Executor] = None,
+    max_in_flight: _typing.Optional[int] = None
+) -> _typing.AsyncIterator[
+        _typing.Tuple[_typechecking.ChunkInfo, _typechecking.CandidatePairs]]:
+    """Process chunks in an executor, yielding results as they complete.
+
+    At most `max_in_flight` chunks are submitted to the executor or
+    waiting to be consumed at any time. A new chunk is only submitted
+    once a result has been taken, so a slow consumer holds back the
+    processing and the results never pile up in memory. `chunks` may
+    be a lazy iterable.
+
+    Closing the generator, or cancelling the task consuming it, cancels
+    the chunks that have not started.
+
+    The results of all chunks may be merged with
+    `merge_candidate_pairs`.
+
+    :param chunks: The chunks to process, as returned by
+        `split_to_chunks`.
+    :param datasets: A sequence of whole datasets. Every chunk is
+        processed with the records that it covers.
+    :param similarity_f: A function that computes a similarity matrix
+        between two sequences of hashes and finds candidates above the
+        threshold.
+    :param threshold: The similarity threshold. We accept pairs that
+        have similarity of at least this value.
+    :param k: Only permit this many candidate pairs per dataset pair per
+        record. Set to `None` to permit all pairs above with similarity
+        at least `threshold`.
+    :param blocking_f: A function returning all block IDs for a record,
+        as in `process_chunk`.
+    :param executor: The `concurrent.futures.Executor` to run on, as in
+        `process_chunk_async`.
+    :param max_in_flight: The maximum number of chunks that are being
+        processed or whose results have not been consumed. Default the
+        number of CPUs.
+
+    :return: An asynchronous iterator of two-tuples of chunk and its
+        candidate pairs, in order of completion.
+    """
+    if max_in_flight is None:
+        max_in_flight = _os.cpu_count() or 1
+    if max_in_flight < 1:
+        raise ValueError(
+            f'max_in_flight must be positive (got {max_in_flight})')
+
+    chunks_iter = iter(chunks)
+    pending: _typing.Dict[_asyncio.Future, _typechecking.ChunkInfo] = {}
+
+    def submit() -> None:
+        chunk = next(chunks_iter, None)
+        if chunk is not None:
+            task = _asyncio.ensure_future(process_chunk_async(
+                chunk, _chunk_datasets(chunk, datasets), similarity_f,
+                threshold, k=k, blocking_f=blocking_f, executor=executor))
+            pending[task] = chunk
+
+    try:
+        for _ in range(max_in_flight):
+            submit()
+        while pending:
+            done, _ = await _asyncio.wait(
+                pending, return_when=_asyncio.FIRST_COMPLETED)
+            for task in done:
+                chunk = pending.pop(task)
+                yield chunk, task.result()
+                submit()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,292 @@
+"""Checkpointing chunked runs so that they can be resumed."""
+
+import concurrent.futures as _futures
+import contextlib as _contextlib
+import io as _io
+import json as _json
+import os as _os
+import tempfile as _tempfile
+import typing as _typing
+
+import anonlink.serialization as _serialization
+import anonlink.typechecking as _typechecking
+from anonlink.concurrency._chunking import (
+    _chunk_datasets, process_chunk, split_to_chunks)
+from anonlink.concurrency._parallel import _split_rows_to_chunks
+from anonlink.concurrency._spilling import _merge_files
+
+_MANIFEST_NAME = 'manifest.json'
+_COMPLETED_NAME = 'completed.log'
+_MANIFEST_VERSION = 2
+
+
+def _write_atomically(path: str, data: bytes) -> None:
+    # Write to a temporary file in the same directory and rename it
+    # over the destination, so a crash never leaves a partial file.
+    directory, name = _os.path.split(path)
+    fd, temp_path = _tempfile.mkstemp(prefix=f'.{name}.', dir=directory)
+    try:
+        with open(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            _os.fsync(f.fileno())
+        _os.replace(temp_path, path)
+    except BaseException:
+        _os.remove(temp_path)
+        raise
+
+
+def _read_completed(path: str) -> _typing.Tuple[_typing.Dict[int, str], int]:
+    # The result file of every completed chunk, and the number of bytes
+    # of the log that hold whole entries. A crash while appending leaves
+    # a partial last line, which is ignored.
+    completed: _typing.Dict[int, str] = {}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return completed, 0
+    size = data.rfind(b'\n') + 1
+    for line in data[:size].splitlines():
+        entry = _json.loads(line)
+        completed[entry['chunk']] = entry['file']
+    return completed, size
+
+
+class ChunkManifest:
+    """A record of the progress of a chunked run, kept in a directory.
+
+    The directory holds `manifest.json`, `completed.log` and one result
+    file per completed chunk, in the `anonlink.serialization` format.
+    The manifest lists the parameters of the run and all of its chunks,
+    and is written once. The log has one line per completed chunk with
+    the name of its result file. Result files are written atomically
+    before their line is appended, so a run that is interrupted at any
+    point resumes from its last completed chunk.
+
+    Create a new manifest with `ChunkManifest.create` and open an
+    existing one with `ChunkManifest.open`.
+    """
+
+    def __init__(self, directory: str,
+                 manifest: _typing.Dict[str, _typing.Any]) -> None:
+        self.directory = directory
+        self._manifest = manifest
+        self._completed, self._completed_size = _read_completed(
+            _os.path.join(directory, _COMPLETED_NAME))
+
+    @classmethod
+    def create(
+        cls,
+        directory: str,
+        chunks: _typing.Iterable[_typechecking.ChunkInfo],
+        *,
+        threshold: float,
+        k: _typing.Optional[int] = None,
+        dataset_sizes: _typing.Optional[_typing.Sequence[int]] = None
+    ) -> 'ChunkManifest':
+        """Start a new run in a directory.
+
+        :param directory: The directory to keep the manifest and result
+            files in. It is created if it does not exist.
+        :param chunks: All chunks of the run.
+        :param threshold: The similarity threshold of the run.
+        :param k: The `k` of the run, or None.
+        :param dataset_sizes: The sizes of the datasets, if known. They
+            are checked when the run is resumed.
+
+        :return: The manifest, with no completed chunks.
+        """
+        _os.makedirs(directory, exist_ok=True)
+        if _os.path.exists(_os.path.join(directory, _MANIFEST_NAME)):
+            raise FileExistsError(
+                f'a manifest already exists in {directory!r}')
+        # A log left over from an earlier run does not belong to this one.
+        with _contextlib.suppress(FileNotFoundError):
+            _os.remove(_os.path.join(directory, _COMPLETED_NAME))
+        manifest = {
+            'version': _MANIFEST_VERSION,
+            'threshold': threshold,
+            'k': k,
+            'datasetSizes': (None if dataset_sizes is None
+                             else list(map(int, dataset_sizes))),
+            'chunks': list(chunks)}
+        _write_atomically(_os.path.join(directory, _MANIFEST_NAME),
+                          _json.dumps(manifest).encode())
+        return cls(directory, manifest)
+
+    @classmethod
+    def open(cls, directory: str) -> 'ChunkManifest':
+        """Open the manifest of an existing run.
+
+        :param directory: The directory of the run.
+
+        :return: The manifest.
+        """
+        with open(_os.path.join(directory, _MANIFEST_NAME), 'rb') as f:
+            manifest = _json.load(f)
+        if manifest.get('version') != _MANIFEST_VERSION:
+            raise ValueError(
+                f'unsupported manifest version {manifest.get("version")!r}')
+        return cls(directory, manifest)
+
+    @property
+    def threshold(self) -> float:
+        return self._manifest['threshold']
+
+    @property
+    def k(self) -> _typing.Optional[int]:
+        return self._manifest['k']
+
+    @property
+    def dataset_sizes(self) -> _typing.Optional[_typing.List[int]]:
+        return self._manifest['datasetSizes']
+
+    @property
+    def chunks(self) -> _typing.List[_typechecking.ChunkInfo]:
+        return self._manifest['chunks']
+
+    def pending(self) -> _typing.List[_typing.Tuple[
+            int, _typechecking.ChunkInfo]]:
+        """The chunks that are yet to be completed, with their indices."""
+        return [(i, chunk) for i, chunk in enumerate(self.chunks)
+                if i not in self._completed]
+
+    @property
+    def is_complete(self) -> bool:
+        return len(self._completed) == len(self.chunks)
+
+    def record(
+        self,
+        chunk_index: int,
+        candidate_pairs: _typechecking.CandidatePairs
+    ) -> None:
+        """Save the result of a chunk and mark it as completed.
+
+        :param chunk_index: The index of the chunk in `chunks`.
+        :param candidate_pairs: Its candidate pairs, as returned by
+            `process_chunk`.
+        """
+        if not 0 <= chunk_index < len(self.chunks):
+            raise IndexError(f'chunk index {chunk_index} out of range')
+        name = f'chunk-{chunk_index:08d}.bin'
+        f = _io.BytesIO()
+        _serialization.dump_candidate_pairs(candidate_pairs, f)
+        _write_atomically(_os.path.join(self.directory, name), f.getvalue())
+
+        line = _json.dumps({'chunk': chunk_index, 'file': name}).encode()
+        with open(_os.path.join(self.directory, _COMPLETED_NAME),
+                  'ab') as log:
+            # Drop a partial line left by a crash before appending.
+            if log.tell() != self._completed_size:
+                log.truncate(self._completed_size)
+            log.write(line + b'\n')
+            log.flush()
+            _os.fsync(log.fileno())
+            self._completed_size = log.tell()
+        self._completed[chunk_index] = name
+
+    def merge(self, output: _typing.BinaryIO) -> int:
+        """Merge the results of all chunks into one stream.
+
+        At most a few hundred result files are open at once. Runs with
+        more chunks are merged in several passes, through temporary
+        files in the directory of the run.
+
+        :param output: A binary stream to write the candidate pairs to.
+
+        :return: The number of bytes written, as in `merge_streams`.
+        """
+        if not self.is_complete:
+            raise ValueError(
+                f'{len(self.pending())} chunks are yet to be completed')
+        paths = [_os.path.join(self.directory, name)
+                 for _, name in sorted(self._completed.items())]
+        return _merge_files(paths, output, self.k, directory=self.directory)
+
+
+def run_resumable(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    *,
+    directory: str,
+    output: _typing.BinaryIO,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None,
+    chunk_size_aim: float = 1e7,
+    executor: _typing.Optional[_futures.Executor] = None
+) -> int:
+    """Find candidate pairs, checkpointing every chunk to a directory.
+
+    If `directory` has no manifest, the datasets are split into chunks
+    and a new `ChunkManifest` is created. Otherwise, the run recorded
+    there is resumed: only the chunks that were not completed are
+    processed. The result of every chunk is saved as soon as it is
+    done. Once all chunks are done, their results are merged into
+    `output` with `merge_streams`.
+
+    The result is the same as that of `find_candidate_pairs`.
+
+    :param datasets: A sequence of datasets. Each dataset is a sequence
+        of hashes that supports slicing.
+    :param similarity_f: A function that computes a similarity matrix
+        between two sequences of hashes and finds candidates above the
+        threshold.
+    :param threshold: The similarity threshold. We accept pairs that
+        have similarity of at least this value.
+    :param k: Only permit this many candidate pairs per dataset pair per
+        record. Set to `None` to permit all pairs above with similarity
+        at least `threshold`.
+    :param directory: The directory to keep the manifest and the result
+        of every chunk in.
+    :param output: A binary stream to write the candidate pairs to.
+    :param blocking_f: A function returning all block IDs for a record,
+        as in `process_chunk`.
+    :param chunk_size_aim: Number of comparisons per chunk to aim for,
+        when starting a new run. Default 1e7.
+    :param executor: A `concurrent.futures.Executor` to process chunks
+        on. The chunks of the datasets, `similarity_f` and `blocking_f`
+        must then be picklable. Default None (process the chunks in this
+        thread).
+
+    :return: The number of bytes written to `output`, as in
+        `merge_streams`.
+    """
+    dataset_sizes = [len(dataset) for dataset in datasets]
+    if _os.path.exists(_os.path.join(directory, _MANIFEST_NAME)):
+        manifest = ChunkManifest.open(directory)
+        if (manifest.threshold != threshold or manifest.k != k
+                or manifest.dataset_sizes != dataset_sizes):
+            raise ValueError(
+                'the run in the directory has different parameters')
+    else:
+        if k is None:
+            chunks = split_to_chunks(chunk_size_aim,
+                                     dataset_sizes=dataset_sizes)
+        else:
+            # Every chunk covers the whole of its second dataset so the
+            # merged result is exact.
+            chunks = _split_rows_to_chunks(chunk_size_aim, dataset_sizes)
+        manifest = ChunkManifest.create(directory, chunks,
+                                        threshold=threshold, k=k,
+                                        dataset_sizes=dataset_sizes)
+
+    def chunk_args(chunk: _typechecking.ChunkInfo) -> _typing.Tuple:
+        return (chunk, _chunk_datasets(chunk, datasets),
+                similarity_f, threshold, k, blocking_f)
+
+    if executor is None:
+        for i, chunk in manifest.pending():
+            manifest.record(i, process_chunk(*chunk_args(chunk)))
+    else:
+        futures = {executor.submit(process_chunk, *chunk_args(chunk)): i
+                   for i, chunk in manifest.pending()}
+        try:
+            for future in _futures.as_completed(futures):
+                manifest.record(futures[future], future.result())
+        finally:
+            for future in futures:
+                future.cancel()
+
+    return manifest.merge(output)
@@ -0,0 +1,594 @@
+"""Splitting datasets into chunks and processing them."""
+
+import array as _array
+import collections as _collections
+import itertools as _itertools
+import math as _math
+import os as _os
+import typing as _typing
+
+import numpy as _np
+
+import anonlink.tracing as _tracing
+import anonlink.typechecking as _typechecking
+from anonlink.candidate_generation import find_candidate_pairs
+from anonlink.concurrency._merging import _occurrence_ranks
+from anonlink.concurrency._shared import SharedDataset
+
+# The native Dice coefficient functions, or None if they are not built.
+_SimilarityResult = _typing.Tuple[_typechecking.FloatArrayType,
+                                  _typing.Tuple[_typechecking.IntArrayType,
+                                                ...]]
+dice_coefficient_accelerated: _typing.Optional[
+    _typechecking.SimilarityFunction]
+_dice_coefficient_accelerated: _typing.Optional[
+    _typing.Callable[..., _SimilarityResult]]
+_dice_coefficient_packed: _typing.Optional[
+    _typing.Callable[..., _SimilarityResult]]
+try:
+    from anonlink.similarities import _dice_x86
+except ImportError:
+    dice_coefficient_accelerated = None
+    _dice_coefficient_accelerated = None
+    _dice_coefficient_packed = None
+else:
+    dice_coefficient_accelerated = _dice_x86.dice_coefficient_accelerated
+    _dice_coefficient_accelerated = _dice_x86._dice_coefficient_accelerated
+    _dice_coefficient_packed = _dice_x86._dice_coefficient_packed
+
+# Future: There may be better ways of chunking. Hamish suggests putting
+# a better guarantee on the maximum size of a chunk. This may help with
+# optimisation (e.g., set chunk size to be the size of a page,
+# eliminating page faults).
+# As the function currently makes no guarantees, any such changes would
+# be backwards compatible. Passing filter_bytes to split_to_chunks bounds
+# the memory of the second dataset's range instead, so it stays in cache.
+
+_SYSFS_CACHE_PATH = '/sys/devices/system/cpu/cpu0/cache'
+_SIZE_SUFFIXES = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+_DEFAULT_CACHE_BUDGET = 256 << 10  # Bytes. Used if detection fails.
+_POPCOUNT_BYTES = 4
+
+
+# The block IDs of every record of a dataset.
+_RecordBlocks = _typing.Sequence[_typing.Iterable[_typing.Hashable]]
+
+
+def _split_points(size: int, chunks: int) -> _typing.Iterator[int]:
+    chunk_size = size / chunks
+    for i in range(chunks):
+        yield round(i * chunk_size)
+    yield size
+
+
+def _chunks_1d(
+    size: int,
+    chunks: int
+) -> _typing.Iterable[_typing.List[int]]:
+    split_points = _split_points(size, chunks)
+    a = next(split_points)
+    for b in split_points:
+        yield [a, b]
+        a = b
+
+
+def detect_cache_sizes() -> _typing.Dict[int, int]:
+    """Find the sizes of the CPU's data caches.
+
+    The sizes are read from sysfs, so this only works on Linux.
+
+    :return: A dictionary mapping every cache level to its size in
+        bytes. Empty if the sizes cannot be found.
+    """
+    sizes: _typing.Dict[int, int] = {}
+    try:
+        indices = _os.listdir(_SYSFS_CACHE_PATH)
+    except OSError:
+        return sizes
+    for index in indices:
+        if not index.startswith('index'):
+            continue
+        path = _os.path.join(_SYSFS_CACHE_PATH, index)
+        try:
+            with open(_os.path.join(path, 'type')) as f:
+                cache_type = f.read().strip()
+            with open(_os.path.join(path, 'level')) as f:
+                level = int(f.read())
+            with open(_os.path.join(path, 'size')) as f:
+                size_str = f.read().strip()
+        except (OSError, ValueError):
+            continue
+        if cache_type == 'Instruction' or not size_str:
+            continue
+        multiplier = _SIZE_SUFFIXES.get(size_str[-1].upper(), 1)
+        try:
+            size = int(size_str.rstrip('KMGkmg')) * multiplier
+        except ValueError:
+            continue
+        sizes[level] = max(sizes.get(level, 0), size)
+    return sizes
+
+
+def default_cache_budget() -> int:
+    """The memory budget for the second dataset's range of a chunk.
+
+    This is half of the L2 cache, leaving room for the record of the
+    first dataset being compared and for the results.
+
+    :return: The budget in bytes.
+    """
+    l2_size = detect_cache_sizes().get(2)
+    return l2_size // 2 if l2_size else _DEFAULT_CACHE_BUDGET
+
+
+def split_to_chunks(
+    chunk_size_aim: float,
+    *,
+    # Keyword-only for forwards compatibility: this argument may not be
+    # needed once we do blocking
+    dataset_sizes: _typing.Sequence[int],
+    filter_bytes: _typing.Optional[int] = None,
+    cache_budget: _typing.Optional[int] = None
+) -> _typing.Iterable[_typechecking.ChunkInfo]:
+    """Split datasets into chunks for parallel processing.
+
+    Resulting chunks are length 2 list of dictionaries. Each dictionary
+    represents one data source for the chunk: it has a 'datasetIndex'
+    key which maps to the index of the dataset as an integer, and it has
+    a 'range' key mapping to the range of records within this dataset. A
+    range is a length 2 list [a, b] representing range(a, b).
+
+    Example: [{"datasetIndex": 2, "range": [3, 21]},
+              {"datasetIndex": 4, "range": [18, 20]}]
+    means that this chunk compares (0-indexed) datasets 2 and 4. We are
+    looking at elements 3-20 (inclusive) of dataset 2 and elements 18
+    and 19 of dataset 4.
+
+    The chunks are always JSON serialisable.
+
+    :param chunk_size_aim: Number of comparisons per chunk to aim for.
+        This is a hint only. No promises.
+    :param dataset_sizes: The sizes of the datasets to compare, as a
+        sequence.
+    :param filter_bytes: The number of bytes in every filter. If given,
+        chunks are no longer square: the range of the second dataset is
+        made small enough for its filters and popcounts to fit in
+        `cache_budget` bytes, since every record of the first dataset is
+        compared with all of them in turn. The range of the first
+        dataset is then sized for `chunk_size_aim` comparisons.
+    :param cache_budget: The memory budget, in bytes, for the second
+        dataset's range of every chunk. Only used with `filter_bytes`.
+        Default `default_cache_budget()`.
+
+    :return: An iterable of chunks.
+    """
+
+    # int-like and float-like types such as np.int64 are welcome but are
+    # not JSON-serialisable.
+    chunk_size_aim_float = float(chunk_size_aim)
+    dataset_sizes_int = map(int, dataset_sizes)
+    max_records1 = None
+    if filter_bytes is not None:
+        if cache_budget is None:
+            cache_budget = default_cache_budget()
+        max_records1 = max(
+            1, int(cache_budget) // (int(filter_bytes) + _POPCOUNT_BYTES))
+    for (i0, size0), (i1, size1) in _itertools.combinations(
+            enumerate(dataset_sizes_int), 2):
+        if not size0 or not size1:
+            continue
+        if max_records1 is None:
+            chunks0 = round(size0 / _math.sqrt(chunk_size_aim_float)) or 1
+            chunk_size0 = size0 / chunks0
+            # chunk_size0 is unlikely to be exactly sqrt(chunk_size_aim).
+            # Adjust goal chunk size for the second dataset.
+            chunks1 = round(size1 * chunk_size0 / chunk_size_aim_float) or 1
+        else:
+            # Every range of the second dataset has at most
+            # max_records1 records.
+            chunks1 = -(-size1 // max_records1)
+            chunk_size1 = size1 / chunks1
+            chunks0 = min(
+                size0,
+                round(size0 * chunk_size1 / chunk_size_aim_float) or 1)
+        for c0, c1 in _itertools.product(
+                _chunks_1d(size0, chunks0), _chunks_1d(size1, chunks1)):
+            yield [{'datasetIndex': i0, 'range': c0},
+                   {'datasetIndex': i1, 'range': c1}]
+
+
+def _max_popcount_differences(
+    popcounts: _np.ndarray,
+    threshold: float
+) -> _np.ndarray:
+    # As calculate_max_difference in the Dice kernel: a pair can only
+    # reach the threshold if its popcounts differ by at most this much.
+    return (2 * popcounts * (1 / threshold - 1)).astype(_np.int64)
+
+
+def _row_costs(
+    popcounts0: _typing.Optional[_np.ndarray],
+    popcounts1: _typing.Optional[_np.ndarray],
+    blocks0: _typing.Optional[_RecordBlocks],
+    blocks1: _typing.Optional[_RecordBlocks],
+    rows: int,
+    columns: _typing.Tuple[int, int],
+    threshold: _typing.Optional[float],
+    check_cost: float
+) -> _np.ndarray:
+    # The estimated cost of comparing every row of the first dataset
+    # with the columns of the second.
+    a1, b1 = columns
+    # The popcounts of the second dataset, if pairs are filtered by
+    # their popcounts.
+    filter_popcounts: _typing.Optional[_np.ndarray] = None
+    if popcounts0 is not None and threshold:
+        assert popcounts1 is not None
+        filter_popcounts = popcounts1
+        differences = _max_popcount_differences(popcounts0, threshold)
+        lows = popcounts0 - differences
+        highs = popcounts0 + differences
+    filtered = filter_popcounts is not None
+
+    if blocks0 is None:
+        compared = _np.full(rows, b1 - a1, dtype=_np.float64)
+        if filter_popcounts is None:
+            return compared * (1 + check_cost)
+        column_popcounts = _np.sort(filter_popcounts[a1:b1])
+        passed = (_np.searchsorted(column_popcounts, highs, side='right')
+                  - _np.searchsorted(column_popcounts, lows, side='left'))
+        return passed + check_cost * compared
+
+    assert blocks1 is not None
+    block_popcounts: _typing.DefaultDict[_typing.Hashable, list] \
+        = _collections.defaultdict(list)
+    for j in range(a1, b1):
+        popcount = 0 if filter_popcounts is None else filter_popcounts[j]
+        for block_id in blocks1[j]:
+            block_popcounts[block_id].append(popcount)
+    sorted_block_popcounts = {block_id: _np.sort(block)
+                              for block_id, block in block_popcounts.items()}
+
+    costs = _np.zeros(rows, dtype=_np.float64)
+    for i in range(rows):
+        for block_id in blocks0[i]:
+            block = sorted_block_popcounts.get(block_id)
+            if block is None:
+                continue
+            if filtered:
+                passed = (_np.searchsorted(block, highs[i], side='right')
+                          - _np.searchsorted(block, lows[i], side='left'))
+            else:
+                passed = block.shape[0]
+            costs[i] += passed + check_cost * block.shape[0]
+    return costs
+
+
+def _weighted_split_points(
+    costs: _np.ndarray,
+    chunk_cost_aim: float
+) -> _typing.List[int]:
+    # Split points such that every range of rows has about the same
+    # total cost.
+    cumulative_costs = _np.cumsum(costs)
+    total_cost = float(cumulative_costs[-1]) if costs.shape[0] else 0.
+    chunks = max(1, round(total_cost / chunk_cost_aim))
+    targets = total_cost * _np.arange(1, chunks) / chunks
+    inner_points = _np.searchsorted(cumulative_costs, targets) + 1
+    points = [0, *inner_points.tolist(), costs.shape[0]]
+    # Drop empty ranges.
+    return [b for a, b in zip([-1] + points, points) if b > a]
+
+
+def split_to_chunks_by_cost(
+    chunk_cost_aim: float,
+    *,
+    dataset_sizes: _typing.Sequence[int],
+    popcounts: _typing.Optional[_typing.Sequence[_typing.Sequence[int]]]
+        = None,
+    threshold: _typing.Optional[float] = None,
+    blocks: _typing.Optional[_typing.Sequence[_RecordBlocks]] = None,
+    check_cost: float = .1
+) -> _typing.Iterable[_typechecking.ChunkInfo]:
+    """Split datasets into chunks of roughly equal estimated work.
+
+    Like `split_to_chunks`, but chunks are sized by the estimated cost
+    of processing them rather than by their number of comparisons.
+    Comparing two records costs 1 when they share a block and their
+    popcounts permit a similarity of at least `threshold`. Every other
+    pair of records that shares a block costs `check_cost`, since the
+    Dice coefficient implementation rejects it after comparing
+    popcounts. Pairs that share no block cost nothing.
+
+    The second dataset of every dataset pair is split into ranges of
+    equal size. Then, within each of those, the first dataset is split
+    into ranges of about `chunk_cost_aim` estimated cost. Chunks with no
+    estimated cost are omitted, since no pair within them can be a
+    candidate pair.
+
+    The chunks are in the same format as those of `split_to_chunks`, and
+    are always JSON serialisable.
+
+    :param chunk_cost_aim: Estimated cost per chunk to aim for. This is
+        a hint only. No promises.
+    :param dataset_sizes: The sizes of the datasets to compare, as a
+        sequence.
+    :param popcounts: For every dataset, the popcount of every record.
+        Default None (assume no pair is rejected by its popcounts).
+    :param threshold: The similarity threshold the chunks will be
+        processed with. Required to make use of `popcounts`.
+    :param blocks: For every dataset, the block IDs of every record, as
+        returned by the blocking function. Default None (no blocking).
+    :param check_cost: The cost of a pair rejected by its popcounts,
+        relative to that of a comparison.
+
+    :return: An iterable of chunks.
+    """
+    chunk_cost_aim_float = float(chunk_cost_aim)
+    if chunk_cost_aim_float <= 0:
+        raise ValueError(
+            f'chunk_cost_aim must be positive (got {chunk_cost_aim})')
+    dataset_sizes_int = list(map(int, dataset_sizes))
+    if popcounts is not None:
+        np_popcounts = [_np.asarray(dataset_popcounts, dtype=_np.int64)
+                        for dataset_popcounts in popcounts]
+        if list(map(len, np_popcounts)) != dataset_sizes_int:
+            raise ValueError('popcounts do not match dataset_sizes')
+    if blocks is not None:
+        blocks = [[tuple(record_blocks) for record_blocks in dataset_blocks]
+                  for dataset_blocks in blocks]
+        if list(map(len, blocks)) != dataset_sizes_int:
+            raise ValueError('blocks do not match dataset_sizes')
+
+    for (i0, size0), (i1, size1) in _itertools.combinations(
+            enumerate(dataset_sizes_int), 2):
+        if not size0 or not size1:
+            continue
+        row_cost_args = (
+            None if popcounts is None else np_popcounts[i0],
+            None if popcounts is None else np_popcounts[i1],
+            None if blocks is None else blocks[i0],
+            None if blocks is None else blocks[i1],
+            size0)
+
+        # Aim for square chunks, in terms of cost.
+        total_cost = _row_costs(*row_cost_args, (0, size1),
+                                threshold, check_cost).sum()
+        chunks1 = min(size1,
+                      round(_math.sqrt(total_cost / chunk_cost_aim_float))
+                      or 1)
+        for c1 in _chunks_1d(size1, chunks1):
+            costs = _row_costs(*row_cost_args, (c1[0], c1[1]),
+                               threshold, check_cost)
+            split_points = _weighted_split_points(costs,
+                                                  chunk_cost_aim_float)
+            for a0, b0 in zip(split_points, split_points[1:]):
+                if costs[a0:b0].any():
+                    yield [{'datasetIndex': i0, 'range': [a0, b0]},
+                           {'datasetIndex': i1, 'range': c1}]
+
+
+def _chunk_datasets(
+    chunk: _typechecking.ChunkInfo,
+    datasets: _typing.Sequence[_typechecking.Dataset]
+) -> _typing.List[_typechecking.Dataset]:
+    # The records of whole datasets that a chunk covers, in the form
+    # that process_chunk expects.
+    return [datasets[dataset_chunk['datasetIndex']][
+                slice(*dataset_chunk['range'])]
+            for dataset_chunk in chunk]
+
+
+def _get_dataset_indices(
+    dataset_chunk: _typechecking.DatasetChunkInfo,
+    size: int
+) -> _typechecking.IntArrayType:
+    index = dataset_chunk['datasetIndex']
+    return _array.array('I', (index,)) * size
+
+
+def _offset_record_indices_inplace(
+    dataset_chunk: _typechecking.DatasetChunkInfo,
+    rec_is: _typechecking.IntArrayType
+) -> None:
+    a, _ = dataset_chunk['range']
+    np_rec_is = _np.frombuffer(rec_is, dtype=rec_is.typecode)
+    np_rec_is += a
+
+
+def _fill_int_array_inplace(
+    int_array: _typechecking.IntArrayType,
+    value: int
+) -> None:
+    np_buffer = _np.frombuffer(int_array, dtype=int_array.typecode)
+    np_buffer.fill(value)
+
+
+def _globalise_indices_inplace(
+    chunk: _typechecking.ChunkInfo,
+    dset_is: _typechecking.IntArrayType,
+    rec_is: _typechecking.IntArrayType
+) -> None:
+    # dset_is holds positions within chunk. Replace them with the
+    # dataset indices and offset the record indices by the start of
+    # each dataset's range.
+    dataset_indices = _np.fromiter(
+        (dataset_chunk['datasetIndex'] for dataset_chunk in chunk),
+        dtype=dset_is.typecode, count=len(chunk))
+    offsets = _np.fromiter(
+        (dataset_chunk['range'][0] for dataset_chunk in chunk),
+        dtype=rec_is.typecode, count=len(chunk))
+    np_dset_is = _np.frombuffer(dset_is, dtype=dset_is.typecode)
+    np_rec_is = _np.frombuffer(rec_is, dtype=rec_is.typecode)
+    np_rec_is += offsets[np_dset_is]
+    np_dset_is[:] = dataset_indices[np_dset_is]
+
+
+def _packed_rows(filters: _np.ndarray) -> _np.ndarray:
+    # The rows of a matrix of filters as one buffer of signed chars, as
+    # the Dice coefficient kernel expects. Contiguous rows are not
+    # copied.
+    return _np.ascontiguousarray(filters).view(_np.int8).reshape(-1)
+
+
+def _process_binary_chunk_accelerated(
+    chunk: _typechecking.ChunkInfo,
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    threshold: float,
+    k: _typing.Optional[int]
+) -> _typechecking.CandidatePairs:
+    # Equivalent to the generic path of process_chunk for unblocked
+    # chunks of two datasets, without its per-element merge. The kernel
+    # writes record indices with the chunk's offsets applied.
+    assert _dice_coefficient_accelerated is not None
+    assert _dice_coefficient_packed is not None
+    offsets = chunk[0]['range'][0], chunk[1]['range'][0]
+    dataset0, dataset1 = datasets
+    if (isinstance(dataset0, SharedDataset)
+            and isinstance(dataset1, SharedDataset)
+            and dataset0.filters.shape[1] == dataset1.filters.shape[1]
+            and dataset0.filters.shape[1]):
+        # Pass the filters and popcounts in shared memory to the kernel
+        # instead of packing and counting them again.
+        sims, (rec_is0, rec_is1) = _dice_coefficient_packed(
+            _packed_rows(dataset0.filters), _packed_rows(dataset1.filters),
+            len(dataset0), _np.ascontiguousarray(dataset1.popcounts),
+            dataset0.filters.shape[1], threshold, k, offsets)
+    else:
+        sims, (rec_is0, rec_is1) = _dice_coefficient_accelerated(
+            datasets, threshold, k, offsets)
+
+    if k is not None and len(sims):
+        # The kernel returns at most k candidates for every record of
+        # the first dataset. Enforce k for the second as well.
+        np_rec_is1 = _np.frombuffer(rec_is1, dtype=rec_is1.typecode)
+        mask = _occurrence_ranks(np_rec_is1) < k
+        if not mask.all():
+            sims = _array.array(sims.typecode, _np.frombuffer(
+                sims, dtype=sims.typecode)[mask].tobytes())
+            rec_is0 = _array.array(rec_is0.typecode, _np.frombuffer(
+                rec_is0, dtype=rec_is0.typecode)[mask].tobytes())
+            rec_is1 = _array.array(rec_is1.typecode,
+                                   np_rec_is1[mask].tobytes())
+
+    dset_is0 = _get_dataset_indices(chunk[0], len(sims))
+    dset_is1 = _get_dataset_indices(chunk[1], len(sims))
+    return sims, (dset_is0, dset_is1), (rec_is0, rec_is1)
+
+
+def process_chunk(
+    chunk: _typechecking.ChunkInfo,
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None
+) -> _typechecking.CandidatePairs:
+    """Find candidate pairs for the chunk.
+
+    Calls the similarity function, offsets record indices by the
+    required amount, and adds dataset index information.
+
+    Chunks returned by `split_to_chunks` cover two datasets. A chunk may
+    also cover more than two datasets, in which case every pair of its
+    datasets is compared, as in `find_candidate_pairs`.
+
+    :param chunk: Chunk to process, as returned by `split_to_chunks`.
+    :param datasets: A sequence of datasets, one for every dataset in
+        `chunk`. Each dataset should contain as many records as required
+        by `chunk`. It is up to you to extract the correct range from
+        the larger dataset.
+    :param similarity_f: A function that computes a similarity matrix
+        between two sequences of hashes and finds candidates above the
+        threshold.
+    :param threshold: The similarity threshold. We accept pairs that
+        have similarity of at least this value.
+    :param k: Only permit this many candidate pairs per dataset pair per
+        record. Set to `None` to permit all pairs above with similarity
+        at least `threshold`.
+    :param blocking_f: A function returning all block IDs for a record.
+        Two records are compared iff they have at least one block ID in
+        common. Support for this is experimental and subject to change.
+
+    :return: A 3-tuple `(similarity, dataset_i, record_i)`. `dataset_i`
+        and `record_i` are sequences of sequences. Every sequence in
+        `dataset_i` has the same length as `similarity`; also, every
+        sequence in `record_i` has the same length as `similarity`.
+        Currently `dataset_i` and `record_i` have length 2, but this may
+        be changed in the future.
+            Every valid index `i` corresponds to one candidate match.
+        `dataset[0][i]` is the index of the dataset of the first record
+        in the pair; `record[0][i]` is this record's index in its
+        dataset. `dataset_[1][i]` is the index of the dataset of the
+        second record in the pair; `record_[1][i]` is this record's
+        index in its dataset. `similarity[i]` is the pair's similarity;
+        this value will be greater than `threshold`.
+    """
+
+    if len(chunk) != len(datasets):
+        raise ValueError(
+            f'number of datasets does not match chunk (expected {len(chunk)}, '
+            f'got {len(datasets)})')
+    for i, dataset_chunk in enumerate(chunk):
+        if 'datasetIndex' not in dataset_chunk:
+            raise ValueError(f"invalid chunk: expected value for "
+                             f"'datasetIndex' at index {i}")
+        if 'range' not in dataset_chunk:
+            raise ValueError(f"invalid chunk: expected value for "
+                             f"'range' at index {i}")
+    for i, dataset_chunk, dataset_records in zip(
+                _itertools.count(), chunk, datasets):
+        a, b = dataset_chunk['range']
+        if len(dataset_records) != b - a:
+            raise ValueError(
+                f'size of dataset at index {i} does not match chunk (expected '
+                f'{b - a}, got {len(dataset_records)})')
+    if len(chunk) < 2:
+        raise NotImplementedError(
+            f'chunks must contain at least two datasets '
+            f'(chunk has {len(chunk)} datasets)')
+
+    with _tracing.stage('process_chunk', chunk=chunk) as span:
+        if (blocking_f is None
+                and len(chunk) == 2
+                and dice_coefficient_accelerated is not None
+                and similarity_f is dice_coefficient_accelerated):
+            candidate_pairs = _process_binary_chunk_accelerated(
+                chunk, datasets, threshold, k)
+        else:
+            candidate_pairs = _process_chunk_generic(
+                chunk, datasets, similarity_f, threshold, k, blocking_f)
+        span.items = len(candidate_pairs[0])
+    return candidate_pairs
+
+
+def _process_chunk_generic(
+    chunk: _typechecking.ChunkInfo,
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int],
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction]
+) -> _typechecking.CandidatePairs:
+    sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = find_candidate_pairs(
+        datasets,
+        similarity_f,
+        threshold,
+        k=k,
+        blocking_f=blocking_f
+    )
+
+    assert len(sims) == len(rec_is0) == len(rec_is1)
+
+    if len(chunk) == 2:
+        # Every candidate pair is between the two datasets, in order.
+        _fill_int_array_inplace(dset_is0, chunk[0]['datasetIndex'])
+        _offset_record_indices_inplace(chunk[0], rec_is0)
+
+        _fill_int_array_inplace(dset_is1, chunk[1]['datasetIndex'])
+        _offset_record_indices_inplace(chunk[1], rec_is1)
+    else:
+        _globalise_indices_inplace(chunk, dset_is0, rec_is0)
+        _globalise_indices_inplace(chunk, dset_is1, rec_is1)
+
+    return sims, (dset_is0, dset_is1), (rec_is0, rec_is1)
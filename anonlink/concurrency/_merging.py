@@ -0,0 +1,97 @@
+"""Merging candidate pairs from multiple chunks."""
+
+import array as _array
+import typing as _typing
+
+import numpy as _np
+
+import anonlink.tracing as _tracing
+import anonlink.typechecking as _typechecking
+
+
+def _occurrence_ranks(*key_columns: _np.ndarray) -> _np.ndarray:
+    # For every row, the number of preceding rows with the same key.
+    # lexsort is stable, so rows with the same key keep their order.
+    n = key_columns[0].shape[0]
+    order = _np.lexsort(key_columns[::-1])
+    new_key = _np.zeros(n, dtype=bool)
+    new_key[:1] = True
+    for column in key_columns:
+        sorted_column = column[order]
+        new_key[1:] |= sorted_column[1:] != sorted_column[:-1]
+    positions = _np.arange(n)
+    key_starts = _np.maximum.accumulate(_np.where(new_key, positions, 0))
+    ranks = _np.empty(n, dtype=_np.intp)
+    ranks[order] = positions - key_starts
+    return ranks
+
+
+def _enforce_k_mask(
+    dset_is0: _np.ndarray,
+    dset_is1: _np.ndarray,
+    rec_is0: _np.ndarray,
+    rec_is1: _np.ndarray,
+    k: int
+) -> _np.ndarray:
+    # Vectorised equivalent of candidate_generation._enforce_k for
+    # candidate pairs that are already sorted: a pair is kept iff both
+    # of its records have fewer than k preceding pairs with the same
+    # dataset pair, whether or not those were kept.
+    return ((_occurrence_ranks(dset_is0, dset_is1, rec_is1) < k)
+            & (_occurrence_ranks(dset_is1, dset_is0, rec_is0) < k))
+
+
+def _concatenate(
+    arrays: _typing.Iterable[_array.array],
+    dtype: _typing.Any
+) -> _np.ndarray:
+    return _np.concatenate([_np.asarray(a, dtype=dtype) for a in arrays]
+                           or [_np.empty(0, dtype=dtype)])
+
+
+def _to_array(typecode: str, values: _np.ndarray) -> _array.array:
+    return _array.array(typecode, values.astype(typecode).tobytes())
+
+
+def merge_candidate_pairs(
+    results: _typing.Iterable[_typechecking.CandidatePairs],
+    k: _typing.Optional[int] = None
+) -> _typechecking.CandidatePairs:
+    """Merge candidate pairs from disjoint chunks into one result.
+
+    This is the in-memory counterpart of
+    `anonlink.serialization.merge_streams`.
+
+    :param results: Candidate pairs of every chunk, as returned by
+        `process_chunk`.
+    :param k: Only keep this many candidate pairs per dataset pair per
+        record in the merged result, as in `find_candidate_pairs`. Set
+        to `None` to keep all pairs.
+
+    :return: The candidate pairs of all chunks, sorted like those
+        returned by `find_candidate_pairs`.
+    """
+    results = tuple(results)
+    with _tracing.stage('merge_candidate_pairs', k=k) as span:
+        sims = _concatenate((sims for sims, _, _ in results), _np.float64)
+        dset_is0 = _concatenate((dset_is[0] for _, dset_is, _ in results),
+                                _np.uint32)
+        dset_is1 = _concatenate((dset_is[1] for _, dset_is, _ in results),
+                                _np.uint32)
+        rec_is0 = _concatenate((rec_is[0] for _, _, rec_is in results),
+                               _np.uint32)
+        rec_is1 = _concatenate((rec_is[1] for _, _, rec_is in results),
+                               _np.uint32)
+
+        order = _np.lexsort((rec_is1, rec_is0, dset_is1, dset_is0, -sims))
+        if k is not None:
+            mask = _enforce_k_mask(dset_is0[order], dset_is1[order],
+                                   rec_is0[order], rec_is1[order], k)
+            order = order[mask]
+        span.items = order.shape[0]
+
+        return (_to_array('d', sims[order]),
+                (_to_array('I', dset_is0[order]),
+                 _to_array('I', dset_is1[order])),
+                (_to_array('I', rec_is0[order]),
+                 _to_array('I', rec_is1[order])))
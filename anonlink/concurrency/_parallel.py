@@ -0,0 +1,264 @@
+"""Finding candidate pairs on all cores of one machine."""
+
+import concurrent.futures as _futures
+import contextlib as _contextlib
+import itertools as _itertools
+import math as _math
+import os as _os
+import tempfile as _tempfile
+import typing as _typing
+
+import anonlink.serialization as _serialization
+import anonlink.typechecking as _typechecking
+from anonlink.concurrency._chunking import (
+    _chunk_datasets, _chunks_1d, dice_coefficient_accelerated, process_chunk,
+    split_to_chunks)
+from anonlink.concurrency._merging import merge_candidate_pairs
+from anonlink.concurrency._scheduling import WorkStealingScheduler
+from anonlink.concurrency._shared import SharedDatasets
+from anonlink.concurrency._spilling import _merge_files, process_chunk_to_file
+
+# Datasets of the worker process, set once by _initialise_worker so that
+# tasks only carry their chunk. Either the datasets themselves or the
+# shared memory holding them.
+_worker_datasets: _typing.Optional[
+    _typing.Sequence[_typechecking.Dataset]] = None
+_worker_shared_datasets: _typing.Optional[SharedDatasets] = None
+
+
+def _initialise_worker(
+    datasets: _typing.Optional[_typing.Sequence[_typechecking.Dataset]],
+    shared_info: _typing.Optional[_typing.Mapping[str, _typing.Any]]
+) -> None:
+    global _worker_datasets, _worker_shared_datasets
+    if shared_info is None:
+        _worker_datasets = datasets
+    else:
+        _worker_shared_datasets = SharedDatasets.attach(shared_info)
+
+
+def _worker_chunk_datasets(
+    chunk: _typechecking.ChunkInfo
+) -> _typing.List[_typechecking.Dataset]:
+    if _worker_shared_datasets is not None:
+        return [_worker_shared_datasets.dataset(
+                    dataset_chunk['datasetIndex'], *dataset_chunk['range'])
+                for dataset_chunk in chunk]
+    assert _worker_datasets is not None
+    return _chunk_datasets(chunk, _worker_datasets)
+
+
+def _split_rows_to_chunks(
+    chunk_size_aim: float,
+    dataset_sizes: _typing.Sequence[int]
+) -> _typing.Iterable[_typechecking.ChunkInfo]:
+    # Like split_to_chunks, but every chunk covers the whole of its
+    # second dataset. The top k candidates of every record of the first
+    # dataset are then found within one chunk.
+    for (i0, size0), (i1, size1) in _itertools.combinations(
+            enumerate(map(int, dataset_sizes)), 2):
+        if not size0 or not size1:
+            continue
+        chunks0 = min(size0, _math.ceil(size0 * size1 / chunk_size_aim))
+        for c0 in _chunks_1d(size0, chunks0):
+            yield [{'datasetIndex': i0, 'range': c0},
+                   {'datasetIndex': i1, 'range': [0, size1]}]
+
+
+def _process_chunk_in_worker(
+    chunk: _typechecking.ChunkInfo,
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int],
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction],
+    directory: _typing.Optional[str],
+    memory_budget: _typing.Optional[int] = None
+) -> _typing.Union[_typechecking.CandidatePairs, str]:
+    if directory is not None and memory_budget is not None:
+        return process_chunk_to_file(
+            chunk, _worker_chunk_datasets(chunk), similarity_f, threshold,
+            k=k, blocking_f=blocking_f,
+            memory_budget=memory_budget, directory=directory)
+    result = process_chunk(chunk, _worker_chunk_datasets(chunk),
+                           similarity_f, threshold,
+                           k=k, blocking_f=blocking_f)
+    if directory is None:
+        return result
+    fd, path = _tempfile.mkstemp(suffix='.bin', dir=directory)
+    with open(fd, 'wb') as f:
+        _serialization.dump_candidate_pairs(result, f)
+    return path
+
+
+def _map_work_stealing(
+    executors: _typing.Sequence[_futures.Executor],
+    scheduler: WorkStealingScheduler,
+    *args: _typing.Any
+) -> _typing.List[_typing.Union[_typechecking.CandidatePairs, str]]:
+    # Every executor has one process, which is the scheduler's worker of
+    # the same index. Keep one piece in flight per process. When its
+    # piece is done, it asks the scheduler for its next one, so that it
+    # only steals once its own queue is empty.
+    pending: _typing.Dict[_futures.Future, int] = {}
+
+    def submit(worker: int) -> None:
+        chunk = scheduler.next_chunk(worker)
+        if chunk is not None:
+            future = executors[worker].submit(_process_chunk_in_worker,
+                                              chunk, *args)
+            pending[future] = worker
+
+    for worker in range(len(executors)):
+        submit(worker)
+    results = []
+    while pending:
+        done, _ = _futures.wait(pending,
+                                return_when=_futures.FIRST_COMPLETED)
+        for future in done:
+            worker = pending.pop(future)
+            results.append(future.result())
+            submit(worker)
+    return results
+
+
+def run_parallel(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    *,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None,
+    workers: _typing.Optional[int] = None,
+    chunk_size_aim: _typing.Optional[float] = None,
+    output: _typing.Optional[_typing.BinaryIO] = None,
+    shared_memory: _typing.Optional[bool] = None,
+    memory_budget: _typing.Optional[int] = None,
+    work_stealing: bool = False
+) -> _typing.Union[_typechecking.CandidatePairs, int]:
+    """Find candidate pairs using a pool of worker processes.
+
+    The datasets are split into chunks, which are processed with
+    `process_chunk` on a `concurrent.futures.ProcessPoolExecutor`. Each
+    worker receives the datasets once when it starts, so each task only
+    carries its chunk. The results of all chunks are then merged.
+
+    The result is the same as that of `find_candidate_pairs`. When `k`
+    is given, every chunk covers the whole of its second dataset, so
+    that the top `k` candidates of every record are found within one
+    chunk.
+
+    :param datasets: A sequence of datasets. Each dataset is a sequence
+        of hashes that supports slicing.
+    :param similarity_f: A function that computes a similarity matrix
+        between two sequences of hashes and finds candidates above the
+        threshold. It must be picklable.
+    :param threshold: The similarity threshold. We accept pairs that
+        have similarity of at least this value.
+    :param k: Only permit this many candidate pairs per dataset pair per
+        record. Set to `None` to permit all pairs above with similarity
+        at least `threshold`.
+    :param blocking_f: A function returning all block IDs for a record,
+        as in `process_chunk`. It must be picklable.
+    :param workers: The number of worker processes. Default the number
+        of CPUs.
+    :param chunk_size_aim: Number of comparisons per chunk to aim for.
+        Default enough for about four chunks per worker.
+    :param output: A binary stream. If given, the results of the chunks
+        are written to temporary files as they are completed and merged
+        into `output` with `anonlink.serialization.merge_streams`, so
+        they never need to be in memory at once. Default None (merge the
+        results in memory).
+    :param shared_memory: Whether to place the datasets in shared
+        memory (see `SharedDatasets`), so workers read them without
+        copying, and the Dice coefficient kernel reads the popcounts
+        computed once in the parent. This requires records that are
+        bitarrays or bytes-like objects of the same length in bytes,
+        and `similarity_f` then receives them as bitarrays. Otherwise,
+        the datasets are pickled and sent to every worker when it
+        starts. Default None (use shared memory when `similarity_f` is
+        `dice_coefficient_accelerated` and the records permit it).
+    :param memory_budget: The approximate number of bytes of candidate
+        pairs every worker may hold in memory, as in
+        `process_chunk_to_file`. Only used with `output`. Default None
+        (hold the candidate pairs of a whole chunk).
+    :param work_stealing: Whether to schedule the chunks with a
+        `WorkStealingScheduler`. The datasets are then split into one
+        coarse chunk per worker by default. Every worker process takes
+        pieces of about a sixteenth of `chunk_size_aim` comparisons of
+        its own chunks at a time, and steals from slower processes when
+        it runs out. Default False (process every chunk as one task).
+
+    :return: The candidate pairs, as returned by `find_candidate_pairs`,
+        or the number of bytes written to `output` if it is given.
+    """
+    if workers is None:
+        workers = _os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f'workers must be positive (got {workers})')
+
+    dataset_sizes = [len(dataset) for dataset in datasets]
+    if chunk_size_aim is None:
+        comparisons = sum(size0 * size1 for size0, size1
+                          in _itertools.combinations(dataset_sizes, 2))
+        chunks_per_worker = 1 if work_stealing else 4
+        chunk_size_aim = max(comparisons / (chunks_per_worker * workers), 1)
+    if k is None:
+        chunks = list(split_to_chunks(chunk_size_aim,
+                                      dataset_sizes=dataset_sizes))
+    else:
+        chunks = list(_split_rows_to_chunks(chunk_size_aim, dataset_sizes))
+
+    if not chunks:
+        result = merge_candidate_pairs((), k)
+        if output is None:
+            return result
+        return _serialization.dump_candidate_pairs(result, output)
+
+    with _contextlib.ExitStack() as stack:
+        shared_datasets = None
+        if shared_memory is None:
+            # Only the Dice coefficient kernel is known to accept the
+            # records as bitarrays in place of the originals.
+            if (dice_coefficient_accelerated is not None
+                    and similarity_f is dice_coefficient_accelerated):
+                try:
+                    shared_datasets = SharedDatasets(datasets)
+                except (TypeError, ValueError):
+                    pass
+        elif shared_memory:
+            shared_datasets = SharedDatasets(datasets)
+        initargs: _typing.Tuple[
+            _typing.Optional[_typing.Sequence[_typechecking.Dataset]],
+            _typing.Optional[_typing.Mapping[str, _typing.Any]]]
+        if shared_datasets is not None:
+            stack.enter_context(shared_datasets)
+            initargs = None, shared_datasets.info
+        else:
+            initargs = datasets, None
+
+        # Work stealing needs to know which process runs each piece, so
+        # it gets a pool of one process per worker.
+        executors = [
+            stack.enter_context(_futures.ProcessPoolExecutor(
+                1 if work_stealing else workers,
+                initializer=_initialise_worker,
+                initargs=initargs))
+            for _ in range(workers if work_stealing else 1)]
+
+        def map_chunks(directory: _typing.Optional[str]) -> _typing.Iterable:
+            args = (similarity_f, threshold, k, blocking_f,
+                    directory, memory_budget)
+            if work_stealing:
+                scheduler = WorkStealingScheduler(
+                    chunks, workers, piece_size_aim=chunk_size_aim / 16)
+                return _map_work_stealing(executors, scheduler, *args)
+            executor, = executors
+            return executor.map(_process_chunk_in_worker, chunks,
+                                *map(_itertools.repeat, args))
+
+        if output is None:
+            return merge_candidate_pairs(map_chunks(None), k)
+
+        with _tempfile.TemporaryDirectory() as directory:
+            return _merge_files(map_chunks(directory), output, k,
+                                directory=directory)
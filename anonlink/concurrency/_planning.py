@@ -0,0 +1,130 @@
+"""Planning multi-party runs over a fixed number of workers."""
+
+import math as _math
+import typing as _typing
+
+import anonlink.typechecking as _typechecking
+from anonlink.concurrency._chunking import _chunks_1d
+
+_RUNS_PER_WORKER = 4
+
+# A run of chunks that share the slice of their first dataset. The
+# slice, then the slices of the second datasets, in order.
+_Strip = _typing.Tuple[
+    _typechecking.DatasetChunkInfo,
+    _typing.List[_typechecking.DatasetChunkInfo]]
+
+
+def _strip_cost(strip: _Strip) -> int:
+    dataset_chunk0, dataset_chunks1 = strip
+    a0, b0 = dataset_chunk0['range']
+    return (b0 - a0) * sum(b1 - a1 for a1, b1
+                           in (c['range'] for c in dataset_chunks1))
+
+
+def _split_strip(strip: _Strip, cost_aim: float) -> _typing.List[_Strip]:
+    # Split a strip into consecutive runs of about cost_aim comparisons.
+    dataset_chunk0, dataset_chunks1 = strip
+    a0, b0 = dataset_chunk0['range']
+    strips = []
+    run: _typing.List[_typechecking.DatasetChunkInfo] = []
+    run_cost = 0
+    for dataset_chunk1 in dataset_chunks1:
+        a1, b1 = dataset_chunk1['range']
+        cost = (b0 - a0) * (b1 - a1)
+        if run and run_cost + cost > cost_aim:
+            strips.append((dataset_chunk0, run))
+            run = []
+            run_cost = 0
+        run.append(dataset_chunk1)
+        run_cost += cost
+    if run:
+        strips.append((dataset_chunk0, run))
+    return strips
+
+
+def plan_chunks(
+    chunk_size_aim: float,
+    *,
+    dataset_sizes: _typing.Sequence[int],
+    workers: int
+) -> _typing.List[_typing.List[_typechecking.ChunkInfo]]:
+    """Split datasets into chunks and schedule them over workers.
+
+    Unlike `split_to_chunks`, which splits every pair of datasets
+    independently, every dataset is split into slices once, and the
+    chunks of all pairs of datasets are made from these slices. Chunks
+    that share the slice of their first dataset form a strip: that
+    slice compared with every slice of every later dataset.
+
+    Strips are the unit of scheduling, so consecutive chunks of a
+    worker share a slice that is already in its cache or mapped from
+    shared memory. Strips with more than a quarter of a worker's share
+    of comparisons are split into consecutive runs. The strips are
+    assigned to workers with the longest processing time first rule,
+    which balances the number of comparisons per worker. Each worker's
+    strips are ordered by their first dataset's slice, with every other
+    strip reversed so that the last chunk of one strip and the first of
+    the next share their second dataset's slice.
+
+    The chunks of all workers cover every pair of records of different
+    datasets exactly once.
+
+    :param chunk_size_aim: Number of comparisons per chunk to aim for.
+        This is a hint only.
+    :param dataset_sizes: The sizes of the datasets to compare, as a
+        sequence.
+    :param workers: The number of workers to plan for.
+
+    :return: A list with, for every worker, the list of chunks it should
+        process in order.
+    """
+    if workers < 1:
+        raise ValueError(f'workers must be positive (got {workers})')
+    slice_size = _math.sqrt(float(chunk_size_aim))
+    slices: _typing.List[_typing.List[_typechecking.DatasetChunkInfo]] = [
+        [{'datasetIndex': i, 'range': c}
+         for c in _chunks_1d(size, round(size / slice_size) or 1)]
+        if size else []
+        for i, size in enumerate(map(int, dataset_sizes))]
+
+    strips: _typing.List[_Strip] = []
+    for i0, slices0 in enumerate(slices):
+        slices1 = [dataset_chunk1
+                   for later_slices in slices[i0 + 1:]
+                   for dataset_chunk1 in later_slices]
+        if slices1:
+            strips.extend((dataset_chunk0, slices1)
+                          for dataset_chunk0 in slices0)
+
+    # With runs of at most a quarter of a worker's share, no worker
+    # gets much more than a quarter more than its share.
+    total_cost = sum(map(_strip_cost, strips))
+    cost_aim = max(total_cost / (_RUNS_PER_WORKER * workers), 1)
+    strips = [split_strip
+              for strip in strips
+              for split_strip in _split_strip(strip, cost_aim)]
+
+    # Longest processing time first: give the next largest strip to the
+    # worker with the least work. sorted is stable, so equal strips stay
+    # in order.
+    order = sorted(range(len(strips)),
+                   key=lambda i: _strip_cost(strips[i]), reverse=True)
+    loads = [0] * workers
+    assigned: _typing.List[_typing.List[int]] = [[] for _ in range(workers)]
+    for i in order:
+        worker = loads.index(min(loads))
+        assigned[worker].append(i)
+        loads[worker] += _strip_cost(strips[i])
+
+    schedule = []
+    for strip_indices in assigned:
+        chunks: _typing.List[_typechecking.ChunkInfo] = []
+        for j, i in enumerate(sorted(strip_indices)):
+            dataset_chunk0, dataset_chunks1 = strips[i]
+            if j % 2:
+                dataset_chunks1 = dataset_chunks1[::-1]
+            chunks.extend([dataset_chunk0, dataset_chunk1]
+                          for dataset_chunk1 in dataset_chunks1)
+        schedule.append(chunks)
+    return schedule
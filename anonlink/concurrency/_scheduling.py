@@ -0,0 +1,143 @@
+"""Scheduling chunks over workers with work stealing."""
+
+import threading as _threading
+import typing as _typing
+
+import anonlink.typechecking as _typechecking
+
+
+class _Task:
+    # The records of a chunk's first dataset that are yet to be handed
+    # out. Pieces are taken from the start, and thieves take the end.
+    __slots__ = 'chunk', 'start', 'end', 'columns'
+
+    def __init__(self, chunk: _typechecking.ChunkInfo,
+                 start: int, end: int) -> None:
+        self.chunk = chunk
+        self.start = start
+        self.end = end
+        a1, b1 = chunk[1]['range']
+        self.columns = b1 - a1
+
+    @property
+    def cost(self) -> int:
+        return (self.end - self.start) * self.columns
+
+
+class WorkStealingScheduler:
+    """Hand out chunks to workers, rebalancing them as the workers run.
+
+    The coarse chunks are first divided between the workers, balancing
+    their number of comparisons. Each worker then asks for work with
+    `next_chunk` and receives a piece of its current chunk: the same
+    chunk, with the range of its first dataset narrowed to about
+    `piece_size_aim` comparisons. A worker that has finished its own
+    chunks steals from the worker with the most remaining comparisons:
+    a chunk that it has not started, or else the second half of the
+    remaining range of the chunk it is working through.
+
+    Pieces of a chunk cover its whole range of the second dataset, so
+    they are processed and merged exactly like the chunk itself. If `k`
+    is used, the chunks themselves must cover the whole of their second
+    dataset for the merged result to be exact.
+
+    The scheduler is thread-safe. It runs in the process that submits
+    the pieces, so the workers only ever see plain chunks.
+
+    :param chunks: The chunks, as returned by `split_to_chunks`. Every
+        chunk must have two datasets.
+    :param workers: The number of workers.
+    :param piece_size_aim: The number of comparisons per piece to aim
+        for. Smaller pieces balance the load better but cost more
+        overhead.
+    """
+
+    def __init__(
+        self,
+        chunks: _typing.Iterable[_typechecking.ChunkInfo],
+        workers: int,
+        *,
+        piece_size_aim: float
+    ) -> None:
+        if workers < 1:
+            raise ValueError(f'workers must be positive (got {workers})')
+        if piece_size_aim <= 0:
+            raise ValueError(
+                f'piece_size_aim must be positive (got {piece_size_aim})')
+        self._piece_size_aim = piece_size_aim
+        self._lock = _threading.Lock()
+        self._queues: _typing.List[_typing.List[_Task]] \
+            = [[] for _ in range(workers)]
+        self.steals = 0
+
+        tasks = []
+        for chunk in chunks:
+            if len(chunk) != 2:
+                raise ValueError(
+                    f'only chunks with two datasets can be scheduled (got '
+                    f'chunk with {len(chunk)})')
+            task = _Task(chunk, *chunk[0]['range'])
+            if task.cost:
+                tasks.append(task)
+        # Longest processing time first: give the next largest chunk to
+        # the worker with the least work.
+        tasks.sort(key=lambda task: task.cost, reverse=True)
+        loads = [0] * workers
+        for task in tasks:
+            worker = loads.index(min(loads))
+            self._queues[worker].append(task)
+            loads[worker] += task.cost
+
+    def _steal(self, thief: int) -> bool:
+        victim_task = None
+        victim_i = victim_j = -1
+        for i, queue in enumerate(self._queues):
+            if i == thief:
+                continue
+            for j, task in enumerate(queue):
+                if victim_task is None or task.cost > victim_task.cost:
+                    victim_task = task
+                    victim_i = i
+                    victim_j = j
+        if victim_task is None:
+            return False
+
+        victim_queue = self._queues[victim_i]
+        rows = victim_task.end - victim_task.start
+        if victim_j == 0 and rows > 1:
+            # The victim is working through this chunk: take the second
+            # half of what is left of it.
+            middle = victim_task.start + rows // 2
+            stolen = _Task(victim_task.chunk, middle, victim_task.end)
+            victim_task.end = middle
+        else:
+            stolen = victim_queue.pop(victim_j)
+        self._queues[thief].append(stolen)
+        self.steals += 1
+        return True
+
+    def next_chunk(self, worker: int) -> _typing.Optional[
+            _typechecking.ChunkInfo]:
+        """Get the next piece of work for a worker.
+
+        :param worker: The index of the worker, less than `workers`.
+
+        :return: A chunk to process, or None if no work remains.
+        """
+        with self._lock:
+            queue = self._queues[worker]
+            if not queue and not self._steal(worker):
+                return None
+            task = queue[0]
+            rows = max(1, int(self._piece_size_aim // max(task.columns, 1)))
+            start = task.start
+            end = min(start + rows, task.end)
+            task.start = end
+            if task.start == task.end:
+                queue.pop(0)
+            dataset_chunk0, dataset_chunk1 = task.chunk
+            piece: _typechecking.ChunkInfo = [
+                {'datasetIndex': dataset_chunk0['datasetIndex'],
+                 'range': [start, end]},
+                dataset_chunk1]
+            return piece
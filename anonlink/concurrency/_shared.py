@@ -0,0 +1,233 @@
+"""Datasets of filters in shared memory, for process-pool workers."""
+
+import typing as _typing
+from multiprocessing import shared_memory as _shared_memory
+
+import bitarray as _bitarray
+import numpy as _np
+
+import anonlink.typechecking as _typechecking
+
+_POPCOUNT_DTYPE = _np.uint32
+_ALIGNMENT = 64  # Bytes. Keeps every matrix on its own cache lines.
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _packed_filters(
+    dataset: _typechecking.Dataset
+) -> _typing.Tuple[_typing.List[bytes], int, str]:
+    # Return the bytes of every filter, the number of bytes per filter,
+    # and the bit endianness to restore them with.
+    endian = 'big'
+    packed: _typing.List[bytes] = []
+    for record in dataset:
+        if isinstance(record, _bitarray.bitarray):
+            if not packed:
+                endian = record.endian()
+            elif record.endian() != endian:
+                record = _bitarray.bitarray(record, endian=endian)
+            if len(record) % 8:
+                raise ValueError(
+                    f'only filters whose length in bits is a multiple of 8 '
+                    f'can be shared (got filter with length {len(record)})')
+            packed.append(record.tobytes())
+        else:
+            try:
+                packed.append(memoryview(record).tobytes())
+            except TypeError:
+                raise TypeError('unsupported record type') from None
+    filter_bytes = len(packed[0]) if packed else 0
+    if any(len(record) != filter_bytes for record in packed):
+        raise ValueError('inconsistent filter length')
+    return packed, filter_bytes, endian
+
+
+def _popcounts_inplace(filters: _np.ndarray, out: _np.ndarray) -> None:
+    # Unpack a block of rows at a time to bound the memory used.
+    block_rows = 4096
+    for start in range(0, filters.shape[0], block_rows):
+        block = filters[start:start + block_rows]
+        out[start:start + block_rows] = _np.unpackbits(block, axis=1).sum(
+            axis=1, dtype=_POPCOUNT_DTYPE)
+
+
+class SharedDataset(_typing.Sequence[_bitarray.bitarray]):
+    """A range of the filters of a dataset in shared memory.
+
+    It is a sequence of bitarrays backed by the shared memory. Slicing
+    it returns another range without copying. The Dice coefficient
+    kernels read the `filters` and `popcounts` attributes directly
+    instead of the bitarrays.
+
+    :ivar filters: The filters as a matrix of bytes, one per row.
+    :ivar popcounts: The popcounts of the filters.
+    :ivar endian: The bit endianness of the bitarrays.
+    """
+
+    def __init__(
+        self,
+        filters: _np.ndarray,
+        popcounts: _np.ndarray,
+        endian: str
+    ) -> None:
+        self.filters = filters
+        self.popcounts = popcounts
+        self.endian = endian
+
+    def __len__(self) -> int:
+        return self.filters.shape[0]
+
+    @_typing.overload
+    def __getitem__(self, index: int) -> _bitarray.bitarray: ...
+
+    @_typing.overload
+    def __getitem__(self, index: slice) -> 'SharedDataset': ...
+
+    def __getitem__(
+        self,
+        index: _typing.Union[int, slice]
+    ) -> _typing.Union[_bitarray.bitarray, 'SharedDataset']:
+        if isinstance(index, slice):
+            return SharedDataset(self.filters[index], self.popcounts[index],
+                                 self.endian)
+        return _bitarray.bitarray(buffer=self.filters[index],
+                                  endian=self.endian)
+
+
+class SharedDatasets:
+    """Datasets of filters, packed into one block of shared memory.
+
+    The filters of every dataset are stored as a matrix with one row of
+    bytes per filter, followed by their popcounts, which the Dice
+    coefficient kernel reads instead of counting them again. Other
+    processes attach to the block with `SharedDatasets.attach(info)`,
+    where `info` is the small, JSON-serialisable `info` attribute, and
+    read the filters without copying them.
+
+    Create it as a context manager, or call `close` and `unlink` when
+    done. Only the creator unlinks the memory.
+
+    :param datasets: A sequence of datasets. Each dataset is a sequence
+        of bitarrays or bytes-like objects of the same length in bytes.
+    """
+
+    def __init__(
+        self,
+        datasets: _typing.Sequence[_typechecking.Dataset]
+    ) -> None:
+        packed_datasets = [_packed_filters(dataset) for dataset in datasets]
+
+        infos: _typing.List[_typing.Dict[str, _typing.Any]] = []
+        offset = 0
+        for packed, filter_bytes, endian in packed_datasets:
+            filters_offset = _aligned(offset)
+            popcounts_offset = _aligned(
+                filters_offset + len(packed) * filter_bytes)
+            offset = (popcounts_offset
+                      + len(packed) * _np.dtype(_POPCOUNT_DTYPE).itemsize)
+            infos.append({'size': len(packed),
+                          'filterBytes': filter_bytes,
+                          'endian': endian,
+                          'filtersOffset': filters_offset,
+                          'popcountsOffset': popcounts_offset})
+
+        # A block of size 0 is not permitted.
+        self._shm = _shared_memory.SharedMemory(create=True,
+                                                size=max(offset, 1))
+        self._owner = True
+        self.info: _typing.Dict[str, _typing.Any] = {
+            'name': self._shm.name, 'datasets': infos}
+
+        try:
+            for i, (packed, _, _) in enumerate(packed_datasets):
+                filters = self.filters(i)
+                for j, record in enumerate(packed):
+                    filters[j] = _np.frombuffer(record, dtype=_np.uint8)
+                _popcounts_inplace(filters, self.popcounts(i))
+                del filters
+        except BaseException:
+            self._shm.close()
+            self._shm.unlink()
+            raise
+
+    @classmethod
+    def attach(cls, info: _typing.Mapping[str, _typing.Any]
+               ) -> 'SharedDatasets':
+        """Attach to datasets created by another process.
+
+        :param info: The `info` attribute of the creator.
+
+        :return: The shared datasets. They must not be modified.
+        """
+        self = cls.__new__(cls)
+        self._shm = _shared_memory.SharedMemory(name=info['name'])
+        self._owner = False
+        self.info = dict(info)
+        return self
+
+    def __len__(self) -> int:
+        return len(self.info['datasets'])
+
+    def filters(self, dataset_index: int) -> _np.ndarray:
+        """The filters of a dataset as a matrix of bytes, one per row.
+
+        The matrix is a view of the shared memory.
+        """
+        info = self.info['datasets'][dataset_index]
+        size = info['size']
+        filter_bytes = info['filterBytes']
+        return _np.ndarray((size, filter_bytes), dtype=_np.uint8,
+                           buffer=self._shm.buf,
+                           offset=info['filtersOffset'])
+
+    def popcounts(self, dataset_index: int) -> _np.ndarray:
+        """The popcounts of the filters of a dataset.
+
+        The array is a view of the shared memory.
+        """
+        info = self.info['datasets'][dataset_index]
+        return _np.ndarray((info['size'],), dtype=_POPCOUNT_DTYPE,
+                           buffer=self._shm.buf,
+                           offset=info['popcountsOffset'])
+
+    def dataset(
+        self,
+        dataset_index: int,
+        start: int = 0,
+        end: _typing.Optional[int] = None
+    ) -> SharedDataset:
+        """Filters of a dataset as bitarrays backed by the shared memory.
+
+        :param dataset_index: The index of the dataset.
+        :param start: The index of the first record to return.
+        :param end: One more than the index of the last record to
+            return. Default the size of the dataset.
+
+        :return: A sequence of bitarrays. It and its bitarrays must be
+            discarded before the shared datasets are closed.
+        """
+        endian = self.info['datasets'][dataset_index]['endian']
+        return SharedDataset(self.filters(dataset_index),
+                             self.popcounts(dataset_index),
+                             endian)[start:end]
+
+    def close(self) -> None:
+        """Detach from the shared memory in this process."""
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Free the shared memory. Only the creator may call this."""
+        if not self._owner:
+            raise RuntimeError('only the creator may unlink shared datasets')
+        self._shm.unlink()
+
+    def __enter__(self) -> 'SharedDatasets':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+        if self._owner:
+            self.unlink()
@@ -0,0 +1,223 @@
+"""Processing chunks with bounded memory by spilling to files."""
+
+import contextlib as _contextlib
+import functools as _functools
+import itertools as _itertools
+import os as _os
+import tempfile as _tempfile
+import typing as _typing
+
+import anonlink.serialization as _serialization
+import anonlink.typechecking as _typechecking
+from anonlink.concurrency._chunking import process_chunk
+from anonlink.concurrency._merging import merge_candidate_pairs
+
+# Bytes per candidate pair in memory: a double and four 32-bit indices.
+_CANDIDATE_PAIR_BYTES = 8 + 4 * 4
+# How much larger each range of records may be than the last one.
+_MAX_GROWTH = 4
+# The most files to open at once when merging them, well below the
+# usual limit of 1024 file descriptors per process.
+_MAX_OPEN_FILES = 256
+
+
+def _candidate_pairs_bytes(candidate_pairs: _typechecking.CandidatePairs
+                           ) -> int:
+    sims, dset_is, rec_is = candidate_pairs
+    return (sims.itemsize * len(sims)
+            + sum(a.itemsize * len(a) for a in dset_is)
+            + sum(a.itemsize * len(a) for a in rec_is))
+
+
+def _offset_blocking_f(
+    blocking_f: _typechecking.BlockingFunction,
+    dataset_indices: _typing.Tuple[int, int],
+    offset0: int,
+    dataset_index: int,
+    record_index: int,
+    hash_: _typechecking.Record
+) -> _typing.Iterable[_typing.Hashable]:
+    # Pass blocking_f the indices it would see for the whole chunk.
+    if dataset_index == 0:
+        record_index += offset0
+    return blocking_f(dataset_indices[dataset_index], record_index, hash_)
+
+
+def _dump_run(
+    results: _typing.List[_typechecking.CandidatePairs],
+    k: _typing.Optional[int],
+    directory: _typing.Optional[str]
+) -> str:
+    fd, path = _tempfile.mkstemp(suffix='.bin', dir=directory)
+    with open(fd, 'wb') as f:
+        _serialization.dump_candidate_pairs(
+            merge_candidate_pairs(results, k), f)
+    return path
+
+
+def _merge_streams_of_paths(
+    paths: _typing.Sequence[str],
+    f_out: _typing.BinaryIO,
+    k: _typing.Optional[int]
+) -> int:
+    with _contextlib.ExitStack() as stack:
+        files = [stack.enter_context(open(path, 'rb')) for path in paths]
+        return _serialization.merge_streams(files, f_out, k=k)
+
+
+def _merge_files(
+    paths: _typing.Iterable[str],
+    f_out: _typing.BinaryIO,
+    k: _typing.Optional[int] = None,
+    *,
+    directory: _typing.Optional[str] = None,
+    max_open_files: int = _MAX_OPEN_FILES
+) -> int:
+    # Like merge_streams on the files at paths, but with at most
+    # max_open_files of them open at once. While there are more, groups
+    # of them are merged into temporary files in directory. Enforcing k
+    # on every group is exact, since the top k candidate pairs of the
+    # union are among the top k of the groups.
+    if max_open_files < 2:
+        raise ValueError(
+            f'max_open_files must be at least 2 (got {max_open_files})')
+    paths = list(paths)
+    temp_paths: _typing.Set[str] = set()
+    try:
+        while len(paths) > max_open_files:
+            merged_paths = []
+            for start in range(0, len(paths), max_open_files):
+                group = paths[start:start + max_open_files]
+                if len(group) == 1:
+                    merged_paths.extend(group)
+                    continue
+                fd, path = _tempfile.mkstemp(suffix='.bin', dir=directory)
+                temp_paths.add(path)
+                with open(fd, 'wb') as f:
+                    _merge_streams_of_paths(group, f, k)
+                merged_paths.append(path)
+                for merged_path in group:
+                    if merged_path in temp_paths:
+                        temp_paths.remove(merged_path)
+                        _os.remove(merged_path)
+            paths = merged_paths
+        return _merge_streams_of_paths(paths, f_out, k)
+    finally:
+        for path in temp_paths:
+            _os.remove(path)
+
+
+def process_chunk_to_file(
+    chunk: _typechecking.ChunkInfo,
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    similarity_f: _typechecking.SimilarityFunction,
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None,
+    *,
+    memory_budget: int = 64 << 20,
+    directory: _typing.Optional[str] = None
+) -> str:
+    """Find candidate pairs for the chunk, writing them to a file.
+
+    Unlike `process_chunk`, the candidate pairs never need to be in
+    memory all at once. Every pair of datasets in the chunk is processed
+    a range of records of its first dataset at a time. Results are kept
+    until they exceed half of `memory_budget`, then sorted and written
+    to a temporary file in the `anonlink.serialization` format. Finally,
+    the temporary files are merged with `merge_streams`.
+
+    The ranges start small enough that even if every pair of records
+    were a candidate pair, the results would fit in `memory_budget`.
+    They grow according to the number of candidate pairs found so far.
+    One record that matches more records than fit in the budget will
+    exceed it.
+
+    :param chunk: Chunk to process, as returned by `split_to_chunks`.
+    :param datasets: A sequence of datasets, one for every dataset in
+        `chunk`, as in `process_chunk`.
+    :param similarity_f: A function that computes a similarity matrix
+        between two sequences of hashes and finds candidates above the
+        threshold.
+    :param threshold: The similarity threshold. We accept pairs that
+        have similarity of at least this value.
+    :param k: Only permit this many candidate pairs per dataset pair per
+        record. Set to `None` to permit all pairs above with similarity
+        at least `threshold`.
+    :param blocking_f: A function returning all block IDs for a record,
+        as in `process_chunk`. It is passed the same indices as it would
+        be by `process_chunk` for the whole chunk.
+    :param memory_budget: The approximate number of bytes of candidate
+        pairs to hold in memory. Default 64 MiB.
+    :param directory: The directory to write files to. Default the
+        system's temporary directory.
+
+    :return: The path of a file with the candidate pairs of the chunk,
+        as they would be returned by `process_chunk`. The caller is
+        responsible for deleting it.
+    """
+    if memory_budget <= 0:
+        raise ValueError(
+            f'memory_budget must be positive (got {memory_budget})')
+    if len(chunk) != len(datasets):
+        raise ValueError(
+            f'number of datasets does not match chunk (expected {len(chunk)}, '
+            f'got {len(datasets)})')
+
+    run_paths = []
+    try:
+        results: _typing.List[_typechecking.CandidatePairs] = []
+        results_bytes = 0
+        for i0, i1 in _itertools.combinations(range(len(chunk)), 2):
+            dataset_chunk0, dataset_chunk1 = chunk[i0], chunk[i1]
+            dataset0, dataset1 = datasets[i0], datasets[i1]
+            a0, b0 = dataset_chunk0['range']
+            size1 = len(dataset1)
+            if a0 == b0 or not size1:
+                continue
+            rows = max(1, memory_budget // (size1 * _CANDIDATE_PAIR_BYTES))
+            start = 0
+            while start < b0 - a0:
+                end = min(start + rows, b0 - a0)
+                sub_chunk: _typechecking.ChunkInfo = [
+                    {'datasetIndex': dataset_chunk0['datasetIndex'],
+                     'range': [a0 + start, a0 + end]},
+                    dataset_chunk1]
+                sub_blocking_f = (
+                    None if blocking_f is None
+                    else _functools.partial(_offset_blocking_f, blocking_f,
+                                            (i0, i1), start))
+                result = process_chunk(
+                    sub_chunk, [dataset0[start:end], dataset1],
+                    similarity_f, threshold, k=k, blocking_f=sub_blocking_f)
+                result_bytes = _candidate_pairs_bytes(result)
+                results.append(result)
+                results_bytes += result_bytes
+                if 2 * results_bytes > memory_budget:
+                    run_paths.append(_dump_run(results, k, directory))
+                    results = []
+                    results_bytes = 0
+
+                # Aim for half the budget per range, given the number of
+                # candidate pairs per record so far.
+                bytes_per_row = max(result_bytes / (end - start), 1)
+                rows = max(1, min(rows * _MAX_GROWTH,
+                                  int(memory_budget / (2 * bytes_per_row))))
+                start = end
+
+        if results or not run_paths:
+            run_paths.append(_dump_run(results, k, directory))
+        if len(run_paths) == 1:
+            return run_paths.pop()
+
+        fd, path = _tempfile.mkstemp(suffix='.bin', dir=directory)
+        try:
+            with open(fd, 'wb') as f_out:
+                _merge_files(run_paths, f_out, k, directory=directory)
+        except BaseException:
+            _os.remove(path)
+            raise
+        return path
+    finally:
+        for run_path in run_paths:
+            _os.remove(run_path)
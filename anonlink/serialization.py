@@ -9,10 +9,16 @@ import heapq as _heapq
 import io as _io
 import itertools as _itertools
 import operator as _operator
+import os as _os
 import struct as _struct
 import typing as _typing
 
+import numpy as _np
+
+import anonlink.tracing as _tracing
 import anonlink.typechecking as _typechecking
+from anonlink.candidate_generation import (_CandidatePairIterable,
+                                           _enforce_k)
 
 # FILE FORMAT
 #   This is subject to change.
@@ -226,8 +232,10 @@ def dump_candidate_pairs(
 
     :return: Number of bytes written.
     """
-    bytes_iter, _ = dump_candidate_pairs_iter(candidate_pairs)
-    return _write_bytes_iter(f, bytes_iter)
+    with _tracing.stage('dump_candidate_pairs') as span:
+        span.items = len(candidate_pairs[0])
+        bytes_iter, _ = dump_candidate_pairs_iter(candidate_pairs)
+        return _write_bytes_iter(f, bytes_iter)
 
 
 def load_candidate_pairs(f: _typing.BinaryIO) -> _typechecking.CandidatePairs:
@@ -238,6 +246,15 @@ def load_candidate_pairs(f: _typing.BinaryIO) -> _typechecking.CandidatePairs:
     :return: Candidate pairs, compatible with the type returned from a
         similarity function.
     """
+    with _tracing.stage('load_candidate_pairs') as span:
+        candidate_pairs = _load_candidate_pairs(f)
+        span.items = len(candidate_pairs[0])
+    return candidate_pairs
+
+
+def _load_candidate_pairs(
+    f: _typing.BinaryIO
+) -> _typechecking.CandidatePairs:
     iterable_with_sizes = _load_to_iter_with_sizes(f)
     iterable, sim_t_size, dset_i_t_size, rec_i_t_size, _ = iterable_with_sizes
 
@@ -275,6 +292,96 @@ def load_candidate_pairs(f: _typing.BinaryIO) -> _typechecking.CandidatePairs:
     return sims, (dset_is0, dset_is1), (rec_is0, rec_is1)
 
 
+def load_candidate_pairs_mmap(
+    path: _typing.Union[str, _os.PathLike]
+) -> _typechecking.CandidatePairs:
+    """Map candidate pairs from a file into memory without reading it.
+
+    The file is memory-mapped read-only. The similarities and indices
+    are returned as NumPy arrays that are views of the mapping, so the
+    operating system only reads the parts that are used. They are
+    accepted in place of arrays by `anonlink.stats`.
+
+    :param path: The path of the file, as written by
+        `dump_candidate_pairs` or `merge_streams`.
+
+    :return: Candidate pairs whose similarities and indices are NumPy
+        arrays.
+    """
+    path = _os.fspath(path)
+    with open(path, 'rb') as f:
+        dtype = _entry_dtype(*_load_header_and_check_version(f))
+
+    entries = _number_entries(_os.path.getsize(path), dtype.itemsize)
+    data: _np.ndarray
+    if entries:
+        data = _np.memmap(path, dtype=dtype, mode='r',
+                          offset=_HEADER_STRUCT.size, shape=(entries,))
+    else:
+        # Empty mappings are not permitted.
+        data = _np.empty(0, dtype=dtype)
+    return _entries_to_candidate_pairs(data)
+
+
+def load_to_blocks(
+    f: _typing.BinaryIO,
+    block_entries: int = 1 << 16
+) -> _typing.Iterator[_typechecking.CandidatePairs]:
+    """Load candidate pairs from file in blocks.
+
+    Only one block is in memory at a time, and every block is read with
+    one call to `f.read`. This is much faster than `load_to_iterable`
+    for large files.
+
+    :param f: Binary stream to read from.
+    :param block_entries: The number of candidate pairs per block.
+        Default 65536.
+
+    :return: An iterator of candidate pairs, one per block, whose
+        similarities and indices are NumPy arrays.
+    """
+    if block_entries < 1:
+        raise ValueError(
+            f'block_entries must be positive (got {block_entries})')
+    f = _make_buffered(f)
+    dtype = _entry_dtype(*_load_header_and_check_version(f))
+    block_bytes = block_entries * dtype.itemsize
+    while True:
+        buffer = f.read(block_bytes)
+        if not buffer:
+            return
+        if len(buffer) % dtype.itemsize:
+            raise ValueError('ran out of input')
+        yield _entries_to_candidate_pairs(_np.frombuffer(buffer, dtype=dtype))
+
+
+def _entry_dtype(
+    sim_t_size: int,
+    dset_i_t_size: int,
+    rec_i_t_size: int
+) -> _np.dtype:
+    # The NumPy equivalent of _entry_struct. This also checks that the
+    # sizes are supported.
+    entry_struct = _entry_struct(sim_t_size, dset_i_t_size, rec_i_t_size)
+    dtype = _np.dtype([('sim', f'<f{sim_t_size}'),
+                       ('dsetI0', f'<u{dset_i_t_size}'),
+                       ('dsetI1', f'<u{dset_i_t_size}'),
+                       ('recI0', f'<u{rec_i_t_size}'),
+                       ('recI1', f'<u{rec_i_t_size}')])
+    assert dtype.itemsize == entry_struct.size
+    return dtype
+
+
+def _entries_to_candidate_pairs(
+    entries: _np.ndarray
+) -> _typechecking.CandidatePairs:
+    # NumPy arrays stand in for the arrays of CandidatePairs.
+    return _typing.cast(_typechecking.CandidatePairs,
+                        (entries['sim'],
+                         (entries['dsetI0'], entries['dsetI1']),
+                         (entries['recI0'], entries['recI1'])))
+
+
 def _number_entries(file_size, entry_size):
     entries, remainder = divmod(file_size - _HEADER_STRUCT.size, entry_size)
     if remainder:
@@ -285,7 +392,8 @@ def _number_entries(file_size, entry_size):
 def merge_streams_iter(
     files_in: _typing.Iterable[_typing.BinaryIO],
     *,
-    sizes: _typing.Optional[_typing.Iterable[int]] = None
+    sizes: _typing.Optional[_typing.Iterable[int]] = None,
+    k: _typing.Optional[int] = None
 ) -> _typing.Tuple[_typing.Iterable[bytes], int]:
     """Merge multiple files with candidate pairs to iterable of bytes.
 
@@ -301,10 +409,13 @@ def merge_streams_iter(
     :param files_in: Sequence of files to read from.
     :param sizes: Optional iterable of file sizes. Permits us to compute
         the number of bytes in the returned iterator.
+    :param k: Only keep this many candidate pairs per dataset pair per
+        record in the merged result, as in `find_candidate_pairs`. Set
+        to `None` to keep all pairs.
 
     :return: 2-tuple containing an iterable of bytes objects and 
-        (optionally if the `sizes` parameter was provided) the length of
-        the merged file as an integer.
+        (optionally if the `sizes` parameter was provided and `k` is
+        `None`) the length of the merged file as an integer.
     """
     if not files_in:
         raise ValueError('no files provided')
@@ -322,14 +433,16 @@ def merge_streams_iter(
 
     # Sort in decreasing order of similarities. Tiebreak with dataset
     # indices and then with record indices, in increasing order.
-    sorted_iterable = _heapq.merge(*file_iterables,
-                                   key=lambda x: (-x[0],) + x[1:])
+    sorted_iterable: _CandidatePairIterable = _heapq.merge(
+        *file_iterables, key=lambda x: (-x[0],) + x[1:])
+    if k is not None:
+        sorted_iterable = _enforce_k(sorted_iterable, k)
     bytes_iter = _bytes_iter_from_iterable(
         sim_t_size, dset_i_t_size, rec_i_t_size,
         entry_struct,
         sorted_iterable)
 
-    if sizes is not None:
+    if sizes is not None and k is None:
         entries_num = sum(map(_number_entries, sizes, file_entry_size))
         file_size = _file_size(entry_struct, entries_num)
     else:
@@ -340,7 +453,9 @@ def merge_streams_iter(
 
 def merge_streams(
     files_in: _typing.Iterable[_typing.BinaryIO],
-    f_out: _typing.BinaryIO
+    f_out: _typing.BinaryIO,
+    *,
+    k: _typing.Optional[int] = None
 ) -> int:
     """Merge multiple files with serialised candidate pairs.
 
@@ -355,8 +470,12 @@ def merge_streams(
 
     :param files_in: Sequence of files to read from.
     :param f_out: Binary stream write the merged candidate pairs to.
+    :param k: Only keep this many candidate pairs per dataset pair per
+        record in the merged result, as in `find_candidate_pairs`. Set
+        to `None` to keep all pairs.
 
     :return: Number of bytes written.
     """
-    bytes_iter, _ = merge_streams_iter(files_in)
-    return _write_bytes_iter(f_out, bytes_iter)
+    with _tracing.stage('merge_streams', k=k):
+        bytes_iter, _ = merge_streams_iter(files_in, k=k)
+        return _write_bytes_iter(f_out, bytes_iter)
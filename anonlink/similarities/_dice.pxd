@@ -1,6 +1,16 @@
 
 cdef extern from "dice.cpp":
 
+    cdef struct DiceCounters:
+        unsigned long long comparisons
+        unsigned long long popcount_pruned
+        unsigned long long computed
+        unsigned long long below_threshold
+        unsigned long long dynamic_pruned
+        unsigned long long heap_pushes
+        unsigned long long heap_pops
+        unsigned long long nanoseconds
+
     int match_one_against_many_dice_k_top(
             const char[] one,
             const char[] many,
@@ -13,6 +23,19 @@ cdef extern from "dice.cpp":
             double[] scores
     ) nogil
 
+    int match_one_against_many_dice_k_top_counted(
+            const char[] one,
+            const char[] many,
+            const unsigned int[] counts_many,
+            int n,
+            int keybytes,
+            unsigned int k,
+            double threshold,
+            unsigned int[] indices,
+            double[] scores,
+            DiceCounters *counters
+    ) nogil
+
     double dice_coeff(const char[] array1, const char[] array2, int array_bytes) nogil
 
     double popcount_arrays(
@@ -1,9 +1,18 @@
+from typing import Dict, Optional
+
 import anonlink.typechecking as _typechecking
 
 
 def popcount_arrays(input_data: _typechecking.CharArrayType, array_bytes: int) -> _typechecking.IntArrayType: ...
 
 
+def popcount_arrays_preallocated_output(
+        output_counts: _typechecking.IntArrayType,
+        input_data: _typechecking.CharArrayType,
+        array_bytes: int = ...
+) -> float: ...
+
+
 def dice_many_to_many(
         carr0: _typechecking.CharArrayType,
         carr1: _typechecking.CharArrayType,
@@ -15,5 +24,8 @@ def dice_many_to_many(
         threshold: float,
         result_sims: _typechecking.FloatArrayType,
         result_indices0: _typechecking.IntArrayType,
-        result_indices1: _typechecking.IntArrayType
+        result_indices1: _typechecking.IntArrayType,
+        offset0: int = ...,
+        offset1: int = ...,
+        counters: Optional[Dict[str, int]] = ...
 ): ...
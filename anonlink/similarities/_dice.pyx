@@ -1,4 +1,5 @@
 cimport cython
+from libc.string cimport memset
 
 from cpython cimport array
 import array
@@ -7,6 +8,8 @@ import array
 from anonlink.similarities._dice cimport popcount_arrays as c_popcount_arrays
 from anonlink.similarities._dice cimport dice_coeff as c_dice_coeff
 from anonlink.similarities._dice cimport match_one_against_many_dice_k_top as c_match_one_against_many_dice_k_top
+from anonlink.similarities._dice cimport match_one_against_many_dice_k_top_counted as c_match_one_against_many_dice_k_top_counted
+from anonlink.similarities._dice cimport DiceCounters
 
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing.
@@ -127,9 +130,26 @@ def dice_many_to_many(
         double threshold,
         array.array result_sims,
         array.array result_indices0,
-        array.array result_indices1
+        array.array result_indices1,
+        unsigned int offset0 = 0,
+        unsigned int offset1 = 0,
+        dict counters = None
 ):
+    """
+    Compare every filter of carr0 with every filter of carr1, appending
+    the top k matches of every filter of carr0 to the result arrays.
+
+    offset0 and offset1 are added to the record indices written to
+    result_indices0 and result_indices1, so a chunk of larger datasets
+    can be written with its global indices.
+
+    If counters is a dict, the kernel's counters are added to its
+    values: 'comparisons', 'popcount_pruned', 'computed',
+    'below_threshold', 'dynamic_pruned', 'heap_pushes', 'heap_pops' and
+    'nanoseconds'. Otherwise the kernel does not count.
+    """
     cdef size_t i
+    cdef int j
     cdef int matches
     cdef int total_matches = 0
     assert len(carr1) == filter_bytes * length_f1
@@ -150,24 +170,48 @@ def dice_many_to_many(
     cdef unsigned int[::1] indicies_memview = c_indices
     cdef unsigned int[::1] i_buffer_memview = i_buffer
 
+    cdef DiceCounters c_counters
+    memset(&c_counters, 0, sizeof(c_counters))
+
     for i in range(length_f0):
-        matches = match_one_to_many_dice_preallocated_output(
-            carr0[i * filter_bytes:(i + 1) * filter_bytes],
-            carr1,
-            c_popcounts,
-            length_f1,
-            filter_bytes,
-            k,
-            threshold,
-            indicies_memview,
-            scores_memview
-        )
+        if counters is None:
+            matches = match_one_to_many_dice_preallocated_output(
+                carr0[i * filter_bytes:(i + 1) * filter_bytes],
+                carr1,
+                c_popcounts,
+                length_f1,
+                filter_bytes,
+                k,
+                threshold,
+                indicies_memview,
+                scores_memview
+            )
+        else:
+            matches = c_match_one_against_many_dice_k_top_counted(
+                &carr0[i * filter_bytes],
+                &carr1[0],
+                &c_popcounts[0],
+                length_f1,
+                filter_bytes,
+                k,
+                threshold,
+                &indicies_memview[0],
+                &scores_memview[0],
+                &c_counters
+            )
         total_matches += matches
-        i_buffer_memview[:] = i
+        i_buffer_memview[:] = i + offset0
+        if offset1:
+            for j in range(matches):
+                indicies_memview[j] += offset1
 
         assert matches <= k
         result_sims.extend(c_scores[:matches])
         result_indices0.extend(i_buffer[:matches])
         result_indices1.extend(c_indices[:matches])
 
+    if counters is not None:
+        for key, value in (<dict>c_counters).items():
+            counters[key] = counters.get(key, 0) + value
+
     return total_matches
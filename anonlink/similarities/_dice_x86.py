@@ -1,10 +1,12 @@
 from array import array
 from itertools import chain, groupby, repeat
-from typing import Optional, Sequence, Tuple
+from time import perf_counter
+from typing import Any, Dict, Optional, Sequence, Tuple
 
 from bitarray import bitarray
 
 from anonlink.similarities import _dice
+from anonlink.tracing import stage
 from anonlink.similarities._utils import (sort_similarities_inplace,
                                           to_bitarrays)
 from anonlink.typechecking import FloatArrayType, IntArrayType
@@ -22,7 +24,9 @@ def _all_equal(iterable):
 def dice_coefficient_accelerated(
     datasets: Sequence[Sequence[bitarray]],
     threshold: float,
-    k: Optional[int] = None
+    k: Optional[int] = None,
+    *,
+    stats: Optional[Dict[str, float]] = None
 ) -> Tuple[FloatArrayType, Tuple[IntArrayType, ...]]:
     """Find Dice coefficients of CLKs.
 
@@ -44,6 +48,27 @@ def dice_coefficient_accelerated(
     :param k: Only permit this many candidate pairs per dataset pair
         per record. Set to `None` to permit all pairs above with
         similarity at least `threshold`.
+    :param stats: If given, the kernel counts the work it does, which
+        is added to the values of this dictionary (missing keys count
+        as 0), so it aggregates over many calls:
+            'comparisons', the pairs of records considered;
+            'popcount_pruned', the pairs skipped because their popcounts
+        are too far apart for the threshold, or because the record of
+        the first dataset has no bits set and the threshold is
+        positive;
+            'computed', the pairs whose Dice coefficient was computed,
+        or is known to be 0 because the record of the first dataset
+        has no bits set;
+            'below_threshold', the computed pairs below `threshold`;
+            'dynamic_pruned', the computed pairs at or above `threshold`
+        but below the threshold raised by the `k` best pairs found so
+        far for the record;
+            'heap_pushes' and 'heap_pops', the pushes onto and pops off
+        the heaps of the `k` best pairs of each record;
+            'kernel_seconds', the time spent in the kernel;
+            'popcount_seconds', the time spent counting the bits of the
+        second dataset's records.
+        Default None (do not count).
 
     :raises NotImplementedError: If an unsupported length filter is
         provided.
@@ -54,6 +79,21 @@ def dice_coefficient_accelerated(
         scores are an array of floating-point values. The indices are a
         2-tuple of arrays of integers.
     """
+    return _dice_coefficient_accelerated(datasets, threshold, k,
+                                         stats=stats)
+
+
+def _dice_coefficient_accelerated(
+    datasets: Sequence[Sequence[bitarray]],
+    threshold: float,
+    k: Optional[int] = None,
+    offsets: Tuple[int, int] = (0, 0),
+    *,
+    stats: Optional[Dict[str, float]] = None
+) -> Tuple[FloatArrayType, Tuple[IntArrayType, ...]]:
+    # As dice_coefficient_accelerated, but the kernel adds offsets to
+    # the record indices it writes. process_chunk uses this to produce
+    # global indices without another pass over the results.
     n_datasets = len(datasets)
     if n_datasets < 2:
         raise ValueError(f'not enough datasets (expected 2, got {n_datasets})')
@@ -100,13 +140,64 @@ def dice_coefficient_accelerated(
     # Current threshold was found by trying out different values while benchmarking
     POPCOUNT_NATIVE_THRESHOLD = 10000
     if len(filters1) < POPCOUNT_NATIVE_THRESHOLD:
+        start = perf_counter()
         c_popcounts = array('I', [f.count() for f in filters1])
+        popcount_seconds = perf_counter() - start
     else:
-        c_popcounts = _dice.popcount_arrays(carr1, filter_bytes)
+        # The kernel times itself in milliseconds.
+        c_popcounts = array('I', repeat(0, length_f1))
+        popcount_seconds = _dice.popcount_arrays_preallocated_output(
+            c_popcounts, carr1, filter_bytes) / 1000
+    if stats is not None:
+        stats['popcount_seconds'] = (stats.get('popcount_seconds', 0)
+                                     + popcount_seconds)
+
+    return _dice_coefficient_packed(
+        carr0, carr1, length_f0, c_popcounts, filter_bytes, threshold, k,
+        offsets, stats=stats)
+
+
+def _dice_coefficient_packed(
+    carr0: Any,
+    carr1: Any,
+    length_f0: int,
+    popcounts1: Any,
+    filter_bytes: int,
+    threshold: float,
+    k: Optional[int] = None,
+    offsets: Tuple[int, int] = (0, 0),
+    *,
+    stats: Optional[Dict[str, float]] = None
+) -> Tuple[FloatArrayType, Tuple[IntArrayType, ...]]:
+    # As _dice_coefficient_accelerated, but on filters already packed
+    # into contiguous buffers of signed chars, with the popcounts of the
+    # second dataset's filters. Any contiguous buffers of signed chars
+    # and of unsigned ints will do, so workers of run_parallel pass the
+    # numpy views of the filters and popcounts in shared memory.
+    result_sims: FloatArrayType = array('d')
+    result_indices0: IntArrayType = array('I')
+    result_indices1: IntArrayType = array('I')
+
+    length_f1 = len(popcounts1)
+    if not length_f0 or not length_f1:
+        return result_sims, (result_indices0, result_indices1)
+    if k is None or k > length_f1:
+        k = length_f1
 
-    _dice.dice_many_to_many(
-        carr0, carr1, length_f0, length_f1, c_popcounts, filter_bytes, k,
-        threshold, result_sims, result_indices0, result_indices1)
+    counters: Optional[Dict[str, int]] = None if stats is None else {}
+    with stage('dice_kernel') as span:
+        span.items = length_f0 * length_f1
+        _dice.dice_many_to_many(
+            carr0, carr1, length_f0, length_f1, popcounts1, filter_bytes,
+            k, threshold, result_sims, result_indices0, result_indices1,
+            *offsets, counters)
+    if stats is not None:
+        assert counters is not None
+        nanoseconds = counters.pop('nanoseconds')
+        for key, value in counters.items():
+            stats[key] = stats.get(key, 0) + value
+        stats['kernel_seconds'] = (stats.get('kernel_seconds', 0)
+                                   + nanoseconds / 1e9)
 
     sort_similarities_inplace(result_sims, result_indices0, result_indices1)
 
@@ -1,3 +1,4 @@
+#include <chrono>
 #include <memory>
 #include <functional>
 #include <algorithm>
@@ -431,6 +432,229 @@ adjust_ptr_alignment(const char *ptr, size_t nbytes) {
 }
 
 
+/**
+ * Counters of the work done by match_one_against_many_dice_k_top.
+ * They are incremented, so they can be aggregated over many calls.
+ */
+struct DiceCounters {
+    // Pairs of records considered.
+    uint64_t comparisons;
+    // Pairs skipped because their popcounts are too far apart, or
+    // because the one record has no bits set.
+    uint64_t popcount_pruned;
+    // Pairs whose Dice coefficient was computed.
+    uint64_t computed;
+    // Computed pairs whose coefficient is below the threshold.
+    uint64_t below_threshold;
+    // Computed pairs at or above the threshold, but below the
+    // threshold raised by the top k scores found so far.
+    uint64_t dynamic_pruned;
+    // Scores pushed onto the heap of top k scores.
+    uint64_t heap_pushes;
+    // Scores popped from the heap to keep it to k scores.
+    uint64_t heap_pops;
+    // Time spent in the kernel.
+    uint64_t nanoseconds;
+};
+
+/**
+ * Calculate up to the top k indices and scores.  Returns the
+ * number matched above the given threshold
+ *
+ * When counted is true, counters is incremented with the work done.
+ * Otherwise it is never touched and the counting compiles away.
+ */
+template<bool counted>
+static int
+_match_one_against_many_dice_k_top(
+        const char *one,
+        const char *many,
+        const uint32_t *counts_many,
+        int n,
+        int keybytes,
+        uint32_t k,
+        double threshold,
+        unsigned int *indices,
+        double *scores,
+        DiceCounters *counters) {
+
+    uint32_t count_one;
+    if (counted) {
+        counters->comparisons += n;
+    }
+
+    // Here we create top_k_scores on the stack by providing it
+    // with a vector in which to put its elements. We do this so
+    // that we can reserve the amount of space needed for the
+    // scores in advance and avoid potential memory reallocation
+    // and copying. Note the data structure is a priority queue where
+    // the **lowest** score has the highest priority. The item with
+    // the lowest score is the first to be popped off the queue.
+    typedef std::vector<Node> node_vector;
+    typedef std::priority_queue<Node, std::vector<Node>, score_cmp> node_queue;
+    node_vector vec;
+    Node temp_node;
+    vec.reserve(k + 1);
+    node_queue top_k_scores(score_cmp(), vec);
+
+    double dynamic_threshold = threshold;
+    auto push_score = [&](double score, int idx) {
+        if (score >= dynamic_threshold) {
+            top_k_scores.push(Node(idx, score));
+            if (counted) {
+                ++counters->heap_pushes;
+            }
+            if (top_k_scores.size() > k) {
+                // Popping the top element is O(log(k))!
+                temp_node = top_k_scores.top();
+                top_k_scores.pop();
+                if (counted) {
+                    ++counters->heap_pops;
+                }
+                // threshold can now be raised
+                dynamic_threshold = temp_node.score;
+            }
+        } else if (counted) {
+            if (score >= threshold) {
+                ++counters->dynamic_pruned;
+            } else {
+                ++counters->below_threshold;
+            }
+        }
+    };
+    // Whether a pair passes the popcount filter.
+    auto popcounts_close = [&](uint32_t counts_many_j, uint32_t max_popcnt_delta) {
+        bool close = abs_diff(count_one, counts_many_j) <= max_popcnt_delta;
+        if (counted) {
+            ++(close ? counters->computed : counters->popcount_pruned);
+        }
+        return close;
+    };
+
+    // If one has no bits set, every pair scores 0 without computing
+    // it. At a threshold of at most 0, the first k pairs are kept.
+    auto count_empty_one = [&]() {
+        if (counted) {
+            counters->computed += n;
+            counters->heap_pushes += k;
+            counters->dynamic_pruned += n - k;
+        }
+    };
+
+    bool key_is_word_divisible = (keybytes > WORD_BYTES) && (keybytes % WORD_BYTES == 0);
+    if (key_is_word_divisible) {
+        // keybytes is divisible by WORD_BYTES
+        int keywords = keybytes / WORD_BYTES;
+        // The static_cast is to avoid int overflow in the multiplication
+        size_t total_bytes = static_cast<size_t>(n) * keybytes;
+        auto ptr_comp1 = adjust_ptr_alignment(one, total_bytes);
+        auto ptr_comp2 = adjust_ptr_alignment(many, total_bytes);
+        auto comp1 = ptr_comp1.get();
+        auto comp2 = ptr_comp2.get();
+
+        count_one = _popcount_array(comp1, keywords);
+
+        if (count_one == 0) {
+            if (threshold > 0) {
+                if (counted) {
+                    counters->popcount_pruned += n;
+                }
+                return 0;
+            }
+
+            count_empty_one();
+            for (uint32_t j = 0; j < k; ++j) {
+                scores[j] = 0.0;
+                indices[j] = j;
+            }
+
+            return static_cast<int>(k);
+        }
+
+        uint32_t max_popcnt_delta = keybytes * CHAR_BIT; // = bits per key
+        if(threshold > 0) {
+            max_popcnt_delta = calculate_max_difference(count_one, threshold);
+        }
+
+        const uint64_t *current = comp2;
+        // NB: For any key length that must run at maximum speed, we
+        // need to specialise a block in the following 'if' statement
+        // (which is an example of specialising to keywords == 16).
+        if (keywords == 16) {
+            for (int j = 0; j < n; j++, current += 16) {
+                const uint32_t counts_many_j = counts_many[j];
+                if (popcounts_close(counts_many_j, max_popcnt_delta)) {
+                    double score = _dice_coeff<16>(comp1, count_one, current, counts_many_j);
+                    push_score(score, j);
+                }
+            }
+        } else {
+            for (int j = 0; j < n; j++, current += keywords) {
+                const uint32_t counts_many_j = counts_many[j];
+                if (popcounts_close(counts_many_j, max_popcnt_delta)) {
+                    double score = _dice_coeff_generic(comp1, count_one, current, counts_many_j, keywords);
+                    push_score(score, j);
+                }
+            }
+        }
+
+    } else {
+        // As the keybytes is not evenly divisible by WORD_BYTES we
+        // process individual bytes instead of 64 bit words.
+        count_one = popcnt(one, keybytes);
+
+        // DUPLICATED FROM ABOVE
+        if (count_one == 0) {
+            if (threshold > 0) {
+                if (counted) {
+                    counters->popcount_pruned += n;
+                }
+                return 0;
+            }
+
+            count_empty_one();
+            for (uint32_t j = 0; j < k; ++j) {
+                scores[j] = 0.0;
+                indices[j] = j;
+            }
+
+            return static_cast<int>(k);
+        }
+        uint32_t max_popcnt_delta = keybytes * CHAR_BIT; // = bits per key
+        if(threshold > 0) {
+            max_popcnt_delta = calculate_max_difference(count_one, threshold);
+        }
+
+        const char *current = many;
+        char *andbuffer = new char[keybytes];
+
+        for (int j = 0; j < n; j++, current += keybytes) {
+            const uint32_t counts_many_j = counts_many[j];
+            if (popcounts_close(counts_many_j, max_popcnt_delta)) {
+                double score = _dice_coeff_chars(one, count_one, current, counts_many_j, andbuffer, keybytes);
+                push_score(score, j);
+            }
+        }
+        delete [] andbuffer;
+
+    }
+
+    // Copy the scores and indices in reverse order so that the
+    // best match is at index 0 and the worst is at index
+    // top_k_scores.size()-1.
+    int nscores = top_k_scores.size();
+    for (int i = top_k_scores.size() - 1; i >= 0; --i) {
+       scores[i] = top_k_scores.top().score;
+       indices[i] = top_k_scores.top().index;
+       assert(indices[i] >= 0);
+       assert(indices[i] <= k);
+       // Popping the top element is O(log(k))!
+       top_k_scores.pop();
+    }
+    assert(top_k_scores.empty());
+    return nscores;
+}
+
 extern "C"
 {
     /**
@@ -525,152 +749,32 @@ extern "C"
             double threshold,
             unsigned int *indices,
             double *scores) {
+        return _match_one_against_many_dice_k_top<false>(
+            one, many, counts_many, n, keybytes, k, threshold,
+            indices, scores, nullptr);
+    }
 
-        uint32_t count_one;
-
-        // Here we create top_k_scores on the stack by providing it
-        // with a vector in which to put its elements. We do this so
-        // that we can reserve the amount of space needed for the
-        // scores in advance and avoid potential memory reallocation
-        // and copying. Note the data structure is a priority queue where
-        // the **lowest** score has the highest priority. The item with
-        // the lowest score is the first to be popped off the queue.
-        typedef std::vector<Node> node_vector;
-        typedef std::priority_queue<Node, std::vector<Node>, score_cmp> node_queue;
-        node_vector vec;
-        Node temp_node;
-        vec.reserve(k + 1);
-        node_queue top_k_scores(score_cmp(), vec);
-        bool key_is_word_divisible = (keybytes > WORD_BYTES) && (keybytes % WORD_BYTES == 0);
-        if (key_is_word_divisible) {
-            // keybytes is divisible by WORD_BYTES
-            int keywords = keybytes / WORD_BYTES;
-            // The static_cast is to avoid int overflow in the multiplication
-            size_t total_bytes = static_cast<size_t>(n) * keybytes;
-            auto ptr_comp1 = adjust_ptr_alignment(one, total_bytes);
-            auto ptr_comp2 = adjust_ptr_alignment(many, total_bytes);
-            auto comp1 = ptr_comp1.get();
-            auto comp2 = ptr_comp2.get();
-
-            count_one = _popcount_array(comp1, keywords);
-
-            if (count_one == 0) {
-                if (threshold > 0) {
-                    return 0;
-                }
-
-                for (uint32_t j = 0; j < k; ++j) {
-                    scores[j] = 0.0;
-                    indices[j] = j;
-                }
-
-                return static_cast<int>(k);
-            }
-
-            uint32_t max_popcnt_delta = keybytes * CHAR_BIT; // = bits per key
-            if(threshold > 0) {
-                max_popcnt_delta = calculate_max_difference(count_one, threshold);
-            }
-
-            double dynamic_threshold = threshold;
-            auto push_score = [&](double score, int idx) {
-                if (score >= dynamic_threshold) {
-                    top_k_scores.push(Node(idx, score));
-                    if (top_k_scores.size() > k) {
-                        // Popping the top element is O(log(k))!
-                        temp_node = top_k_scores.top();
-                        top_k_scores.pop();
-                        // threshold can now be raised
-                        dynamic_threshold = temp_node.score;
-                    }
-                }
-            };
-
-            const uint64_t *current = comp2;
-            // NB: For any key length that must run at maximum speed, we
-            // need to specialise a block in the following 'if' statement
-            // (which is an example of specialising to keywords == 16).
-            if (keywords == 16) {
-                for (int j = 0; j < n; j++, current += 16) {
-                    const uint32_t counts_many_j = counts_many[j];
-                    if (abs_diff(count_one, counts_many_j) <= max_popcnt_delta) {
-                        double score = _dice_coeff<16>(comp1, count_one, current, counts_many_j);
-                        push_score(score, j);
-                    }
-                }
-            } else {
-                for (int j = 0; j < n; j++, current += keywords) {
-                    const uint32_t counts_many_j = counts_many[j];
-                    if (abs_diff(count_one, counts_many_j) <= max_popcnt_delta) {
-                        double score = _dice_coeff_generic(comp1, count_one, current, counts_many_j, keywords);
-                        push_score(score, j);
-                    }
-                }
-            }
-
-        } else {
-            // As the keybytes is not evenly divisible by WORD_BYTES we
-            // process individual bytes instead of 64 bit words.
-            count_one = popcnt(one, keybytes);
-
-            // DUPLICATED FROM ABOVE
-            if (count_one == 0) {
-                if (threshold > 0) {
-                    return 0;
-                }
-
-                for (uint32_t j = 0; j < k; ++j) {
-                    scores[j] = 0.0;
-                    indices[j] = j;
-                }
-
-                return static_cast<int>(k);
-            }
-            uint32_t max_popcnt_delta = keybytes * CHAR_BIT; // = bits per key
-            if(threshold > 0) {
-                max_popcnt_delta = calculate_max_difference(count_one, threshold);
-            }
-            double dynamic_threshold = threshold;
-            auto push_score = [&](double score, int idx) {
-                if (score >= dynamic_threshold) {
-                    top_k_scores.push(Node(idx, score));
-                    if (top_k_scores.size() > k) {
-                        // Popping the top element is O(log(k))!
-                        temp_node = top_k_scores.top();
-                        top_k_scores.pop();
-                        // threshold can now be raised
-                        dynamic_threshold = temp_node.score;
-                    }
-                }
-            };
-
-            const char *current = many;
-            char *andbuffer = new char[keybytes];
-
-            for (int j = 0; j < n; j++, current += keybytes) {
-                const uint32_t counts_many_j = counts_many[j];
-                if (abs_diff(count_one, counts_many_j) <= max_popcnt_delta) {
-                    double score = _dice_coeff_chars(one, count_one, current, counts_many_j, andbuffer, keybytes);
-                    push_score(score, j);
-                }
-            }
-            delete [] andbuffer;
-
-        }
-
-        // Copy the scores and indices in reverse order so that the
-        // best match is at index 0 and the worst is at index
-        // top_k_scores.size()-1.
-        int nscores = top_k_scores.size();
-        for (int i = top_k_scores.size() - 1; i >= 0; --i) {
-           scores[i] = top_k_scores.top().score;
-           indices[i] = top_k_scores.top().index;
-           assert(indices[i] >= 0);
-           assert(indices[i] <= k);
-           // Popping the top element is O(log(k))!
-           top_k_scores.pop();
-        }
-        assert(top_k_scores.empty());
+    /**
+     * As match_one_against_many_dice_k_top, but also increment
+     * counters with the work done and the time taken.
+     */
+    int match_one_against_many_dice_k_top_counted(
+            const char *one,
+            const char *many,
+            const uint32_t *counts_many,
+            int n,
+            int keybytes,
+            uint32_t k,
+            double threshold,
+            unsigned int *indices,
+            double *scores,
+            DiceCounters *counters) {
+        auto start = std::chrono::steady_clock::now();
+        int nscores = _match_one_against_many_dice_k_top<true>(
+            one, many, counts_many, n, keybytes, k, threshold,
+            indices, scores, counters);
+        counters->nanoseconds += std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::steady_clock::now() - start).count();
         return nscores;
     }
 }
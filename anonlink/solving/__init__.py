@@ -10,17 +10,26 @@ import typing as _typing
 import anonlink.typechecking as _typechecking
 
 from anonlink.solving._multiparty_solving_python import (
-    greedy_solve_python, probabilistic_greedy_solve_python)
+    connected_components_python, greedy_solve_python,
+    probabilistic_greedy_solve_python)
 try:
     from anonlink.solving._multiparty_solving import (
-        greedy_solve_native, probabilistic_greedy_solve_native)
+        connected_components_native, greedy_solve_native,
+        probabilistic_greedy_solve_native)
 except ImportError:
+    connected_components = connected_components_python
     greedy_solve = greedy_solve_python
     probabilistic_greedy_solve = probabilistic_greedy_solve_python
 else:
+    connected_components = connected_components_native
     greedy_solve = greedy_solve_native
     probabilistic_greedy_solve = probabilistic_greedy_solve_native
 
+from anonlink.solving._components import (
+    parallel_solve, partition_candidates)
+from anonlink.solving._bipartite import (
+    bipartite_optimal_solve, matching_weight, optimality_gap)
+
 
 def pairs_from_groups(
     groups: _typechecking.MatchGroups
@@ -0,0 +1,272 @@
+"""Optimal solving of bipartite problems."""
+
+import concurrent.futures as _futures
+import heapq as _heapq
+import typing as _typing
+
+import numpy as _np
+
+import anonlink.solving as _solving
+import anonlink.tracing as _tracing
+import anonlink.typechecking as _typechecking
+
+_INF = float('inf')
+
+
+def _bipartite_datasets(
+    candidates: _typechecking.CandidatePairs
+) -> _typing.Optional[_typing.Tuple[int, int]]:
+    _, dset_is, rec_is = candidates
+    if len(dset_is) != len(rec_is):
+        raise ValueError('inconsistent shape of index arrays')
+    if len(dset_is) != 2:
+        raise ValueError('non-bipartite problems are unsupported')
+    dset_is0, dset_is1 = dset_is
+    if not len(dset_is0):
+        return None
+    dset_i0 = dset_is0[0]
+    dset_i1 = dset_is1[0]
+    np_dset_is0 = _np.frombuffer(dset_is0, dtype=dset_is0.typecode)
+    np_dset_is1 = _np.frombuffer(dset_is1, dtype=dset_is1.typecode)
+    if (dset_i0 == dset_i1
+            or not (np_dset_is0 == dset_i0).all()
+            or not (np_dset_is1 == dset_i1).all()):
+        raise ValueError('non-bipartite problems are unsupported')
+    return dset_i0, dset_i1
+
+
+def _max_weight_matching(
+    adjacency: _typing.Sequence[_typing.Sequence[_typing.Tuple[int, float]]],
+    right_n: int
+) -> _typing.List[int]:
+    """Find a maximum weight matching of a bipartite graph.
+
+    This is the successive shortest path algorithm for min-cost flow
+    with edge costs equal to the negated weights. Each iteration runs
+    Dijkstra's algorithm on the residual graph, keeping edge costs
+    nonnegative with vertex potentials, and augments along the
+    shortest path from a free left vertex to a free right vertex. We
+    stop once that path no longer increases the weight of the matching.
+
+    :param adjacency: For every left vertex, a sequence of its edges as
+        two-tuples of right vertex and weight.
+    :param right_n: The number of right vertices.
+
+    :return: For every left vertex, the right vertex it is matched to,
+        or -1 if it is unmatched.
+    """
+    left_n = len(adjacency)
+    match_left = [-1] * left_n
+    match_right = [-1] * right_n
+    match_weight = [0.] * left_n
+
+    # The initial graph is acyclic, so we can start with the shortest
+    # distances from the source: 0 for left vertices and the negated
+    # heaviest incoming edge for right vertices.
+    potential_left = [0.] * left_n
+    potential_right = [0.] * right_n
+    for edges in adjacency:
+        for v, w in edges:
+            potential_right[v] = min(potential_right[v], -w)
+    potential_sink = min(potential_right, default=0.)
+
+    while True:
+        dist_left = [_INF] * left_n
+        dist_right = [_INF] * right_n
+        prev_right = [-1] * right_n
+        heap = []
+        for u in range(left_n):
+            if match_left[u] == -1:
+                dist_left[u] = -potential_left[u]
+                heap.append((dist_left[u], u))
+        _heapq.heapify(heap)
+
+        dist_sink = _INF
+        best_v = -1
+        while heap:
+            d, u = _heapq.heappop(heap)
+            if d > dist_left[u]:
+                continue
+            if d >= dist_sink:
+                break
+            base = d + potential_left[u]
+            for v, w in adjacency[u]:
+                if match_left[u] == v:
+                    continue
+                dist_v = base - w - potential_right[v]
+                if dist_v >= dist_right[v]:
+                    continue
+                dist_right[v] = dist_v
+                prev_right[v] = u
+                # Right vertices have at most one outgoing residual edge,
+                # so relax it straight away.
+                u_next = match_right[v]
+                if u_next == -1:
+                    dist_v_sink = dist_v + potential_right[v] - potential_sink
+                    if dist_v_sink < dist_sink:
+                        dist_sink = dist_v_sink
+                        best_v = v
+                else:
+                    dist_u_next = (dist_v + potential_right[v]
+                                   + match_weight[u_next]
+                                   - potential_left[u_next])
+                    if dist_u_next < dist_left[u_next]:
+                        dist_left[u_next] = dist_u_next
+                        _heapq.heappush(heap, (dist_u_next, u_next))
+
+        # The potentials are distances from the source, so
+        # dist_sink + potential_sink is the change in cost.
+        if best_v == -1 or dist_sink + potential_sink >= 0:
+            return match_left
+
+        for u in range(left_n):
+            potential_left[u] += min(dist_left[u], dist_sink)
+        for v in range(right_n):
+            potential_right[v] += min(dist_right[v], dist_sink)
+        potential_sink += dist_sink
+
+        v = best_v
+        while v != -1:
+            u = prev_right[v]
+            v_prev = match_left[u]
+            match_left[u] = v
+            match_right[v] = u
+            match_weight[u] = next(w for v_, w in adjacency[u] if v_ == v)
+            v = v_prev
+
+
+def _bipartite_optimal_solve_serial(
+    candidates: _typechecking.CandidatePairs
+) -> _typechecking.MatchGroups:
+    dsets = _bipartite_datasets(candidates)
+    if dsets is None:
+        return ()
+    dset_i0, dset_i1 = dsets
+    sims, _, (rec_is0, rec_is1) = candidates
+
+    # Solving every connected component separately keeps Dijkstra's
+    # searches local.
+    components, labels = _solving.connected_components(candidates)
+    np_labels = _np.frombuffer(labels, dtype=labels.typecode)
+    order = _np.argsort(np_labels, kind='mergesort')
+    bounds = _np.searchsorted(np_labels[order], _np.arange(components + 1))
+
+    groups: _typing.List[_typing.Tuple[_typing.Tuple[int, int], ...]] = []
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        left_ids: _typing.Dict[int, int] = {}
+        right_ids: _typing.Dict[int, int] = {}
+        weights: _typing.Dict[_typing.Tuple[int, int], float] = {}
+        for i in order[start:end].tolist():
+            u = left_ids.setdefault(rec_is0[i], len(left_ids))
+            v = right_ids.setdefault(rec_is1[i], len(right_ids))
+            weights[u, v] = max(weights.get((u, v), -_INF), sims[i])
+
+        adjacency: _typing.List[_typing.List[_typing.Tuple[int, float]]] \
+            = [[] for _ in left_ids]
+        for (u, v), w in weights.items():
+            if w > 0:
+                adjacency[u].append((v, w))
+
+        left_recs = list(left_ids)
+        right_recs = list(right_ids)
+        match_left = _max_weight_matching(adjacency, len(right_recs))
+        groups.extend(((dset_i0, left_recs[u]), (dset_i1, right_recs[v]))
+                      for u, v in enumerate(match_left) if v != -1)
+    return tuple(groups)
+
+
+def bipartite_optimal_solve(
+    candidates: _typechecking.CandidatePairs,
+    *,
+    executor: _typing.Optional[_futures.Executor] = None,
+    partitions: _typing.Optional[int] = None
+) -> _typechecking.MatchGroups:
+    """Select the matches with the highest total similarity.
+
+    Unlike `greedy_solve`, which accepts the most similar remaining
+    pair at every step, this solver finds a maximum weight matching: a
+    set of candidate pairs, no two sharing a record, whose similarities
+    have the largest possible sum. Only the candidate pairs are used,
+    so the problem is never made dense.
+
+    Every connected component of the candidate graph is solved
+    separately. Components are independent, so they may also be solved
+    in parallel with `executor`.
+
+    :param candidates: Candidates, as returned by `find_candidates`.
+        Every candidate pair must be between the same two datasets.
+    :param executor: A `concurrent.futures.Executor` to solve the
+        components on, as in `parallel_solve`. Since this solver is
+        written in Python, a `ProcessPoolExecutor` is usually best.
+        Default None (solve in this thread).
+    :param partitions: The number of partitions to split the
+        components into when using `executor`. Default four per CPU.
+
+    :return: An sequence of groups. Each group is a pair of records,
+        each a two-tuple of dataset index and record index.
+    """
+    with _tracing.stage('bipartite_optimal_solve') as span:
+        span.items = len(candidates[0])
+        if executor is None:
+            return _bipartite_optimal_solve_serial(candidates)
+        _bipartite_datasets(candidates)
+        return _solving.parallel_solve(candidates,
+                                       _bipartite_optimal_solve_serial,
+                                       executor=executor,
+                                       partitions=partitions)
+
+
+def matching_weight(
+    candidates: _typechecking.CandidatePairs,
+    groups: _typechecking.MatchGroups
+) -> float:
+    """Compute the total similarity of a set of matches.
+
+    The weight of every group is the sum of the similarities of the
+    candidate pairs within it. Pairs of records in the same group that
+    are not candidate pairs do not contribute.
+
+    :param candidates: Candidates, as returned by `find_candidates`.
+    :param groups: Groups, as returned by a solver.
+
+    :return: The sum of the weights of all groups.
+    """
+    group_of = {record: group_i
+                for group_i, group in enumerate(groups)
+                for record in group}
+    sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = candidates
+    total = 0.
+    for sim, dset_i0, dset_i1, rec_i0, rec_i1 in zip(
+            sims, dset_is0, dset_is1, rec_is0, rec_is1):
+        group_i = group_of.get((dset_i0, rec_i0))
+        if group_i is not None and group_i == group_of.get((dset_i1, rec_i1)):
+            total += sim
+    return total
+
+
+def optimality_gap(
+    candidates: _typechecking.CandidatePairs,
+    groups: _typing.Optional[_typechecking.MatchGroups] = None,
+    optimal_groups: _typing.Optional[_typechecking.MatchGroups] = None
+) -> float:
+    """Compare the total similarity of a solution with the optimum.
+
+    :param candidates: Candidates, as returned by `find_candidates`.
+        Every candidate pair must be between the same two datasets.
+    :param groups: The solution to evaluate. Default
+        `greedy_solve(candidates)`.
+    :param optimal_groups: The optimal solution, if it is already
+        known. Default `bipartite_optimal_solve(candidates)`.
+
+    :return: The relative gap: the proportion of the optimal total
+        similarity that is lost by `groups`. 0 when there are no
+        candidate pairs.
+    """
+    if groups is None:
+        groups = _solving.greedy_solve(candidates)
+    if optimal_groups is None:
+        optimal_groups = bipartite_optimal_solve(candidates)
+    optimal_weight = matching_weight(candidates, optimal_groups)
+    if not optimal_weight:
+        return 0.
+    return 1 - matching_weight(candidates, groups) / optimal_weight
@@ -0,0 +1,125 @@
+"""Solving independent components of the candidate graph in parallel."""
+
+import array as _array
+import concurrent.futures as _futures
+import functools as _functools
+import itertools as _itertools
+import os as _os
+import typing as _typing
+
+import numpy as _np
+
+import anonlink.solving as _solving
+import anonlink.tracing as _tracing
+import anonlink.typechecking as _typechecking
+
+
+def _take(arr, indices: _np.ndarray) -> _array.array:
+    np_arr = _np.asarray(arr)[indices]
+    return _array.array(np_arr.dtype.char, np_arr.tobytes())
+
+
+def partition_candidates(
+    candidates: _typechecking.CandidatePairs,
+    partitions: int
+) -> _typing.List[_typechecking.CandidatePairs]:
+    """Split candidate pairs into independent partitions.
+
+    Every connected component of the candidate graph is assigned to
+    exactly one partition, so solving every partition and taking the
+    union of the groups gives the same groups as solving all the
+    candidate pairs at once. Partitions have roughly equal numbers of
+    candidate pairs, except where one component is larger than the
+    others combined. Within a partition, candidate pairs keep their
+    original order.
+
+    :param candidates: Candidates, as returned by `find_candidates`.
+    :param partitions: The number of partitions to aim for. Fewer are
+        returned if there are not enough components.
+
+    :return: A list of candidate pairs, one for every nonempty
+        partition.
+    """
+    if partitions < 1:
+        raise ValueError(
+            f'partitions is expected to be positive but is {partitions}')
+
+    sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = candidates
+    components, labels = _solving.connected_components(candidates)
+    np_labels = _np.frombuffer(labels, dtype=labels.typecode)
+    n = np_labels.shape[0]
+    if not n:
+        return []
+
+    # Components are numbered in order of their first candidate pair.
+    # Assign runs of consecutive components to each partition so that
+    # every partition has about n / partitions candidate pairs.
+    component_sizes = _np.bincount(np_labels, minlength=components)
+    component_starts = _np.cumsum(component_sizes) - component_sizes
+    component_partitions = component_starts * partitions // n
+    candidate_partitions = component_partitions[np_labels]
+
+    # Mergesort is stable. This keeps candidate pairs in their order.
+    order = _np.argsort(candidate_partitions, kind='mergesort')
+    bounds = _np.searchsorted(candidate_partitions[order],
+                              _np.arange(partitions + 1))
+
+    result: _typing.List[_typechecking.CandidatePairs] = []
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if start == end:
+            continue
+        indices = order[start:end]
+        result.append((_take(sims, indices),
+                       (_take(dset_is0, indices), _take(dset_is1, indices)),
+                       (_take(rec_is0, indices), _take(rec_is1, indices))))
+    return result
+
+
+def parallel_solve(
+    candidates: _typechecking.CandidatePairs,
+    solve_f: _typing.Optional[
+        _typing.Callable[..., _typechecking.MatchGroups]] = None,
+    *,
+    executor: _typing.Optional[_futures.Executor] = None,
+    partitions: _typing.Optional[int] = None,
+    **kwargs
+) -> _typechecking.MatchGroups:
+    """Solve the connected components of the candidate graph in parallel.
+
+    Candidate pairs are split into partitions of whole connected
+    components with `partition_candidates`. The partitions are solved
+    independently and their groups are combined. The result contains
+    the same groups as `solve_f(candidates, **kwargs)`, although
+    possibly in a different order.
+
+    :param candidates: Candidates, as returned by `find_candidates`.
+    :param solve_f: The solver. Default `greedy_solve`.
+    :param executor: A `concurrent.futures.Executor` to run the solver
+        on. The native solvers release the GIL, so a
+        `ThreadPoolExecutor` is often enough. When using a
+        `ProcessPoolExecutor`, `solve_f` must be picklable. If omitted,
+        a `ThreadPoolExecutor` is created for the duration of the call.
+    :param partitions: The number of partitions to split the candidate
+        pairs into. Default four per CPU.
+    :param kwargs: Passed to `solve_f`, e.g., `merge_threshold`.
+
+    :return: An sequence of groups, as returned by `solve_f`.
+    """
+    if solve_f is None:
+        solve_f = _solving.greedy_solve
+    if executor is None:
+        with _futures.ThreadPoolExecutor() as executor:
+            return parallel_solve(candidates, solve_f,
+                                  executor=executor,
+                                  partitions=partitions,
+                                  **kwargs)
+    if partitions is None:
+        partitions = 4 * (_os.cpu_count() or 1)
+
+    if kwargs:
+        solve_f = _functools.partial(solve_f, **kwargs)
+    with _tracing.stage('parallel_solve', partitions=partitions) as span:
+        span.items = len(candidates[0])
+        results = executor.map(solve_f,
+                               partition_candidates(candidates, partitions))
+        return tuple(_itertools.chain.from_iterable(results))
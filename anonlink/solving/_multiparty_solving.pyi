@@ -1,3 +1,5 @@
+import typing as _typing
+
 import anonlink.typechecking as _typechecking
 
 def greedy_solve_native(candidates: _typechecking.CandidatePairs) -> _typechecking.MatchGroups: ...
@@ -5,4 +7,10 @@ def probabilistic_greedy_solve_native(
     candidates: _typechecking.CandidatePairs,
     *,
     merge_threshold: float = ...,
-    deduplicated: bool = ...) -> _typechecking.MatchGroups: ...
+    deduplicated: bool = ...,
+    max_edges: _typing.Optional[int] = ...,
+    stats: _typing.Optional[_typing.MutableMapping[str, int]] = ...
+) -> _typechecking.MatchGroups: ...
+def connected_components_native(
+    candidates: _typechecking.CandidatePairs
+) -> _typing.Tuple[int, _typechecking.IntArrayType]: ...
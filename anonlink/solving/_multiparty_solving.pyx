@@ -1,17 +1,24 @@
+from cpython cimport array
+import array
+
 from libcpp cimport bool
 from libcpp.vector cimport vector
 
 from cython.operator cimport dereference as deref
 
+import anonlink.tracing as _tracing
 from anonlink.solving._multiparty_solving_inner cimport (
-    Record, Group, greedy_solve_inner)
+    Record, Group, SolverStats, connected_components_inner,
+    greedy_solve_inner)
 
 
 def probabilistic_greedy_solve_native(
     candidates,
     *,
     merge_threshold=.5,
-    deduplicated=True
+    deduplicated=True,
+    max_edges=None,
+    stats=None
 ):
     """Select matches using the probabilistic greedy algorithm.
 
@@ -58,6 +65,21 @@ def probabilistic_greedy_solve_native(
         similarity is above the similarity threshold.
     :param bool deduplicated: When True, two records that belong to the
         same dataset will never be in the same group. Default True.
+        We then also stop counting the edges between two groups as soon
+        as they can never be merged: when they share a dataset, or when
+        even if every remaining candidate pair between them were seen
+        and both grew to the largest size the datasets allow, too few
+        of their pairs would have edges to reach `merge_threshold`. This
+        keeps the working set small without changing the result.
+    :param int max_edges: The maximum number of pairs of groups whose
+        edges may be counted at once. This bounds the solver's working
+        set, which can grow very large when `merge_threshold` is below
+        1. Raises MemoryError when exceeded. Default None (no limit).
+    :param dict stats: If given, updated with the solver's working-set
+        statistics: 'peak_edges', the largest number of pairs of groups
+        whose edges were counted at once, and 'pruned_edges', the number
+        of candidate pairs whose edges were discarded or never counted
+        because their records' groups can never be merged.
 
     :return: An sequence of groups. Each group is an sequence of
         records. Two records are in the same group iff they represent
@@ -68,9 +90,16 @@ def probabilistic_greedy_solve_native(
     if len(dset_is_arrs) != len(rec_is_arrs):
         raise ValueError('inconsistent shape of index arrays')
     if len(dset_is_arrs) != 2:
-        raise NotImplementedError('only binary solving is supported')
+        # Candidates from any number of datasets are supported, but each
+        # candidate must be a pair of records.
+        raise NotImplementedError(
+            f'only candidate pairs are supported (got candidates of '
+            f'{len(dset_is_arrs)} records)')
     if merge_threshold < 0 or merge_threshold > 1:
         raise ValueError('merge_threshold must be between 0 and 1')
+    if max_edges is not None and max_edges < 0:
+        raise ValueError(
+            f'max_edges must be nonnegative (got {max_edges})')
 
     dset_is0_arr, dset_is1_arr = dset_is_arrs
     rec_is0_arr, rec_is1_arr = rec_is_arrs
@@ -88,17 +117,33 @@ def probabilistic_greedy_solve_native(
 
     cdef double merge_threshold_double = merge_threshold
     cdef bool deduplicated_bool = deduplicated
+    cdef size_t max_edges_size = (<size_t>-1 if max_edges is None
+                                  else <size_t>max_edges)
+    cdef SolverStats solver_stats
+    solver_stats.peak_edges = 0
+    solver_stats.pruned_edges = 0
 
     if n:  # Prevent dereferencing empty arrays.
-        with nogil:
-            cpp_result = greedy_solve_inner(
-                &dset_is0[0],
-                &dset_is1[0],
-                &rec_is0[0],
-                &rec_is1[0],
-                n,
-                merge_threshold_double,
-                deduplicated_bool)
+        with _tracing.stage('probabilistic_greedy_solve',
+                            merge_threshold=merge_threshold,
+                            deduplicated=deduplicated) as span:
+            span.items = n
+            try:
+                with nogil:
+                    cpp_result = greedy_solve_inner(
+                        &dset_is0[0],
+                        &dset_is1[0],
+                        &rec_is0[0],
+                        &rec_is1[0],
+                        n,
+                        merge_threshold_double,
+                        deduplicated_bool,
+                        max_edges_size,
+                        solver_stats)
+            finally:
+                if stats is not None:
+                    stats['peak_edges'] = solver_stats.peak_edges
+                    stats['pruned_edges'] = solver_stats.pruned_edges
 
         # Save groups of size > 1.
         result = tuple(tuple((record.dset_i, record.rec_i)
@@ -109,6 +154,9 @@ def probabilistic_greedy_solve_native(
             del group
         return result
     else:
+        if stats is not None:
+            stats['peak_edges'] = 0
+            stats['pruned_edges'] = 0
         return ()
 
 
@@ -136,3 +184,71 @@ def greedy_solve_native(candidates):
     """
     return probabilistic_greedy_solve_native(
         candidates, merge_threshold=1.0, deduplicated=False)
+
+
+def connected_components_native(candidates):
+    """Find the connected components of the candidate graph.
+
+    The records are the vertices of the candidate graph and the
+    candidate pairs are its edges. No record in one component is ever
+    matched with a record in another, so the components may be solved
+    independently.
+
+    :param tuple candidates: Candidates, as returned by
+        `find_candidates`.
+
+    :return: A 2-tuple of the number of components and an array of the
+        component of every candidate pair. Components are numbered in
+        order of their first candidate pair.
+    """
+    sims_arr, dset_is_arrs, rec_is_arrs = candidates
+    if len(dset_is_arrs) != len(rec_is_arrs):
+        raise ValueError('inconsistent shape of index arrays')
+    if len(dset_is_arrs) != 2:
+        raise NotImplementedError(
+            f'only candidate pairs are supported (got candidates of '
+            f'{len(dset_is_arrs)} records)')
+
+    dset_is0_arr, dset_is1_arr = dset_is_arrs
+    rec_is0_arr, rec_is1_arr = rec_is_arrs
+    cdef size_t n = <size_t>len(sims_arr)
+    if not (n
+            == len(dset_is0_arr) == len(dset_is1_arr)
+            == len(rec_is0_arr) == len(rec_is1_arr)):
+        raise ValueError('inconsistent shape of index arrays')
+
+    cdef array.array labels_arr = array.clone(
+        array.array('I', []), n, zero=False)
+    if not n:  # Prevent dereferencing empty arrays.
+        return 0, labels_arr
+
+    # NB: [::1] makes sure that the array is C-contiguous
+    cdef unsigned int[::1] dset_is0 = dset_is0_arr
+    cdef unsigned int[::1] dset_is1 = dset_is1_arr
+    cdef unsigned int[::1] rec_is0 = rec_is0_arr
+    cdef unsigned int[::1] rec_is1 = rec_is1_arr
+    cdef unsigned int[::1] labels = labels_arr
+    cdef size_t components
+
+    with _tracing.stage('connected_components') as span:
+        span.items = n
+        with nogil:
+            components = connected_components_inner(
+                &dset_is0[0],
+                &dset_is1[0],
+                &rec_is0[0],
+                &rec_is1[0],
+                n,
+                &labels[0])
+
+    return components, labels_arr
+
+
+# The extension is compiled as `solving._multiparty_solving`, which Cython
+# records as the functions' module. Use the name it is imported as
+# instead so that the functions can be pickled, e.g., for process pools.
+for _f in (connected_components_native,
+           greedy_solve_native,
+           probabilistic_greedy_solve_native):
+    _f.__module__ = __name__
+del _f
@@ -1,6 +1,11 @@
 #include <algorithm>
 #include <cassert>
+#include <limits>
+#include <new>
+#include <stdexcept>
 #include <unordered_map>
+#include <unordered_set>
+#include <utility>
 #include <vector>
 #include <stdint.h>
 #include "_multiparty_solving_inner.h"
@@ -132,6 +137,14 @@ public:
     }
 };
 
+struct EdgesLimitExceeded : public std::bad_alloc {
+    // Cython turns std::bad_alloc into MemoryError with this message.
+    const char *what() const noexcept override {
+        return "the solver exceeded max_edges inter-group edge counts";
+    }
+};
+
+
 template <class T>
 class EdgesMatrix {
 // Recall that two groups are merged iff every pair of records has been encountered as a candidate
@@ -140,6 +153,8 @@ class EdgesMatrix {
 // 1. increment the number of edges between two groups by one and return the new number
 // 2. merge a column into another column (and also merge the corresponding rows); this is used when
 //    we are merging two groups together.
+// It also supports removing the entries of a column that are no longer needed, and it keeps track of
+// its number of entries so that its size can be reported and capped.
 
 private:
     typedef unsigned long long CountType;
@@ -148,6 +163,12 @@ private:
     typedef std::unordered_map<T, Column> SparseMatrix;
     
     SparseMatrix sparse_matrix;
+
+    // Number of pairs of keys with an entry. Each entry is stored twice for symmetry, but counted
+    // once.
+    size_t entries = 0;
+    size_t max_entries;
+    SolverStats &stats;
     
     CountType set_or_increment(T key0, T key1, CountType n) {
         // Increment entry at column key0, row key1 by n if it exists. Set to n if it doesn't.
@@ -173,12 +194,24 @@ private:
     }
     
 public:
+    EdgesMatrix(size_t max_entries_, SolverStats &stats_)
+        : max_entries(max_entries_), stats(stats_) {}
+
     CountType increment(T key0, T key1) {
         // Call set_or_increment twice for symmetry.
         CountType retval0 = set_or_increment(key0, key1, 1);
         CountType retval1[[maybe_unused]] = set_or_increment(key1, key0, 1);
         
         assert(retval0 == retval1); // Assert symmetric.
+
+        // Merges never add entries, so this is the only place where we can exceed the cap.
+        if (retval0 == 1) {
+            ++entries;
+            stats.peak_edges = std::max(stats.peak_edges, entries);
+            if (entries > max_entries) {
+                throw EdgesLimitExceeded();
+            }
+        }
         
         return retval0;
     }
@@ -190,7 +223,7 @@ public:
         
         // Merging two groups.
         // matrix[absorbee][absorber] and matrix[absorbee][absorber] are no longer needed.
-        absorber_store.erase(absorbee_key);
+        entries -= absorber_store.erase(absorbee_key);
         absorbee_store.erase(absorber_key);
 
         // Move all the edges from absorbee to absorber. Same with edges referencing absorbee.
@@ -200,8 +233,10 @@ public:
             CountType count = edge_count.second;
             assert(count);
             
-            // Move edge count from absorbee to absorber.
-            set_or_increment(absorber_key, edge, count);
+            // Move edge count from absorbee to absorber. The entry is new unless the count is larger.
+            if (set_or_increment(absorber_key, edge, count) != count) {
+                --entries;
+            }
             
             // Edge count (from some third group) referencing absorbee will now reference absorber.
             Column &mp_match = sparse_matrix[edge];
@@ -217,10 +252,97 @@ public:
             sparse_matrix.erase(absorber_key);
         }
     }
+
+    CountType count(T key0, T key1) const {
+        // Return the entry at column key0, row key1, or 0 if there is none.
+        auto column_iterator = sparse_matrix.find(key0);
+        if (column_iterator == sparse_matrix.end()) {
+            return 0;
+        }
+        auto count_iterator = column_iterator->second.find(key1);
+        if (count_iterator == column_iterator->second.end()) {
+            return 0;
+        }
+        return count_iterator->second;
+    }
+
+    void count_pruned(CountType n = 1) {
+        // Record that n candidate pairs were not counted because they can never lead to a merge.
+        stats.pruned_edges += n;
+    }
+
+    void discard(T key0, T key1) {
+        // Remove the entry between key0 and key1, if any, because it can never lead to a merge.
+        for (auto key_pair : {std::make_pair(key0, key1), std::make_pair(key1, key0)}) {
+            auto column_iterator = sparse_matrix.find(key_pair.first);
+            if (column_iterator == sparse_matrix.end()) {
+                continue;
+            }
+            Column &column = column_iterator->second;
+            auto count_iterator = column.find(key_pair.second);
+            if (count_iterator != column.end()) {
+                if (key_pair.first == key0) {
+                    --entries;
+                    stats.pruned_edges += count_iterator->second;
+                }
+                column.erase(count_iterator);
+            }
+            if (column.empty()) {
+                sparse_matrix.erase(column_iterator);
+            }
+        }
+    }
+
+    template <class Predicate>
+    void prune(T key, Predicate keep) {
+        // Remove the entries between key and every other key for which keep, given the other key
+        // and the entry, returns false.
+        auto column_iterator = sparse_matrix.find(key);
+        if (column_iterator == sparse_matrix.end()) {
+            return;
+        }
+        Column &column = column_iterator->second;
+        for (auto it = column.begin(); it != column.end();) {
+            T other_key = it->first;
+            CountType count = it->second;
+            if (keep(other_key, count)) {
+                ++it;
+                continue;
+            }
+            auto other_column_iterator = sparse_matrix.find(other_key);
+            assert(other_column_iterator != sparse_matrix.end());
+            other_column_iterator->second.erase(key);
+            if (other_column_iterator->second.empty()) {
+                sparse_matrix.erase(other_column_iterator);
+            }
+            it = column.erase(it);
+            --entries;
+            stats.pruned_edges += count;
+        }
+        if (column.empty()) {
+            sparse_matrix.erase(column_iterator);
+        }
+    }
     
 };
 
 
+// Datasets with an index below this can be represented in a bitmask of their group.
+constexpr unsigned int MAX_MASKED_DATASETS = 64;
+
+bool datasets_mask(const Group *group, uint64_t &mask) {
+    // Set mask to the set of datasets that have a record in group. Return false if some dataset
+    // index is too large to be represented.
+    mask = 0;
+    for (const auto &r : *group) {
+        if (r.dset_i >= MAX_MASKED_DATASETS) {
+            return false;
+        }
+        mask |= static_cast<uint64_t>(1) << r.dset_i;
+    }
+    return true;
+}
+
 // Check if there exists a datset that has more than one element in the two groups.
 // If so, and if we assume that the two datasets are deduplicated, then we cannot merge the groups.
 bool check_no_duplicates(Record i0, Record i1) {
@@ -233,6 +355,12 @@ bool check_no_duplicates(Record i0, Group *group1) {
                        });
 }
 bool check_no_duplicates(Group *group0, Group *group1) {
+    // With tens of datasets the groups get large enough that comparing every pair of records is
+    // wasteful. Compare the sets of datasets instead when they fit in a bitmask.
+    uint64_t mask0, mask1;
+    if (datasets_mask(group0, mask0) && datasets_mask(group1, mask1)) {
+        return !(mask0 & mask1);
+    }
     return std::all_of(group0->cbegin(), group0->cend(),
                        [group1](Record r) {
                            return check_no_duplicates(r, group1);
@@ -240,17 +368,103 @@ bool check_no_duplicates(Group *group0, Group *group1) {
 }
 
 
-void none_grouped(GroupsStore &groups_store, Record i0, Record i1, bool deduplicated) {
+class RemainingEdges {
+// With deduplication, a group has at most one record from every dataset. This bounds the sizes of
+// groups, so we can tell when two groups can no longer be merged: when even if every remaining
+// candidate pair between them were seen and both grew to the largest size the datasets allow, too
+// few of their pairs would have edges to reach the merge threshold. This class counts the
+// candidate pairs every record has left.
+
+private:
+    std::unordered_map<Record, size_t, RecordHasher> remaining;
+    long long datasets = 0;
+
+    size_t group_remaining(const Group *group) const {
+        size_t total = 0;
+        for (const auto &r : *group) {
+            total += remaining.at(r);
+        }
+        return total;
+    }
+
+public:
+    RemainingEdges(unsigned int dset_is0[],
+                   unsigned int dset_is1[],
+                   unsigned int rec_is0[],
+                   unsigned int rec_is1[],
+                   size_t n,
+                   bool deduplicated) {
+        if (!deduplicated) {
+            return;
+        }
+        std::unordered_set<unsigned int> dsets;
+        for (size_t i = 0; i < n; ++i) {
+            Record i0(dset_is0[i], rec_is0[i]);
+            Record i1(dset_is1[i], rec_is1[i]);
+            if (!(i0 == i1)) {
+                ++remaining[i0];
+                ++remaining[i1];
+                dsets.insert(i0.dset_i);
+                dsets.insert(i1.dset_i);
+            }
+        }
+        datasets = static_cast<long long>(dsets.size());
+    }
+
+    void consume(Record i0, Record i1) {
+        // The candidate pair of i0 and i1 is being processed.
+        --remaining.at(i0);
+        --remaining.at(i1);
+    }
+
+    bool reachable(const Group *group0, const Group *group1, unsigned long long overlap,
+                   double merge_threshold) const {
+        // Whether groups containing group0 and group1 may ever be merged when overlap of their
+        // pairs have edges. Only for groups that do not share a dataset. Between groups of sizes a
+        // and b, with a + b at most the number of datasets, at most min(remaining) more pairs of
+        // group0 and group1 and every pair with a record outside them can have an edge.
+        long long size0 = static_cast<long long>(group0->size());
+        long long size1 = static_cast<long long>(group1->size());
+        unsigned long long future = std::min(group_remaining(group0), group_remaining(group1));
+        long long size0_most = std::min(std::max(datasets / 2, size0), datasets - size1);
+        unsigned long long most_pairs = size0_most * (datasets - size0_most);
+        unsigned long long possible = overlap + future + most_pairs - size0 * size1;
+        return static_cast<double>(possible)
+            >= merge_threshold * static_cast<double>(most_pairs);
+    }
+};
+
+
+void none_grouped(GroupsStore &groups_store,
+                  EdgesMatrix<Group *> &edges_store,
+                  Record i0,
+                  Record i1,
+                  bool deduplicated) {
     if (!deduplicated || check_no_duplicates(i0, i1)) {
         // Neither is in a group, so let's make one.
         groups_store.make_group(i0, i1);
+    } else {
+        // If they are duplicates from the same datasets, then they will never be in the same
+        // group, so there is no point making singleton groups for them.
+        edges_store.count_pruned();
     }
-    // If they are duplicates from the same datasets, then they will never be in the same group, so
-    // there is no point making singleton groups for them.
+}
+
+void prune_unmergeable(EdgesMatrix<Group *> &edges_store,
+                       const RemainingEdges &remaining,
+                       Group *group,
+                       double merge_threshold) {
+    // Forget the edges between group, which has just grown, and groups with which it can never be
+    // merged.
+    edges_store.prune(group, [&](Group *other, unsigned long long count) {
+        return check_no_duplicates(group, other)
+            && remaining.reachable(group, other, count, merge_threshold);
+    });
 }
 
 void one_grouped(GroupsStore &groups_store,
                  EdgesMatrix<Group *> &edges_store,
+                 const RemainingEdges &remaining,
                  Group *group,
                  Record i,
                  double merge_threshold,
@@ -259,28 +473,47 @@ void one_grouped(GroupsStore &groups_store,
         if (!deduplicated || check_no_duplicates(i, group)) {
             // We have two singletons (one has a group of itself, one doesn't), so we can merge.
             groups_store.add_to_group(group, i);
+            if (deduplicated) {
+                prune_unmergeable(edges_store, remaining, group, merge_threshold);
+            }
+        } else {
+            edges_store.count_pruned();
         }
     } else {
         // The group has at least 2 elements. We've only matched with one so far (or else we'd
         // already have a group of size at least one), so we can't merge.
         Group *group_i = groups_store.make_group(i);
-        edges_store.increment(group, group_i);
+        if (!deduplicated
+                || (check_no_duplicates(i, group)
+                    && remaining.reachable(group, group_i, 1, merge_threshold))) {
+            edges_store.increment(group, group_i);
+        } else {
+            // These groups can never be merged, so there's no need to count their edges.
+            edges_store.count_pruned();
+        }
     }
 }
 
 void two_grouped_merge(GroupsStore &groups_store,
                        EdgesMatrix<Group *> &edges_store,
+                       const RemainingEdges &remaining,
                        Group *absorber,
-                       Group *absorbee) {
+                       Group *absorbee,
+                       double merge_threshold,
+                       bool deduplicated) {
     // Merge the two groups.
     // Merge the two sets of records.
     groups_store.merge_into(absorber, absorbee);
     // Merge the relevant columns/rows of the sparse edges matrix.
     edges_store.merge_into(absorber, absorbee);
+    if (deduplicated) {
+        prune_unmergeable(edges_store, remaining, absorber, merge_threshold);
+    }
 }
 
 void two_grouped(GroupsStore &groups_store,
                  EdgesMatrix<Group *> &edges_store,
+                 const RemainingEdges &remaining,
                  Group *group0,
                  Group *group1,
                  double merge_threshold,
@@ -289,23 +522,86 @@ void two_grouped(GroupsStore &groups_store,
         return; // Already grouped together. Nothing to do.
     }
 
-    double overlap = edges_store.increment(group0, group1);
+    if (deduplicated && !check_no_duplicates(group0, group1)) {
+        // These groups can never be merged, so there's no need to count their edges.
+        edges_store.count_pruned();
+        return;
+    }
+
+    unsigned long long overlap = edges_store.count(group0, group1) + 1;
     auto group_0_size = group0->size();
     auto group_1_size = group1->size();
     // The below is equivalent to: for every pair of records in the Cartesian product of group 0 and
     // group 1, we've encountered an edge.
-    if (overlap >= merge_threshold * group_0_size * group_1_size) {
-        if (!deduplicated || check_no_duplicates(group0, group1)) {
-            // Optimise by enlarging the bigger group.
-            if (group_0_size < group_1_size) {
-                two_grouped_merge(groups_store, edges_store, group1, group0);
-            } else {
-                two_grouped_merge(groups_store, edges_store, group0, group1);
-            }
+    bool mergeable = overlap >= merge_threshold * group_0_size * group_1_size;
+    if (!mergeable && deduplicated
+            && !remaining.reachable(group0, group1, overlap, merge_threshold)) {
+        // These groups can no longer be merged. Forget their edges.
+        edges_store.discard(group0, group1);
+        edges_store.count_pruned();
+        return;
+    }
+
+    edges_store.increment(group0, group1);
+    if (mergeable) {
+        // Optimise by enlarging the bigger group.
+        if (group_0_size < group_1_size) {
+            two_grouped_merge(groups_store, edges_store, remaining, group1, group0,
+                              merge_threshold, deduplicated);
+        } else {
+            two_grouped_merge(groups_store, edges_store, remaining, group0, group1,
+                              merge_threshold, deduplicated);
         }
     }
 }
 
+
+class DisjointSets {
+// Union-find over elements 0, 1, ..., size() - 1, with path halving and union by size.
+
+private:
+    std::vector<size_t> parents;
+    std::vector<size_t> sizes;
+
+public:
+    size_t size() const {
+        return parents.size();
+    }
+
+    size_t make_set() {
+        // Makes a new singleton set. Returns its element.
+        size_t element = parents.size();
+        parents.push_back(element);
+        sizes.push_back(1);
+        return element;
+    }
+
+    size_t find(size_t element) {
+        // Returns the representative of the set containing element.
+        assert(element < parents.size());
+        while (parents[element] != element) {
+            parents[element] = parents[parents[element]];
+            element = parents[element];
+        }
+        return element;
+    }
+
+    void unite(size_t element0, size_t element1) {
+        // Merges the sets containing element0 and element1.
+        size_t root0 = find(element0);
+        size_t root1 = find(element1);
+        if (root0 == root1) {
+            return;
+        }
+        // Optimise by attaching the smaller tree to the bigger one.
+        if (sizes[root0] < sizes[root1]) {
+            std::swap(root0, root1);
+        }
+        parents[root1] = root0;
+        sizes[root0] += sizes[root1];
+    }
+};
+
 } /* namespace */
 
 std::unordered_set<Group *>
@@ -315,49 +611,114 @@ greedy_solve_inner(unsigned int dset_is0[],
                    unsigned int rec_is1[],
                    size_t n,
                    double merge_threshold,
-                   bool deduplicated) {
+                   bool deduplicated,
+                   size_t max_edges,
+                   SolverStats &stats) {
     // Keep track of groups that have already been formed.
     GroupsStore groups_store;
 
     // Keep track of edges between records that we've encountered. We only merge two groups if
     // we've encountered edges between all their records.
-    EdgesMatrix<Group *> edges_store;
+    EdgesMatrix<Group *> edges_store(max_edges, stats);
 
-    for (size_t i = 0; i < n; ++i) {
-        Record i0(dset_is0[i], rec_is0[i]);
-        Record i1(dset_is1[i], rec_is1[i]);
+    // Keep track of the candidate pairs every record has left, to prune edges between groups that
+    // can no longer be merged.
+    RemainingEdges remaining(dset_is0, dset_is1, rec_is0, rec_is1, n, deduplicated);
 
-        if (i0 == i1) {
-            continue; // Record trivially grouped with itself. Nothing to do.
-        }
+    try {
+        for (size_t i = 0; i < n; ++i) {
+            Record i0(dset_is0[i], rec_is0[i]);
+            Record i1(dset_is1[i], rec_is1[i]);
 
-        // These will be nullptr if the corresponding records don't already belong do a group.
-        Group *group_i0 = groups_store.get_group(i0);
-        Group *group_i1 = groups_store.get_group(i1);
-        
-        if (group_i0) {
-            assert(group_i0->size());
-            if (group_i1) {
-                assert(group_i1->size());
-                two_grouped(groups_store, edges_store,
-                            group_i0, group_i1,
-                            merge_threshold, deduplicated);
-            } else {
-                one_grouped(groups_store, edges_store,
-                            group_i0, i1,
-                            merge_threshold, deduplicated);
+            if (i0 == i1) {
+                continue; // Record trivially grouped with itself. Nothing to do.
             }
-        } else {
-            if (group_i1) {
-                assert(group_i1->size());
-                one_grouped(groups_store, edges_store,
-                            group_i1, i0,
-                            merge_threshold, deduplicated);
+            if (deduplicated) {
+                remaining.consume(i0, i1);
+            }
+
+            // These will be nullptr if the corresponding records don't already belong do a group.
+            Group *group_i0 = groups_store.get_group(i0);
+            Group *group_i1 = groups_store.get_group(i1);
+        
+            if (group_i0) {
+                assert(group_i0->size());
+                if (group_i1) {
+                    assert(group_i1->size());
+                    two_grouped(groups_store, edges_store, remaining,
+                                group_i0, group_i1,
+                                merge_threshold, deduplicated);
+                } else {
+                    one_grouped(groups_store, edges_store, remaining,
+                                group_i0, i1,
+                                merge_threshold, deduplicated);
+                }
             } else {
-                none_grouped(groups_store, i0, i1, deduplicated);
+                if (group_i1) {
+                    assert(group_i1->size());
+                    one_grouped(groups_store, edges_store, remaining,
+                                group_i1, i0,
+                                merge_threshold, deduplicated);
+                } else {
+                    none_grouped(groups_store, edges_store, i0, i1, deduplicated);
+                }
             }
         }
+    } catch (...) {
+        // The caller only takes ownership of the groups if we return them.
+        for (Group *group : groups_store.get_groups()) {
+            delete group;
+        }
+        throw;
     }
 
     return groups_store.get_groups();
 }
+
+
+size_t
+connected_components_inner(unsigned int dset_is0[],
+                           unsigned int dset_is1[],
+                           unsigned int rec_is0[],
+                           unsigned int rec_is1[],
+                           size_t n,
+                           unsigned int labels[]) {
+    static constexpr unsigned int NO_LABEL = std::numeric_limits<unsigned int>::max();
+
+    // Give every record a dense index so the disjoint sets can be stored in vectors.
+    std::unordered_map<Record, unsigned int, RecordHasher> record_indices;
+    DisjointSets sets;
+    auto get_index = [&](Record record) {
+        auto emplace_res = record_indices.emplace(record, 0);
+        if (emplace_res.second) {
+            size_t element = sets.make_set();
+            if (element >= NO_LABEL) {
+                throw std::overflow_error("too many records");
+            }
+            emplace_res.first->second = static_cast<unsigned int>(element);
+        }
+        return emplace_res.first->second;
+    };
+
+    // Join the records of every candidate pair. Temporarily keep the index of the first record of
+    // each candidate in labels.
+    for (size_t i = 0; i < n; ++i) {
+        unsigned int index0 = get_index(Record(dset_is0[i], rec_is0[i]));
+        unsigned int index1 = get_index(Record(dset_is1[i], rec_is1[i]));
+        sets.unite(index0, index1);
+        labels[i] = index0;
+    }
+
+    // Number the components in order of their first candidate.
+    std::vector<unsigned int> root_labels(sets.size(), NO_LABEL);
+    unsigned int components = 0;
+    for (size_t i = 0; i < n; ++i) {
+        unsigned int &root_label = root_labels[sets.find(labels[i])];
+        if (root_label == NO_LABEL) {
+            root_label = components++;
+        }
+        labels[i] = root_label;
+    }
+
+    return components;
+}
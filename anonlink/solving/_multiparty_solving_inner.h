@@ -1,7 +1,9 @@
 #ifndef _multiparty_solving_inner_h
 #define _multiparty_solving_inner_h
 
+#include <cstddef>
 #include <unordered_set>
+#include <vector>
 
 struct Record {
     unsigned int dset_i;
@@ -21,6 +23,16 @@ struct Record {
 typedef std::vector<Record> Group;
 
 
+// Working-set statistics of the solver.
+struct SolverStats {
+    // The largest number of pairs of groups whose edges were counted at any one time.
+    size_t peak_edges;
+    // The number of candidate pairs whose edges were discarded or never counted because their
+    // records' groups can never be merged.
+    size_t pruned_edges;
+};
+
+
 std::unordered_set<Group *>
 greedy_solve_inner(
     unsigned int dset_is0[],
@@ -29,6 +41,18 @@ greedy_solve_inner(
     unsigned int rec_is1[],
     size_t n,
     double merge_threshold,
-    bool deduplicated);
+    bool deduplicated,
+    size_t max_edges,
+    SolverStats &stats);
+
+
+size_t
+connected_components_inner(
+    unsigned int dset_is0[],
+    unsigned int dset_is1[],
+    unsigned int rec_is0[],
+    unsigned int rec_is1[],
+    size_t n,
+    unsigned int labels[]);
 
 #endif /* _multiparty_solving_inner_h */
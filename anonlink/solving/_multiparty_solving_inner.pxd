@@ -10,6 +10,10 @@ cdef extern from "_multiparty_solving_inner.h":
 
     ctypedef vector[Record] Group
 
+    cdef struct SolverStats:
+        size_t peak_edges
+        size_t pruned_edges
+
     unordered_set[Group *] greedy_solve_inner(
         unsigned int[],
         unsigned int[],
@@ -17,6 +21,17 @@ cdef extern from "_multiparty_solving_inner.h":
         unsigned int[],
         size_t,
         double,
-        bool
+        bool,
+        size_t,
+        SolverStats &
     ) nogil except +
     # `except +` asks Cython to propagate C++ exceptions to Python land
+
+    size_t connected_components_inner(
+        unsigned int[],
+        unsigned int[],
+        unsigned int[],
+        unsigned int[],
+        size_t,
+        unsigned int[]
+    ) nogil except +
@@ -1,7 +1,9 @@
+import array as _array
 import collections as _collections
 import itertools as _itertools
 import typing as _typing
 
+import anonlink.tracing as _tracing
 import anonlink.typechecking as _typechecking
 
 
@@ -9,7 +11,9 @@ def probabilistic_greedy_solve_python(
     candidates: _typechecking.CandidatePairs,
     *,
     merge_threshold: float = .5,
-    deduplicated: bool = True
+    deduplicated: bool = True,
+    max_edges: _typing.Optional[int] = None,
+    stats: _typing.Optional[_typing.MutableMapping[str, int]] = None
 ) -> _typechecking.MatchGroups:
     """Select matches using the probabilistic greedy algorithm.
 
@@ -56,6 +60,21 @@ def probabilistic_greedy_solve_python(
         similarity is above the similarity threshold.
     :param bool deduplicated: When True, two records that belong to the
         same dataset will never be in the same group. Default True.
+        We then also stop counting the edges between two groups as soon
+        as they can never be merged: when they share a dataset, or when
+        even if every remaining candidate pair between them were seen
+        and both grew to the largest size the datasets allow, too few
+        of their pairs would have edges to reach `merge_threshold`. This
+        keeps the working set small without changing the result.
+    :param int max_edges: The maximum number of pairs of groups whose
+        edges may be counted at once. This bounds the solver's working
+        set, which can grow very large when `merge_threshold` is below
+        1. Raises MemoryError when exceeded. Default None (no limit).
+    :param dict stats: If given, updated with the solver's working-set
+        statistics: 'peak_edges', the largest number of pairs of groups
+        whose edges were counted at once, and 'pruned_edges', the number
+        of candidate pairs whose edges were discarded or never counted
+        because their records' groups can never be merged.
 
     :return: An sequence of groups. Each group is an sequence of
         records. Two records are in the same group iff they represent
@@ -65,12 +84,19 @@ def probabilistic_greedy_solve_python(
     if merge_threshold < 0 or merge_threshold > 1:
         raise ValueError(
             f'merge_threshold must be between 0 and 1 (got {merge_threshold})') 
+    if max_edges is not None and max_edges < 0:
+        raise ValueError(
+            f'max_edges must be nonnegative (got {max_edges})')
 
     sims, dset_is, rec_is = candidates
     if len(dset_is) != len(rec_is):
         raise ValueError('inconsistent shape of index arrays')
     if len(dset_is) != 2:
-        raise NotImplementedError('only binary solving is supported')
+        # Candidates from any number of datasets are supported, but each
+        # candidate must be a pair of records.
+        raise NotImplementedError(
+            f'only candidate pairs are supported (got candidates of '
+            f'{len(dset_is)} records)')
 
     dset_is0, dset_is1 = dset_is
     rec_is0, rec_is1 = rec_is
@@ -91,98 +117,233 @@ def probabilistic_greedy_solve_python(
     # as the key.
     matchable_pairs: _typing.DefaultDict[int, _typing.Counter[int]] \
         = _collections.defaultdict(_collections.Counter)
+    # Map the id of every group to the group, so we can prune
+    # matchable_pairs.
+    groups_by_id: _typing.Dict[int, _typing.List[_typing.Tuple[int, int]]] \
+        = {}
 
-    for dset_i0, dset_i1, rec_i0, rec_i1 in zip(
-            dset_is0, dset_is1, rec_is0, rec_is1):
-        i0 = dset_i0, rec_i0
-        i1 = dset_i1, rec_i1
+    # Working-set statistics. edges is the number of pairs of groups
+    # with nonzero matchable pairs. pruned_edges is the number of
+    # candidate pairs whose edges were discarded or never counted.
+    edges = peak_edges = pruned_edges = 0
+
+    # With deduplication, the groups are bounded by the number of
+    # datasets, so we can tell when two groups can no longer be merged
+    # from the number of candidate pairs each record has left.
+    remaining: _typing.Counter[_typing.Tuple[int, int]] \
+        = _collections.Counter()
+    datasets = 0
+    if deduplicated:
+        dsets: _typing.Set[int] = set()
+        for dset_i0, dset_i1, rec_i0, rec_i1 in zip(
+                dset_is0, dset_is1, rec_is0, rec_is1):
+            i0 = dset_i0, rec_i0
+            i1 = dset_i1, rec_i1
+            if i0 != i1:
+                remaining[i0] += 1
+                remaining[i1] += 1
+                dsets.update((dset_i0, dset_i1))
+        datasets = len(dsets)
 
-        if i0 == i1:
-            continue
+    def count_new_edge():
+        nonlocal edges, peak_edges
+        edges += 1
+        peak_edges = max(peak_edges, edges)
+        if max_edges is not None and edges > max_edges:
+            raise MemoryError(
+                'the solver exceeded max_edges inter-group edge counts')
 
-        if i0 in matches and i1 in matches:
-            # Both records are assigned to a group.
-            i0_matches = matches[i0]
-            i1_matches = matches[i1]
-            i0_mid = id(i0_matches)
-            i1_mid = id(i1_matches)
+    def reachable(group0, group1, overlap):
+        # Whether groups containing group0 and group1 may ever be merged
+        # when overlap of their pairs have edges. Only for deduplicated
+        # groups that do not share a dataset. Between groups of sizes a
+        # and b, with a + b at most the number of datasets, at most
+        # min(remaining) more pairs of group0 and group1 and every pair
+        # with a record outside them can have an edge.
+        size0 = len(group0)
+        size1 = len(group1)
+        future = min(sum(remaining[r] for r in group0),
+                     sum(remaining[r] for r in group1))
+        size0_most = min(max(datasets // 2, size0), datasets - size1)
+        most_pairs = size0_most * (datasets - size0_most)
+        return (overlap + future + most_pairs - size0 * size1
+                >= merge_threshold * most_pairs)
 
-            if i0_mid == i1_mid:
+    def prune(group):
+        # Forget the matchable pairs between group and groups with
+        # which it can never be merged.
+        nonlocal edges, pruned_edges
+        mid = id(group)
+        if mid not in matchable_pairs:
+            return
+        group_dsets = {dset_i for dset_i, _ in group}
+        mid_pairs = matchable_pairs[mid]
+        for j_mid, j_count in tuple(mid_pairs.items()):
+            j_group = groups_by_id[j_mid]
+            if (group_dsets.isdisjoint(dset_i for dset_i, _ in j_group)
+                    and reachable(group, j_group, j_count)):
                 continue
+            del mid_pairs[j_mid]
+            del matchable_pairs[j_mid][mid]
+            if not matchable_pairs[j_mid]:
+                del matchable_pairs[j_mid]
+            edges -= 1
+            pruned_edges += j_count
+        if not mid_pairs:
+            del matchable_pairs[mid]
+
+    with _tracing.stage('probabilistic_greedy_solve',
+                        merge_threshold=merge_threshold,
+                        deduplicated=deduplicated) as span:
+        span.items = len(sims)
+        try:
+            for dset_i0, dset_i1, rec_i0, rec_i1 in zip(
+                    dset_is0, dset_is1, rec_is0, rec_is1):
+                i0 = dset_i0, rec_i0
+                i1 = dset_i1, rec_i1
+
+                if i0 == i1:
+                    continue
+                if deduplicated:
+                    remaining[i0] -= 1
+                    remaining[i1] -= 1
+
+                if i0 in matches and i1 in matches:
+                    # Both records are assigned to a group.
+                    i0_matches = matches[i0]
+                    i1_matches = matches[i1]
+                    i0_mid = id(i0_matches)
+                    i1_mid = id(i1_matches)
+
+                    if i0_mid == i1_mid:
+                        continue
+
+                    duplicates_ok = (not deduplicated
+                                     or all(m0 != m1
+                                            for m0, _ in i0_matches
+                                            for m1, _ in i1_matches))
+                    if not duplicates_ok:
+                        # These groups can never be merged, so there's no
+                        # need to count their matchable pairs.
+                        pruned_edges += 1
+                        continue
+
+                    # Check if mergeable. matchable_pairs[i0_mid][i1_mid] is
+                    # the number of pairs they have in common not including
+                    # the current pair--we add one to include it. The total
+                    # number of pairs is len(i0_matches) * len(i1_matches)).
+                    # When this is the number of matchable pairs, then every
+                    # pair is matchable.
+                    overlap = matchable_pairs[i0_mid][i1_mid] + 1
+                    total_pairs = len(i0_matches) * len(i1_matches)
+                    if (overlap < merge_threshold * total_pairs
+                            and deduplicated
+                            and not reachable(i0_matches, i1_matches,
+                                              overlap)):
+                        # These groups can no longer be merged. Forget
+                        # their matchable pairs.
+                        if overlap > 1:
+                            del matchable_pairs[i0_mid][i1_mid]
+                            del matchable_pairs[i1_mid][i0_mid]
+                            edges -= 1
+                        for mid in i0_mid, i1_mid:
+                            if not matchable_pairs[mid]:
+                                del matchable_pairs[mid]
+                        pruned_edges += overlap
+                        continue
+                    if overlap == 1:
+                        count_new_edge()
+                    if overlap >= merge_threshold * total_pairs:
+                        # Optimise by always extending the bigger group.
+                        if len(i0_matches) < len(i1_matches):
+                            i0, i1 = i1, i0
+                            i0_mid, i1_mid = i1_mid, i0_mid
+                            i0_matches, i1_matches = i1_matches, i0_matches
+                        # Merge groups.
+                        i0_matches.extend(i1_matches)
+                        matches.update(
+                            zip(i1_matches, _itertools.repeat(i0_matches)))
+                        del groups_by_id[i1_mid]
 
-            # Check if mergeable. matchable_pairs[i0_mid][i1_mid] is the
-            # number of pairs they have in common not including the
-            # current pair--we add one to include it. The total number
-            # of pairs is len(i0_matches) * len(i1_matches)). When this
-            # is the number of matchable pairs, then every pair is
-            # matchable.
-            overlap = matchable_pairs[i0_mid][i1_mid] + 1
-            total_pairs = len(i0_matches) * len(i1_matches)
-            duplicates_ok = (not deduplicated or all(m0 != m1
-                                                     for m0, _ in i0_matches
-                                                     for m1, _ in i1_matches))
-            if overlap >= merge_threshold * total_pairs and duplicates_ok:
-                # Optimise by always extending the bigger group.
-                if len(i0_matches) < len(i1_matches):
+                        # Update matchable pairs.
+                        del matchable_pairs[i0_mid][i1_mid]
+                        del matchable_pairs[i1_mid][i0_mid]
+                        edges -= 1
+                        for j_mid, j_count in matchable_pairs[i1_mid].items():
+                            if matchable_pairs[i0_mid][j_mid]:
+                                edges -= 1
+                            matchable_pairs[i0_mid][j_mid] += j_count
+                            matchable_pairs[j_mid][i0_mid] += j_count
+                            del matchable_pairs[j_mid][i1_mid]
+                        del matchable_pairs[i1_mid]
+                        if not matchable_pairs[i0_mid]:  # Empty. Can delete.
+                            del matchable_pairs[i0_mid]
+                        if deduplicated:
+                            prune(i0_matches)
+
+                    else:
+                        # Don't merge. Mark: they have another edge in
+                        # common.
+                        matchable_pairs[i0_mid][i1_mid] += 1
+                        matchable_pairs[i1_mid][i0_mid] += 1
+                    continue
+
+                if i0 not in matches and i1 in matches:
                     i0, i1 = i1, i0
-                    i0_mid, i1_mid = i1_mid, i0_mid
-                    i0_matches, i1_matches = i1_matches, i0_matches
-                # Merge groups.
-                i0_matches.extend(i1_matches)
-                matches.update(zip(i1_matches, _itertools.repeat(i0_matches)))
-                
-                # Update matchable pairs.
-                del matchable_pairs[i0_mid][i1_mid]
-                del matchable_pairs[i1_mid][i0_mid]
-                for j_mid, j_count in matchable_pairs[i1_mid].items():
-                    matchable_pairs[i0_mid][j_mid] += j_count
-                    matchable_pairs[j_mid][i0_mid] += j_count
-                    del matchable_pairs[j_mid][i1_mid]
-                del matchable_pairs[i1_mid]
-                if not matchable_pairs[i0_mid]:  # Empty. Can delete.
-                    del matchable_pairs[i0_mid]
-
-            else:
-                # Don't merge. Mark: they have another edge in common.
-                matchable_pairs[i0_mid][i1_mid] += 1
-                matchable_pairs[i1_mid][i0_mid] += 1
-            continue
-
-        if i0 not in matches and i1 in matches:
-            i0, i1 = i1, i0
-            # Symmetry. Fall through.
-        if i0 in matches and i1 not in matches:
-            # i0 is in a group, but i1 is not.
-            # See if we may assign i0 to that group.
-            i0_matches = matches[i0]
-            overlap = 1
-            total_pairs = len(i0_matches)
-            duplicates_ok = not deduplicated or all(m0 != i1[0]
-                                                    for m0, _ in i0_matches)
-            if overlap >= merge_threshold * total_pairs and duplicates_ok:
-                # i0 is a group of 1, so trivially we can merge.
-                i0_matches.append(i1)
-                matches[i1] = i0_matches
-            else:
-                # i0 is a group of >1. i1 is not in a group, so this is
-                # the first time we're seeing it. Hence, it is not
-                # matchable with the other elements of i0.
-                i1_matches = [i1]
-                matches[i1] = i1_matches
-
-                matchable_pairs[id(i1_matches)][id(i0_matches)] = 1
-                matchable_pairs[id(i0_matches)][id(i1_matches)] = 1
-            continue
-
-        if i0 not in matches and i1 not in matches:
-            duplicates_ok = not deduplicated or i0[0] != i1[0]
-            if duplicates_ok:
-                # Neither is in a group, so let's just make one.
-                matches[i0] = matches[i1] = [i0, i1]
-            continue
-
-        raise RuntimeError('non-exhaustive cases')
-                
+                    # Symmetry. Fall through.
+                if i0 in matches and i1 not in matches:
+                    # i0 is in a group, but i1 is not.
+                    # See if we may assign i0 to that group.
+                    i0_matches = matches[i0]
+                    overlap = 1
+                    total_pairs = len(i0_matches)
+                    duplicates_ok = (not deduplicated
+                                     or all(m0 != i1[0]
+                                            for m0, _ in i0_matches))
+                    if overlap >= merge_threshold * total_pairs:
+                        if duplicates_ok:
+                            # i0 is a group of 1, so trivially we can merge.
+                            i0_matches.append(i1)
+                            matches[i1] = i0_matches
+                            if deduplicated:
+                                prune(i0_matches)
+                        else:
+                            pruned_edges += 1
+                    else:
+                        # i0 is a group of >1. i1 is not in a group, so this
+                        # is the first time we're seeing it. Hence, it is not
+                        # matchable with the other elements of i0.
+                        i1_matches = [i1]
+                        matches[i1] = i1_matches
+                        groups_by_id[id(i1_matches)] = i1_matches
+
+                        if duplicates_ok and (
+                                not deduplicated
+                                or reachable(i0_matches, i1_matches, 1)):
+                            count_new_edge()
+                            matchable_pairs[id(i1_matches)][id(i0_matches)] = 1
+                            matchable_pairs[id(i0_matches)][id(i1_matches)] = 1
+                        else:
+                            pruned_edges += 1
+                    continue
+
+                if i0 not in matches and i1 not in matches:
+                    duplicates_ok = not deduplicated or i0[0] != i1[0]
+                    if duplicates_ok:
+                        # Neither is in a group, so let's just make one.
+                        group = [i0, i1]
+                        matches[i0] = matches[i1] = group
+                        groups_by_id[id(group)] = group
+                    else:
+                        pruned_edges += 1
+                    continue
+
+                raise RuntimeError('non-exhaustive cases')
+        finally:
+            if stats is not None:
+                stats['peak_edges'] = peak_edges
+                stats['pruned_edges'] = pruned_edges
+
     # Return all nontrivial groups without duplication
     deduplicated_groups = {id(group): group
                            for group in matches.values()
@@ -216,3 +377,77 @@ def greedy_solve_python(
     """
     return probabilistic_greedy_solve_python(
         candidates, merge_threshold=1.0, deduplicated=False)
+
+
+def connected_components_python(
+    candidates: _typechecking.CandidatePairs
+) -> _typing.Tuple[int, _typechecking.IntArrayType]:
+    """Find the connected components of the candidate graph.
+
+    The records are the vertices of the candidate graph and the
+    candidate pairs are its edges. No record in one component is ever
+    matched with a record in another, so the components may be solved
+    independently.
+
+    :param tuple candidates: Candidates, as returned by
+        `find_candidates`.
+
+    :return: A 2-tuple of the number of components and an array of the
+        component of every candidate pair. Components are numbered in
+        order of their first candidate pair.
+    """
+    sims, dset_is, rec_is = candidates
+    if len(dset_is) != len(rec_is):
+        raise ValueError('inconsistent shape of index arrays')
+    if len(dset_is) != 2:
+        raise NotImplementedError(
+            f'only candidate pairs are supported (got candidates of '
+            f'{len(dset_is)} records)')
+
+    dset_is0, dset_is1 = dset_is
+    rec_is0, rec_is1 = rec_is
+    if not (len(sims)
+            == len(dset_is0) == len(dset_is1)
+            == len(rec_is0) == len(rec_is1)):
+        raise ValueError('inconsistent shape of index arrays')
+
+    with _tracing.stage('connected_components') as span:
+        span.items = len(sims)
+        return _connected_components(dset_is0, dset_is1, rec_is0, rec_is1)
+
+
+def _connected_components(
+    dset_is0: _typechecking.IntArrayType,
+    dset_is1: _typechecking.IntArrayType,
+    rec_is0: _typechecking.IntArrayType,
+    rec_is1: _typechecking.IntArrayType
+) -> _typing.Tuple[int, _typechecking.IntArrayType]:
+    # Union-find with path halving. Map every record to its parent.
+    parents: _typing.Dict[_typing.Tuple[int, int],
+                          _typing.Tuple[int, int]] = {}
+
+    def find(i):
+        parent = parents.setdefault(i, i)
+        while parent != i:
+            grandparent = parents[parent]
+            parents[i] = grandparent
+            i, parent = parent, grandparent
+        return i
+
+    first_records = []
+    for dset_i0, dset_i1, rec_i0, rec_i1 in zip(
+            dset_is0, dset_is1, rec_is0, rec_is1):
+        i0 = dset_i0, rec_i0
+        i1 = dset_i1, rec_i1
+        root0 = find(i0)
+        root1 = find(i1)
+        if root0 != root1:
+            parents[root1] = root0
+        first_records.append(i0)
+
+    # Number the components in order of their first candidate.
+    root_labels: _typing.Dict[_typing.Tuple[int, int], int] = {}
+    labels: _typechecking.IntArrayType = _array.array('I')
+    for i in first_records:
+        labels.append(root_labels.setdefault(find(i), len(root_labels)))
+    return len(root_labels), labels
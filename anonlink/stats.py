@@ -1,21 +1,160 @@
-import itertools
+import collections as _collections
+import concurrent.futures as _futures
+import functools as _functools
+import io as _io
+import itertools as _itertools
+import os as _os
+import statistics as _statistics
+import time as _time
 import typing as _typing
 
+import bitarray as _bitarray
 import numpy as _np
 
+import anonlink.serialization as _serialization
+import anonlink.similarities as _similarities
+import anonlink.solving as _solving
 import anonlink.typechecking as _typechecking
 
+# Candidate pairs in a file in the serialization format, or as the
+# iterable of 5-tuples returned by serialization.load_to_iterable.
+_CandidatePairsSource = _typing.Union[
+    _typing.BinaryIO,
+    _typing.Iterable[_typing.Tuple[float, int, int, int, int]]]
+
+
+# Resolving the greedy solution in rounds stops once a round resolves
+# fewer than this proportion of the remaining candidate pairs. The rest
+# are resolved one at a time.
+_MIN_ROUND_PROGRESS = 1 / 64
+# Records matched by the streaming greedy solver are kept in a boolean
+# array indexed by record, unless it would need more entries than this.
+_MAX_DENSE_RECORDS = 1 << 27
+# Sizes in bytes of the similarities and indices of the candidate pairs
+# returned by find_candidate_pairs.
+_CANDIDATE_SIM_BYTES = 8
+_CANDIDATE_INDEX_BYTES = 4
+
 
 def _similarities_as_nparray(candidate_pairs: _typechecking.CandidatePairs):
+    # Candidate pairs may hold arrays or NumPy arrays, such as those
+    # returned by serialization.load_candidate_pairs_mmap.
     sims, _, _ = candidate_pairs
-    return _np.frombuffer(sims, dtype=sims.typecode)
+    return _np.asarray(sims)
 
 
 def _check_bipartite(candidate_pairs: _typechecking.CandidatePairs) -> bool:
     _, (dset_is0, dset_is1), _ = candidate_pairs
-    np_dset_is0 = _np.frombuffer(dset_is0, dtype=dset_is0.typecode)
-    np_dset_is1 = _np.frombuffer(dset_is1, dtype=dset_is1.typecode)
-    return (np_dset_is0 == 0).all() and (np_dset_is1 == 1).all()
+    return bool((_np.asarray(dset_is0) == 0).all()
+                and (_np.asarray(dset_is1) == 1).all())
+
+
+def _check_pairs_of_records(
+    candidate_pairs: _typechecking.CandidatePairs
+) -> None:
+    _, dset_is, rec_is = candidate_pairs
+    if len(dset_is) != 2 or len(rec_is) != 2:
+        raise ValueError('only pairs of records are supported')
+
+
+def _dense_record_ids(rec_is: _np.ndarray) -> _np.ndarray:
+    # Record IDs that index an array about as long as rec_is.
+    if not rec_is.shape[0] or int(rec_is.max()) < 2 * rec_is.shape[0]:
+        return rec_is.astype(_np.intp, copy=False)
+    _, dense_rec_is = _np.unique(rec_is, return_inverse=True)
+    return dense_rec_is
+
+
+def _key_ids(*key_columns: _np.ndarray) -> _np.ndarray:
+    # Number the distinct keys, given as columns, from 0.
+    n = key_columns[0].shape[0]
+    order = _np.lexsort(key_columns[::-1])
+    new_key = _np.zeros(n, dtype=bool)
+    new_key[:1] = True
+    for column in key_columns:
+        sorted_column = column[order]
+        new_key[1:] |= sorted_column[1:] != sorted_column[:-1]
+    ids = _np.empty(n, dtype=_np.intp)
+    ids[order] = _np.cumsum(new_key) - 1
+    return ids
+
+
+def _pairwise_record_ids(dset_is0, dset_is1, rec_is0, rec_is1
+                         ) -> _typing.Tuple[_np.ndarray, _np.ndarray]:
+    # Identify every record by its dataset, the dataset of the other
+    # record and its index. Running the greedy solver on these IDs runs
+    # it separately for every pair of datasets, since records only
+    # conflict with records of the same pair of datasets.
+    dset_is0 = _np.asarray(dset_is0)
+    dset_is1 = _np.asarray(dset_is1)
+    rec_is0 = _np.asarray(rec_is0)
+    rec_is1 = _np.asarray(rec_is1)
+    # Put the lower dataset first so that both orders of a pair of
+    # datasets are the same.
+    swap = dset_is0 > dset_is1
+    dset_is0, dset_is1 = (_np.where(swap, dset_is1, dset_is0),
+                          _np.where(swap, dset_is0, dset_is1))
+    rec_is0, rec_is1 = (_np.where(swap, rec_is1, rec_is0),
+                        _np.where(swap, rec_is0, rec_is1))
+    return (_key_ids(dset_is0, dset_is1, rec_is0),
+            _key_ids(dset_is1, dset_is0, rec_is1))
+
+
+def _greedy_matches(rec_is0, rec_is1) -> _np.ndarray:
+    # Run the 2-party greedy solver on candidate pairs that are sorted by
+    # decreasing similarity. Return a boolean array that is True for the
+    # pairs that it accepts as matches.
+    #
+    # Instead of visiting the pairs one at a time, we resolve them in
+    # rounds. A pair is a match if it is the first unresolved pair of
+    # both its records: every earlier pair with either record has been
+    # resolved as a nonmatch. All later pairs with either record are
+    # then nonmatches. Every round resolves at least the first
+    # unresolved pair, and usually most of them.
+    rec_is0 = _dense_record_ids(_np.asarray(rec_is0))
+    rec_is1 = _dense_record_ids(_np.asarray(rec_is1))
+    n = rec_is0.shape[0]
+    is_match = _np.zeros(n, dtype=bool)
+    if not n:
+        return is_match
+    matched0 = _np.zeros(int(rec_is0.max()) + 1, dtype=bool)
+    matched1 = _np.zeros(int(rec_is1.max()) + 1, dtype=bool)
+    first0 = _np.empty(matched0.shape[0], dtype=_np.intp)
+    first1 = _np.empty(matched1.shape[0], dtype=_np.intp)
+
+    unresolved = _np.arange(n)
+    while unresolved.shape[0]:
+        unresolved_rec_is0 = rec_is0[unresolved]
+        unresolved_rec_is1 = rec_is1[unresolved]
+        first0[unresolved_rec_is0] = n
+        first1[unresolved_rec_is1] = n
+        _np.minimum.at(first0, unresolved_rec_is0, unresolved)
+        _np.minimum.at(first1, unresolved_rec_is1, unresolved)
+        new_matches = unresolved[
+            (first0[unresolved_rec_is0] == unresolved)
+            & (first1[unresolved_rec_is1] == unresolved)]
+        is_match[new_matches] = True
+        matched0[rec_is0[new_matches]] = True
+        matched1[rec_is1[new_matches]] = True
+
+        remaining = ~(matched0[unresolved_rec_is0]
+                      | matched1[unresolved_rec_is1])
+        resolved = unresolved.shape[0] - int(remaining.sum())
+        unresolved = unresolved[remaining]
+        if resolved < _MIN_ROUND_PROGRESS * unresolved.shape[0]:
+            break
+
+    # Long chains of pairs that depend on each other resolve slowly in
+    # rounds, so finish them one pair at a time.
+    matched0_bytes = bytearray(matched0.tobytes())
+    matched1_bytes = bytearray(matched1.tobytes())
+    for i, rec_i0, rec_i1 in zip(unresolved.tolist(),
+                                 rec_is0[unresolved].tolist(),
+                                 rec_is1[unresolved].tolist()):
+        if not matched0_bytes[rec_i0] and not matched1_bytes[rec_i1]:
+            matched0_bytes[rec_i0] = matched1_bytes[rec_i1] = True
+            is_match[i] = True
+    return is_match
 
 
 def similarities_hist(candidate_pairs: _typechecking.CandidatePairs,
@@ -35,40 +174,44 @@ def similarities_hist(candidate_pairs: _typechecking.CandidatePairs,
                          bins=bins)
 
 
+def _prefix_greedy_matches(
+    candidate_pairs: _typechecking.CandidatePairs,
+    end: int,
+    multiparty: bool
+) -> _np.ndarray:
+    # Run the greedy solver on the first end candidate pairs: the
+    # 2-party solver, or the 2-party solver for every pair of datasets.
+    _, (dset_is0, dset_is1), (rec_is0, rec_is1) = candidate_pairs
+    if multiparty:
+        return _greedy_matches(*_pairwise_record_ids(
+            dset_is0[:end], dset_is1[:end], rec_is0[:end], rec_is1[:end]))
+    return _greedy_matches(rec_is0[:end], rec_is1[:end])
+
+
 def _semiopen_hist_matches_nonmatches(
     candidate_pairs: _typechecking.CandidatePairs,
-    steps: int = 100
+    steps: int = 100,
+    multiparty: bool = False
 ):
-    # Run the 2-party greedy solver.
-    if not _check_bipartite(candidate_pairs):
+    # Run the greedy solver.
+    if multiparty:
+        _check_pairs_of_records(candidate_pairs)
+    elif not _check_bipartite(candidate_pairs):
         raise ValueError('only 2-party matching is supported')
 
-    thresholds = _np.histogram_bin_edges(
-        _similarities_as_nparray(candidate_pairs), bins=steps)
-    thresholds_enumerate_iter = zip(
-        range(thresholds.shape[0] - 1, -1, -1), thresholds[::-1])
+    sims = _similarities_as_nparray(candidate_pairs)
+    thresholds = _np.histogram_bin_edges(sims, bins=steps)
 
-    sims, _, (rec_is0, rec_is1) = candidate_pairs
-    matched0: _typing.Set[int] = set()
-    matched1: _typing.Set[int] = set()
-    num_matches = _np.zeros_like(thresholds, dtype=int)
-    num_nonmatches = _np.zeros_like(thresholds, dtype=int)
-    try:
-        i, threshold = next(thresholds_enumerate_iter)
-    except StopIteration:
-        return num_matches, num_nonmatches, thresholds
-    for sim, rec_i0, rec_i1 in zip(sims, rec_is0, rec_is1):
-        while sim < threshold:
-            try:
-                i, threshold = next(thresholds_enumerate_iter)
-            except StopIteration:
-                return num_matches, num_nonmatches, thresholds
-        if rec_i0 not in matched0 and rec_i1 not in matched1:
-            matched0.add(rec_i0)
-            matched1.add(rec_i1)
-            num_matches[i] += 1
-        else:
-            num_nonmatches[i] += 1
+    # Every pair counts towards the highest threshold that it meets.
+    # Pairs are sorted, so those below the lowest threshold are last.
+    bin_is = _np.searchsorted(thresholds, sims, side='right') - 1
+    end = int(_np.searchsorted(-bin_is, 0, side='right'))
+    is_match = _prefix_greedy_matches(candidate_pairs, end, multiparty)
+    bin_is = bin_is[:end]
+    num_matches = _np.bincount(bin_is[is_match],
+                               minlength=thresholds.shape[0])
+    num_nonmatches = _np.bincount(bin_is[~is_match],
+                                  minlength=thresholds.shape[0])
     return num_matches, num_nonmatches, thresholds
 
 
@@ -96,7 +239,11 @@ def matches_nonmatches_hist(
         nonmatches as an array of length bins, and (3) the edges of the
         bins as an array length bins + 1.
     """
-    semiopen_hist = _semiopen_hist_matches_nonmatches(candidate_pairs, bins)
+    return _closed_hist_matches_nonmatches(
+        _semiopen_hist_matches_nonmatches(candidate_pairs, bins))
+
+
+def _closed_hist_matches_nonmatches(semiopen_hist):
     num_matches, num_nonmatches, thresholds = semiopen_hist
     # Merge last and second last bins for consistency with np.histogram
     num_matches[-2] += num_matches[-1]
@@ -128,8 +275,12 @@ def cumul_number_matches_vs_threshold(
         an array length steps + 1, and (2) the thresholds as an array
         length steps + 1.
     """
-    num_matches, _, thresholds = _semiopen_hist_matches_nonmatches(
-        candidate_pairs, steps)
+    return _cumul_number_matches(
+        _semiopen_hist_matches_nonmatches(candidate_pairs, steps))
+
+
+def _cumul_number_matches(semiopen_hist):
+    num_matches, _, thresholds = semiopen_hist
     num_matches_rev = num_matches[::-1]
     _np.cumsum(num_matches_rev, out=num_matches_rev)
     return num_matches, thresholds
@@ -160,18 +311,982 @@ def nonmatch_index_score(
     """
     if not _check_bipartite(candidate_pairs):
         raise ValueError('only 2-party matching is supported')
-    _, _, (rec_is0, rec_is1) = candidate_pairs
-
-    matched0: _typing.Set[int] = set()
-    matched1: _typing.Set[int] = set()
-    nonmatches = 0
-    for i, rec_i0, rec_i1 in zip(itertools.count(), rec_is0, rec_is1):
-        if rec_i0 not in matched0 and rec_i1 not in matched1:
-            matched0.add(rec_i0)
-            matched1.add(rec_i1)
+    return _nonmatch_index(candidate_pairs, n, multiparty=False)
+
+
+def _nonmatch_index(
+    candidate_pairs: _typechecking.CandidatePairs,
+    n: int,
+    multiparty: bool
+) -> int:
+    if multiparty:
+        _check_pairs_of_records(candidate_pairs)
+    # The greedy solution of a prefix is a prefix of the greedy
+    # solution, so look at longer prefixes until we find n nonmatches.
+    sims, _, _ = candidate_pairs
+    total = len(sims)
+    end = min(total, 4 * max(n, 1))
+    while True:
+        nonmatch_is = _np.flatnonzero(
+            ~_prefix_greedy_matches(candidate_pairs, end, multiparty))
+        if nonmatch_is.shape[0] >= n > 0:
+            return int(nonmatch_is[n - 1])
+        if end == total:
+            # Fewer than n definite nonmatches.
+            raise ValueError('fewer than n definite nonmatches')
+        end = min(total, 2 * end)
+
+
+def matches_nonmatches_hist_multiparty(
+    candidate_pairs: _typechecking.CandidatePairs,
+    bins: int = 100
+):
+    """Compute a histogram of matches and nonmatches of many parties.
+
+    This function is experimental and subject to change without warning.
+
+    This is `matches_nonmatches_hist` for candidate pairs between any
+    number of datasets. The greedy solver is run separately for every
+    pair of datasets: a candidate pair is a definite nonmatch if one of
+    its records has a more promising match with another record of the
+    other record's dataset. For 2-party candidate pairs, the result is
+    the same as that of `matches_nonmatches_hist`.
+
+    :param candidate_pairs: The candidate pairs.
+    :param bins: An integer determining the number of bins to use.
+        Default 100.
+
+    :return: 3-tuple of (1) values of the histogram of the matches as an
+        array of length bins, (2) values of the histogram of the
+        nonmatches as an array of length bins, and (3) the edges of the
+        bins as an array length bins + 1.
+    """
+    return _closed_hist_matches_nonmatches(
+        _semiopen_hist_matches_nonmatches(candidate_pairs, bins,
+                                          multiparty=True))
+
+
+def cumul_number_matches_vs_threshold_multiparty(
+    candidate_pairs: _typechecking.CandidatePairs,
+    steps: int = 100
+):
+    """Compute the number of matches of many parties for each threshold.
+
+    This function is experimental and subject to change without warning.
+
+    This is `cumul_number_matches_vs_threshold` for candidate pairs
+    between any number of datasets. The matches are those of the
+    greedy solver run separately for every pair of datasets, as in
+    `matches_nonmatches_hist_multiparty`: the number of matched pairs of
+    records, summed over all pairs of datasets.
+
+    :param candidate_pairs: The candidate pairs.
+    :param steps: An integer determining the number of threshold steps
+        to use. Default 100.
+
+    :return: 2-tuple of (1) the number of matches for the threshold as
+        an array length steps + 1, and (2) the thresholds as an array
+        length steps + 1.
+    """
+    return _cumul_number_matches(
+        _semiopen_hist_matches_nonmatches(candidate_pairs, steps,
+                                          multiparty=True))
+
+
+def nonmatch_index_score_multiparty(
+    candidate_pairs: _typechecking.CandidatePairs,
+    n: int = 1
+) -> int:
+    """Find the index of the ``n``th definite nonmatch of many parties.
+
+    This is `nonmatch_index_score` for candidate pairs between any
+    number of datasets, with definite nonmatches as in
+    `matches_nonmatches_hist_multiparty`.
+
+    Raises ValueError if there are fewer than n definite nonmatches.
+
+    :param candidate pairs: The candidate pairs.
+    :param n: We return the index of the ``n``th definite nonmatch.
+        Default 1.
+
+    :return: The index of the ``n``th definite nonmatch if there are at
+        least ``n`` definite nonmatches in the candidate pairs.
+    """
+    return _nonmatch_index(candidate_pairs, n, multiparty=True)
+
+
+def _file_sim_range(
+    f: _typing.BinaryIO
+) -> _typing.Optional[_np.ndarray]:
+    # Similarities are sorted, so the first and last entries of the file
+    # hold the greatest and least. Leave f where it was.
+    start = f.tell()
+    try:
+        dtype = _serialization._entry_dtype(
+            *_serialization._load_header_and_check_version(f))
+        first = f.read(dtype.itemsize)
+        if not first:
+            return None
+        f.seek(-dtype.itemsize, _io.SEEK_END)
+        last = f.read(dtype.itemsize)
+    finally:
+        f.seek(start)
+    return _np.concatenate([_np.frombuffer(last, dtype=dtype)['sim'],
+                            _np.frombuffer(first, dtype=dtype)['sim']])
+
+
+def _iterable_to_blocks(
+    iterable: _typing.Iterable[_typing.Tuple[float, int, int, int, int]],
+    block_entries: int
+) -> _typing.Iterator[_typechecking.CandidatePairs]:
+    iterator = iter(iterable)
+    while True:
+        block = _np.array(list(_itertools.islice(iterator, block_entries)),
+                          dtype=_np.float64).reshape(-1, 5)
+        if not block.shape[0]:
+            return
+        # Indices below 2 ** 53 are represented exactly.
+        indices = block[:, 1:].astype(_np.uint64)
+        # NumPy arrays stand in for the arrays of CandidatePairs.
+        yield _typing.cast(_typechecking.CandidatePairs,
+                           (block[:, 0],
+                            (indices[:, 0], indices[:, 1]),
+                            (indices[:, 2], indices[:, 3])))
+
+
+def _source_blocks_and_edges(
+    source: _CandidatePairsSource,
+    bins: int,
+    sim_range: _typing.Optional[_typing.Tuple[float, float]],
+    block_entries: int
+) -> _typing.Tuple[_typing.Iterator[_typechecking.CandidatePairs],
+                   _np.ndarray]:
+    # Return the blocks of the source and the edges of the bins, which
+    # are those that np.histogram would use for all the similarities.
+    if hasattr(source, 'read'):
+        source = _typing.cast(_typing.BinaryIO, source)
+        if sim_range is None:
+            if not source.seekable():
+                raise ValueError(
+                    'sim_range is required for streams that are not '
+                    'seekable')
+            sims = _file_sim_range(source)
+        blocks = _serialization.load_to_blocks(source, block_entries)
+    else:
+        if sim_range is None:
+            raise ValueError('sim_range is required for iterables')
+        blocks = _iterable_to_blocks(source, block_entries)
+    if sim_range is not None:
+        sims = _np.array(sim_range, dtype=_np.float64)
+    if sims is None:
+        sims = _np.empty(0)
+    return blocks, _np.histogram_bin_edges(sims, bins=bins)
+
+
+class _MatchedRecords:
+    # The records of one dataset that have been matched. They are kept
+    # as a dense boolean array indexed by record, unless the record
+    # indices are too large, in which case they are kept in a set.
+
+    def __init__(self) -> None:
+        self._dense: _typing.Optional[_np.ndarray] = _np.zeros(0, dtype=bool)
+        self._sparse: _typing.Set[int] = set()
+
+    def _reserve(self, rec_is: _np.ndarray) -> None:
+        if self._dense is None or not rec_is.shape[0]:
+            return
+        size = int(rec_is.max()) + 1
+        if size <= self._dense.shape[0]:
+            return
+        if size > _MAX_DENSE_RECORDS:
+            self._sparse.update(_np.flatnonzero(self._dense).tolist())
+            self._dense = None
+            return
+        dense = _np.zeros(max(size, 2 * self._dense.shape[0]), dtype=bool)
+        dense[:self._dense.shape[0]] = self._dense
+        self._dense = dense
+
+    def contains(self, rec_is: _np.ndarray) -> _np.ndarray:
+        self._reserve(rec_is)
+        if self._dense is not None:
+            return self._dense[rec_is]
+        return _np.fromiter(map(self._sparse.__contains__, rec_is.tolist()),
+                            dtype=bool, count=rec_is.shape[0])
+
+    def add(self, rec_is: _np.ndarray) -> None:
+        self._reserve(rec_is)
+        if self._dense is not None:
+            self._dense[rec_is] = True
         else:
-            nonmatches += 1
-            if nonmatches == n:
-                return i
-    # Fewer than n definite nonmatches.
-    raise ValueError('fewer than n definite nonmatches')
+            self._sparse.update(rec_is.tolist())
+
+
+class _StreamingGreedy:
+    # The 2-party greedy solver over consecutive blocks of candidate
+    # pairs. Only the records matched so far are kept between blocks.
+
+    def __init__(self) -> None:
+        self._matched0 = _MatchedRecords()
+        self._matched1 = _MatchedRecords()
+
+    def matches(self, rec_is0: _np.ndarray, rec_is1: _np.ndarray
+                ) -> _np.ndarray:
+        rec_is0 = rec_is0.astype(_np.intp, copy=False)
+        rec_is1 = rec_is1.astype(_np.intp, copy=False)
+        # Pairs with a record matched in an earlier block are nonmatches.
+        # The rest are solved as if they were the only pairs.
+        fresh = _np.flatnonzero(~(self._matched0.contains(rec_is0)
+                                  | self._matched1.contains(rec_is1)))
+        is_match = _np.zeros(rec_is0.shape[0], dtype=bool)
+        is_match[fresh] = _greedy_matches(rec_is0[fresh], rec_is1[fresh])
+        self._matched0.add(rec_is0[is_match])
+        self._matched1.add(rec_is1[is_match])
+        return is_match
+
+
+def _semiopen_hist_matches_nonmatches_stream(
+    source: _CandidatePairsSource,
+    steps: int,
+    sim_range: _typing.Optional[_typing.Tuple[float, float]],
+    block_entries: int
+):
+    blocks, thresholds = _source_blocks_and_edges(
+        source, steps, sim_range, block_entries)
+    num_matches = _np.zeros(thresholds.shape[0], dtype=_np.int64)
+    num_nonmatches = _np.zeros(thresholds.shape[0], dtype=_np.int64)
+    greedy = _StreamingGreedy()
+    for block in blocks:
+        if not _check_bipartite(block):
+            raise ValueError('only 2-party matching is supported')
+        sims, _, (rec_is0, rec_is1) = block
+        bin_is = _np.searchsorted(thresholds, sims, side='right') - 1
+        end = int(_np.searchsorted(-bin_is, 0, side='right'))
+        is_match = greedy.matches(_np.asarray(rec_is0)[:end],
+                                  _np.asarray(rec_is1)[:end])
+        bin_is = bin_is[:end]
+        num_matches += _np.bincount(bin_is[is_match],
+                                    minlength=thresholds.shape[0])
+        num_nonmatches += _np.bincount(bin_is[~is_match],
+                                       minlength=thresholds.shape[0])
+        if end < len(sims):
+            # The remaining pairs are below the lowest threshold.
+            break
+    return num_matches, num_nonmatches, thresholds
+
+
+def similarities_hist_stream(
+    source: _CandidatePairsSource,
+    bins: int = 100,
+    *,
+    sim_range: _typing.Optional[_typing.Tuple[float, float]] = None,
+    block_entries: int = 1 << 16
+):
+    """Compute a histogram of similarity scores without loading them.
+
+    This function is experimental and subject to change without warning.
+
+    This is `similarities_hist` for candidate pairs that are read in
+    one pass, a block at a time, so they never need to fit in memory.
+
+    :param source: A binary stream in the `anonlink.serialization`
+        format, or an iterable of candidate pairs as returned by
+        `anonlink.serialization.load_to_iterable`. The candidate pairs
+        must be sorted, as they are when returned by
+        `find_candidate_pairs`.
+    :param bins: An integer determining the number of bins to use.
+        Default 100.
+    :param sim_range: The least and greatest similarity, which determine
+        the edges of the bins. Required for iterables and streams that
+        are not seekable. Default None (read them from the first and
+        last candidate pair of the stream).
+    :param block_entries: The number of candidate pairs to read at once.
+        Default 65536.
+
+    :return: 2-tuple of (1) values of the histogram as an array length
+        bins, and (2) the edges of the bins as an array length bins + 1.
+        If `sim_range` is None, they are the same as those returned by
+        `similarities_hist`.
+    """
+    blocks, edges = _source_blocks_and_edges(
+        source, bins, sim_range, block_entries)
+    counts = _np.zeros(edges.shape[0] - 1, dtype=_np.int64)
+    for sims, _, _ in blocks:
+        block_counts, _ = _np.histogram(sims, bins=edges)
+        counts += block_counts
+    return counts, edges
+
+
+def matches_nonmatches_hist_stream(
+    source: _CandidatePairsSource,
+    bins: int = 100,
+    *,
+    sim_range: _typing.Optional[_typing.Tuple[float, float]] = None,
+    block_entries: int = 1 << 16
+):
+    """Compute a histogram of matches and nonmatches without loading them.
+
+    This function is experimental and subject to change without warning.
+
+    This is `matches_nonmatches_hist` for candidate pairs that are read
+    in one pass, a block at a time. Besides the current block, only the
+    records matched so far are kept, as one boolean per record index.
+
+    :param source: A binary stream or an iterable of candidate pairs, as
+        in `similarities_hist_stream`.
+    :param bins: An integer determining the number of bins to use.
+        Default 100.
+    :param sim_range: The least and greatest similarity, as in
+        `similarities_hist_stream`.
+    :param block_entries: The number of candidate pairs to read at once.
+        Default 65536.
+
+    :return: 3-tuple of (1) values of the histogram of the matches as an
+        array of length bins, (2) values of the histogram of the
+        nonmatches as an array of length bins, and (3) the edges of the
+        bins as an array length bins + 1.
+    """
+    return _closed_hist_matches_nonmatches(
+        _semiopen_hist_matches_nonmatches_stream(
+            source, bins, sim_range, block_entries))
+
+
+def cumul_number_matches_vs_threshold_stream(
+    source: _CandidatePairsSource,
+    steps: int = 100,
+    *,
+    sim_range: _typing.Optional[_typing.Tuple[float, float]] = None,
+    block_entries: int = 1 << 16
+):
+    """Compute the number of matches for each threshold without loading.
+
+    This function is experimental and subject to change without warning.
+
+    This is `cumul_number_matches_vs_threshold` for candidate pairs that
+    are read in one pass, a block at a time, as in
+    `matches_nonmatches_hist_stream`.
+
+    :param source: A binary stream or an iterable of candidate pairs, as
+        in `similarities_hist_stream`.
+    :param steps: An integer determining the number of threshold steps
+        to use. Default 100.
+    :param sim_range: The least and greatest similarity, as in
+        `similarities_hist_stream`.
+    :param block_entries: The number of candidate pairs to read at once.
+        Default 65536.
+
+    :return: 2-tuple of (1) the number of matches for the threshold as
+        an array length steps + 1, and (2) the thresholds as an array
+        length steps + 1.
+    """
+    return _cumul_number_matches(
+        _semiopen_hist_matches_nonmatches_stream(
+            source, steps, sim_range, block_entries))
+
+
+def _sample_similarities(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    min_similarity: float,
+    sample_rows: int,
+    sample_columns: _typing.Optional[int],
+    similarity_f: _typing.Optional[_typechecking.SimilarityFunction],
+    seed: _typing.Optional[int]
+):
+    # Compare a random sample of the records of the first dataset with a
+    # random sample of the records of the second. Return the
+    # similarities of at least min_similarity, the positions in the
+    # samples of the records of each, and the sizes of the samples.
+    if len(datasets) != 2:
+        raise ValueError(
+            f'only 2 datasets are supported (got {len(datasets)})')
+    if not 0 < min_similarity <= 1:
+        raise ValueError(
+            f'min_similarity must be in (0, 1] (got {min_similarity})')
+    if sample_rows < 1:
+        raise ValueError(f'sample_rows must be positive (got {sample_rows})')
+    if sample_columns is not None and sample_columns < 1:
+        raise ValueError(
+            f'sample_columns must be positive (got {sample_columns})')
+    if similarity_f is None:
+        similarity_f = _similarities.dice_coefficient
+
+    dataset0, dataset1 = datasets
+    size0 = len(dataset0)
+    size1 = len(dataset1)
+    rng = _np.random.default_rng(seed)
+    rows = min(sample_rows, size0)
+    columns = size1 if sample_columns is None else min(sample_columns, size1)
+    row_is = _np.sort(rng.choice(size0, rows, replace=False))
+    column_is = _np.sort(rng.choice(size1, columns, replace=False))
+    sample = ([dataset0[i] for i in row_is.tolist()],
+              [dataset1[i] for i in column_is.tolist()])
+
+    if rows and columns:
+        sims, (sample_rec_is0, sample_rec_is1) = similarity_f(
+            sample, min_similarity)
+        np_sims = _np.asarray(sims, dtype=_np.float64)
+        np_rec_is = (_np.asarray(sample_rec_is0, dtype=_np.intp),
+                     _np.asarray(sample_rec_is1, dtype=_np.intp))
+    else:
+        np_sims = _np.empty(0)
+        np_rec_is = (_np.empty(0, dtype=_np.intp),
+                     _np.empty(0, dtype=_np.intp))
+    return np_sims, np_rec_is, rows, columns, size0, size1
+
+
+def estimate_similarities_hist(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    bins: int = 100,
+    *,
+    min_similarity: float = .5,
+    sample_rows: int = 1000,
+    sample_columns: _typing.Optional[int] = None,
+    similarity_f: _typing.Optional[_typechecking.SimilarityFunction] = None,
+    seed: _typing.Optional[int] = None
+):
+    """Estimate a histogram of similarities from a sample of records.
+
+    This function is experimental and subject to change without warning.
+
+    A random sample of `sample_rows` records of the first dataset is
+    compared with a random sample of `sample_columns` records of the
+    second, and the histogram of their similarities is scaled up to
+    all pairs of records. This takes a fraction of the time of
+    `find_candidate_pairs` followed by `similarities_hist`.
+
+    :param datasets: A length 2 sequence of datasets.
+    :param bins: An integer determining the number of bins to use.
+        Default 100.
+    :param min_similarity: The least similarity of interest. The bins
+        evenly divide the range from this to 1. Default 0.5.
+    :param sample_rows: The number of records of the first dataset to
+        sample. Default 1000.
+    :param sample_columns: The number of records of the second dataset
+        to sample. Default None (all of them).
+    :param similarity_f: The similarity function. Default
+        `anonlink.similarities.dice_coefficient`.
+    :param seed: Seed for the random sample. Default None.
+
+    :return: 2-tuple of (1) the estimated number of pairs of records in
+        every bin as an array length bins, and (2) the edges of the bins
+        as an array length bins + 1.
+    """
+    sims, _, rows, columns, size0, size1 = _sample_similarities(
+        datasets, min_similarity, sample_rows, sample_columns,
+        similarity_f, seed)
+    counts, edges = _np.histogram(sims, bins=bins, range=(min_similarity, 1))
+    scale = size0 * size1 / (rows * columns) if rows and columns else 0.
+    return counts * scale, edges
+
+
+def estimate_candidate_counts(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    thresholds: _typing.Sequence[float],
+    *,
+    confidence: float = .95,
+    sample_rows: int = 1000,
+    sample_columns: _typing.Optional[int] = None,
+    similarity_f: _typing.Optional[_typechecking.SimilarityFunction] = None,
+    seed: _typing.Optional[int] = None
+):
+    """Estimate the number of candidate pairs for every threshold.
+
+    This function is experimental and subject to change without warning.
+
+    A random sample of `sample_rows` records of the first dataset is
+    compared with a random sample of `sample_columns` records of the
+    second. For every sampled record, we count its candidate pairs in
+    the sample and scale up to the whole second dataset. The estimate
+    is then the mean count times the size of the first dataset. The
+    confidence interval uses the normal approximation. Its variance is
+    the sum of the variances due to sampling each dataset, estimated
+    from the counts of the sampled records of that dataset with a
+    finite population correction.
+
+    Use this to choose a threshold or a chunk size before finding the
+    candidate pairs.
+
+    :param datasets: A length 2 sequence of datasets.
+    :param thresholds: The thresholds to estimate the number of
+        candidate pairs for. They must be in (0, 1].
+    :param confidence: The confidence level of the intervals. Default
+        0.95.
+    :param sample_rows: The number of records of the first dataset to
+        sample. Default 1000.
+    :param sample_columns: The number of records of the second dataset
+        to sample. Default None (all of them).
+    :param similarity_f: The similarity function. Default
+        `anonlink.similarities.dice_coefficient`.
+    :param seed: Seed for the random sample. Default None.
+
+    :return: 3-tuple of (1) the estimated number of candidate pairs,
+        (2) the lower bounds of the confidence intervals, and (3) their
+        upper bounds, each as an array with one value per threshold.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError(f'confidence must be in (0, 1) (got {confidence})')
+    thresholds_arr = _np.asarray(thresholds, dtype=_np.float64)
+    if not thresholds_arr.shape[0]:
+        empty = _np.empty(0)
+        return empty, empty, empty
+    sims, rec_is, rows, columns, size0, size1 = _sample_similarities(
+        datasets, float(thresholds_arr.min()), sample_rows, sample_columns,
+        similarity_f, seed)
+    total_pairs = size0 * size1
+    if not rows or not columns:
+        zeros = _np.zeros(thresholds_arr.shape[0])
+        return zeros, zeros, zeros
+
+    rec_is0, rec_is1 = rec_is
+    row_counts = _threshold_counts(sims, rec_is0, rows, thresholds_arr)
+    column_counts = _threshold_counts(sims, rec_is1, columns, thresholds_arr)
+    return _total_with_interval(
+        row_counts * (size1 / columns), size0,
+        column_counts * (size0 / rows), size1,
+        confidence=confidence, maximum=total_pairs)
+
+
+def _threshold_counts(
+    sims: _np.ndarray,
+    rec_is: _np.ndarray,
+    records: int,
+    thresholds: _np.ndarray
+) -> _np.ndarray:
+    # counts[i, j] is the number of candidate pairs of the ith record at
+    # threshold thresholds[j].
+    return _np.stack([_np.bincount(rec_is[sims >= threshold],
+                                   minlength=records)
+                      for threshold in thresholds.tolist()], axis=1)
+
+
+def _sampling_variances(counts: _np.ndarray, size: int) -> _np.ndarray:
+    # The variances of size times the means of the columns of counts,
+    # as estimates of the totals over all size records, given a row of
+    # counts for each record in a random sample of them.
+    rows = counts.shape[0]
+    if rows == size:
+        return _np.zeros(counts.shape[1])
+    if rows < 2:
+        return _np.full(counts.shape[1], _np.inf)
+    population_correction = 1 - rows / size
+    return (size ** 2 * counts.var(axis=0, ddof=1)
+            * population_correction / rows)
+
+
+def _total_with_interval(
+    row_counts: _np.ndarray,
+    size0: int,
+    column_counts: _typing.Optional[_np.ndarray],
+    size1: int,
+    *,
+    confidence: float,
+    maximum: float
+) -> _typing.Tuple[_np.ndarray, _np.ndarray, _np.ndarray]:
+    # Estimate the totals of the columns of row_counts over all size0
+    # records of the first dataset, given a row of counts for each
+    # record in a random sample of them. column_counts holds the same
+    # counts for a random sample of the records of the second dataset,
+    # or None if all of its records were compared. Return the estimates
+    # and the bounds of their confidence intervals.
+    estimates = size0 * row_counts.mean(axis=0)
+    variances = _sampling_variances(row_counts, size0)
+    if column_counts is not None:
+        variances = variances + _sampling_variances(column_counts, size1)
+    standard_errors = _np.sqrt(variances)
+    z = _statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    lower = _np.clip(estimates - z * standard_errors, 0, maximum)
+    upper = _np.clip(estimates + z * standard_errors, 0, maximum)
+    return estimates, lower, upper
+
+
+# The number of set bits of every byte.
+_BYTE_POPCOUNTS = _np.array([bin(i).count('1') for i in range(256)],
+                            dtype=_np.uint8)
+# The number of records of a packed matrix to unpack into bits at once.
+_UNPACK_ROWS = 1 << 14
+
+
+def _packed_records(
+    dataset: _typechecking.Dataset
+) -> _typing.Tuple[_np.ndarray, int]:
+    # Pack the records into a matrix of bytes, one row per record, with
+    # the first bit of every record in the most significant bit of its
+    # first byte. Return the matrix and the number of bits per record.
+    if not len(dataset):
+        return _np.zeros((0, 0), dtype=_np.uint8), 0
+    if all(isinstance(record, _bitarray.bitarray) for record in dataset):
+        bits = len(dataset[0])
+        if any(len(record) != bits for record in dataset):
+            raise ValueError('records must all have the same length')
+        data = b''.join(
+            record.tobytes() if record.endian() == 'big'
+            else _bitarray.bitarray(record, endian='big').tobytes()
+            for record in dataset)
+    else:
+        records = [bytes(record) for record in dataset]
+        bits = 8 * len(records[0])
+        if any(8 * len(record) != bits for record in records):
+            raise ValueError('records must all have the same length')
+        data = b''.join(records)
+    matrix = _np.frombuffer(data, dtype=_np.uint8)
+    return matrix.reshape(len(dataset), -1), bits
+
+
+def _popcount_hist(matrix: _np.ndarray, bits: int) -> _np.ndarray:
+    popcounts = _BYTE_POPCOUNTS[matrix].sum(axis=1, dtype=_np.intp)
+    return _np.bincount(popcounts, minlength=bits + 1)
+
+
+def _popcount_filter_passes(
+    popcount_counts0: _np.ndarray,
+    popcount_counts1: _np.ndarray,
+    threshold: float
+) -> float:
+    # The number of pairs of records that the popcount filter of the
+    # accelerated Dice kernel lets through, when the records of the
+    # first dataset are compared against the second. A record with
+    # popcount a is only compared with records whose popcount is within
+    # floor(2 a (1 / threshold - 1)) of a, and records with no bits set
+    # are not compared at all.
+    counts0 = popcount_counts0.astype(_np.float64)
+    counts1 = popcount_counts1.astype(_np.float64)
+    if threshold <= 0:
+        return float(counts0.sum() * counts1.sum())
+    popcounts = _np.arange(counts0.shape[0])
+    max_deltas = _np.floor(2 * popcounts * (1 / threshold - 1))
+    cumul_counts1 = _np.concatenate([[0.], _np.cumsum(counts1)])
+    low = _np.clip(popcounts - max_deltas, 0, counts1.shape[0])
+    high = _np.clip(popcounts + max_deltas + 1, 0, counts1.shape[0])
+    passes = (cumul_counts1[high.astype(_np.intp)]
+              - cumul_counts1[low.astype(_np.intp)])
+    passes[0] = 0
+    return float(counts0 @ passes)
+
+
+def popcount_profile(
+    dataset: _typechecking.Dataset
+) -> _typing.Tuple[_np.ndarray, _np.ndarray]:
+    """Profile the popcounts and bits of the records of a dataset.
+
+    This function is experimental and subject to change without warning.
+
+    The records are packed into a matrix of bytes and processed with
+    vectorised operations.
+
+    :param dataset: A sequence of bitarrays or bytes-like records, all
+        of the same length.
+
+    :return: A 2-tuple of the number of records with every popcount,
+        indexed by popcount from 0 to the number of bits per record,
+        and the proportion of records with every bit set. Both are
+        empty if the dataset is.
+    """
+    matrix, bits = _packed_records(dataset)
+    if not matrix.shape[0]:
+        return _np.zeros(0, dtype=_np.intp), _np.zeros(0)
+    bit_counts = _np.zeros(8 * matrix.shape[1], dtype=_np.int64)
+    for start in range(0, matrix.shape[0], _UNPACK_ROWS):
+        bit_counts += _np.unpackbits(
+            matrix[start:start + _UNPACK_ROWS], axis=1
+        ).sum(axis=0, dtype=_np.int64)
+    return (_popcount_hist(matrix, bits),
+            bit_counts[:bits] / matrix.shape[0])
+
+
+def popcount_filter_pruning(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    threshold: float
+) -> float:
+    """Predict the effectiveness of the popcount filter of Dice kernels.
+
+    This function is experimental and subject to change without warning.
+
+    Before computing the Dice coefficient of two records, the
+    accelerated Dice kernel skips the pair if their popcounts are too
+    far apart for the coefficient to reach `threshold`. The kernel is
+    fastest when most pairs are skipped. We compute the proportion of
+    the pairs of records of different datasets that are skipped, from
+    the distribution of the popcounts of every dataset. This is exact,
+    as the filter only depends on the popcounts.
+
+    A proportion near 0 means that nearly every pair is compared, and
+    that blocking may be needed for large datasets.
+
+    :param datasets: A sequence of datasets of bitarrays or bytes-like
+        records.
+    :param threshold: The similarity threshold, in [0, 1].
+
+    :return: The proportion of pairs of records that are skipped, or 0
+        if there are no pairs.
+    """
+    if not 0 <= threshold <= 1:
+        raise ValueError(f'threshold must be in [0, 1] (got {threshold})')
+    popcount_counts = [_popcount_hist(*_packed_records(dataset))
+                       for dataset in datasets]
+    total = passes = 0.
+    for counts0, counts1 in _itertools.combinations(popcount_counts, 2):
+        total += float(counts0.sum()) * float(counts1.sum())
+        passes += _popcount_filter_passes(counts0, counts1, threshold)
+    return 1 - passes / total if total else 0.
+
+
+def estimate_linkage_cost(
+    datasets: _typing.Sequence[_typechecking.Dataset],
+    threshold: float,
+    k: _typing.Optional[int] = None,
+    *,
+    blocking_f: _typing.Optional[_typechecking.BlockingFunction] = None,
+    sample_rows: int = 200,
+    confidence: float = .95,
+    similarity_f: _typing.Optional[_typechecking.SimilarityFunction] = None,
+    seed: _typing.Optional[int] = None
+) -> _typing.Dict[str, float]:
+    """Estimate the cost of finding candidate pairs before doing so.
+
+    This function is experimental and subject to change without warning.
+
+    For every pair of datasets, we count:
+
+    - the comparisons, which is the sum over blocks of the product of
+      the block's sizes, or the product of the datasets' sizes if there
+      is no blocking;
+    - the comparisons that are not skipped by the popcount filter of
+      the accelerated Dice kernel, as in `popcount_filter_pruning`
+      (with blocking, this is the proportion of all pairs of records
+      that are not skipped, times the comparisons);
+    - the candidate pairs, estimated as in
+      `estimate_candidate_counts` by comparing a random sample of
+      records of the first dataset with all records that they share a
+      block with. With `k`, the candidates of every sampled record are
+      capped at `k`. This is an upper bound, since the cap on the
+      records of the second dataset is not accounted for.
+
+    Comparing the sample is timed, which calibrates the time per
+    comparison on this machine. The runtime is estimated from it and
+    the number of comparisons, for one thread. With blocking, the
+    sampled records are compared with one call of `similarity_f` per
+    block, as in `find_candidate_pairs`. Those calls only have the
+    sampled records of the block, so their fixed overhead is spread
+    over fewer comparisons than in the full run, and the runtime is
+    overestimated when blocks are small.
+
+    :param datasets: A sequence of datasets of bitarrays or bytes-like
+        records.
+    :param threshold: The similarity threshold, in (0, 1].
+    :param k: The `k` to be passed to `find_candidate_pairs`, or None.
+    :param blocking_f: The blocking function to be passed to
+        `find_candidate_pairs`, or None.
+    :param sample_rows: The number of records of the first dataset of
+        every pair to sample. Default 200.
+    :param confidence: The confidence level of the intervals. Default
+        0.95.
+    :param similarity_f: The similarity function. Default
+        `anonlink.similarities.dice_coefficient`.
+    :param seed: Seed for the random sample. Default None.
+
+    :return: A JSON-serialisable dictionary with the keys
+        'comparisons', 'popcountFilteredComparisons', 'candidates',
+        'candidatesLower', 'candidatesUpper' (the bounds of the
+        confidence interval), 'outputBytes' (the size of the candidate
+        pairs in the `anonlink.serialization` format, and roughly in
+        memory) and 'seconds'.
+    """
+    if not 0 < threshold <= 1:
+        raise ValueError(f'threshold must be in (0, 1] (got {threshold})')
+    if not 0 < confidence < 1:
+        raise ValueError(f'confidence must be in (0, 1) (got {confidence})')
+    if sample_rows < 1:
+        raise ValueError(f'sample_rows must be positive (got {sample_rows})')
+    if similarity_f is None:
+        similarity_f = _similarities.dice_coefficient
+    rng = _np.random.default_rng(seed)
+
+    comparisons = 0
+    filtered_comparisons = 0.
+    candidates = candidates_lower = candidates_upper = 0.
+    seconds = 0.
+    popcount_counts = [_popcount_hist(*_packed_records(dataset))
+                       for dataset in datasets]
+    for i0, i1 in _itertools.combinations(range(len(datasets)), 2):
+        dataset0, dataset1 = datasets[i0], datasets[i1]
+        size0, size1 = len(dataset0), len(dataset1)
+        if not size0 or not size1:
+            continue
+        passes = _popcount_filter_passes(popcount_counts[i0],
+                                         popcount_counts[i1], threshold)
+        if blocking_f is None:
+            pair_comparisons = size0 * size1
+            pair_filtered = passes
+        else:
+            blocks0 = [tuple(blocking_f(i0, j, record))
+                       for j, record in enumerate(dataset0)]
+            blocks1: _typing.DefaultDict[_typing.Hashable,
+                                         _typing.List[int]] \
+                = _collections.defaultdict(list)
+            for j, record in enumerate(dataset1):
+                for block_id in blocking_f(i1, j, record):
+                    blocks1[block_id].append(j)
+            pair_comparisons = sum(len(blocks1.get(block_id, ()))
+                                   for record_blocks in blocks0
+                                   for block_id in record_blocks)
+            pair_filtered = pair_comparisons * passes / (size0 * size1)
+        comparisons += pair_comparisons
+        filtered_comparisons += pair_filtered
+
+        rows = min(sample_rows, size0)
+        row_is = _np.sort(rng.choice(size0, rows, replace=False)).tolist()
+        row_counts = _np.zeros(rows)
+        sampled_comparisons = 0
+        start = _time.perf_counter()
+        if blocking_f is None:
+            sims, (sample_rec_is0, _) = similarity_f(
+                ([dataset0[j] for j in row_is], dataset1), threshold)
+            row_counts = _np.bincount(
+                _np.asarray(sample_rec_is0, dtype=_np.intp),
+                minlength=rows).astype(_np.float64)
+            sampled_comparisons = rows * size1
+        else:
+            # Compare the sampled records of every block with the records
+            # of the second dataset in it, in one call per block. A pair
+            # of records in several blocks is a candidate pair once.
+            sampled_blocks: _typing.DefaultDict[_typing.Hashable,
+                                                _typing.List[int]] \
+                = _collections.defaultdict(list)
+            for row, j in enumerate(row_is):
+                for block_id in blocks0[j]:
+                    if block_id in blocks1:
+                        sampled_blocks[block_id].append(row)
+            row_candidates: _typing.List[_typing.Set[int]] = [
+                set() for _ in range(rows)]
+            for block_id, block_rows in sampled_blocks.items():
+                block_columns = blocks1[block_id]
+                sims, (block_is0, block_is1) = similarity_f(
+                    ([dataset0[row_is[row]] for row in block_rows],
+                     [dataset1[c] for c in block_columns]),
+                    threshold)
+                for i, c in zip(block_is0, block_is1):
+                    row_candidates[block_rows[i]].add(block_columns[c])
+                sampled_comparisons += len(block_rows) * len(block_columns)
+            row_counts = _np.fromiter(map(len, row_candidates),
+                                      dtype=_np.float64, count=rows)
+        elapsed = _time.perf_counter() - start
+        if k is not None:
+            row_counts = _np.minimum(row_counts, k)
+        estimate, lower, upper = _total_with_interval(
+            row_counts[:, _np.newaxis], size0, None, size1,
+            confidence=confidence, maximum=pair_comparisons)
+        candidates += float(estimate[0])
+        candidates_lower += float(lower[0])
+        candidates_upper += float(upper[0])
+        if sampled_comparisons:
+            seconds += elapsed * pair_comparisons / sampled_comparisons
+
+    entry_bytes = _serialization._entry_struct(
+        _CANDIDATE_SIM_BYTES, _CANDIDATE_INDEX_BYTES,
+        _CANDIDATE_INDEX_BYTES).size
+    return {'comparisons': comparisons,
+            'popcountFilteredComparisons': float(filtered_comparisons),
+            'candidates': candidates,
+            'candidatesLower': candidates_lower,
+            'candidatesUpper': candidates_upper,
+            'outputBytes': (_serialization._HEADER_STRUCT.size
+                            + candidates * entry_bytes),
+            'seconds': seconds}
+
+
+def _solved_group_sizes(
+    solve_f: _typing.Callable[..., _typechecking.MatchGroups],
+    candidate_pairs: _typechecking.CandidatePairs,
+    merge_threshold: float,
+    deduplicated: bool
+) -> _np.ndarray:
+    groups = solve_f(candidate_pairs, merge_threshold=merge_threshold,
+                     deduplicated=deduplicated)
+    return _np.bincount(_np.fromiter(map(len, groups), dtype=_np.intp,
+                                     count=len(groups)))
+
+
+def merge_threshold_sweep(
+    candidate_pairs: _typechecking.CandidatePairs,
+    merge_thresholds: _typing.Sequence[float],
+    *,
+    deduplicated: bool = True,
+    solve_f: _typing.Optional[
+        _typing.Callable[..., _typechecking.MatchGroups]] = None,
+    executor: _typing.Optional[_futures.Executor] = None,
+    partitions: _typing.Optional[int] = None
+) -> _typing.Tuple[_np.ndarray, _np.ndarray]:
+    """Count the groups of the solver for many merge thresholds.
+
+    This function is experimental and subject to change without warning.
+
+    The candidate graph is split into partitions of whole connected
+    components once, with `partition_candidates`. Every partition is
+    then solved for every merge threshold, as one batch of tasks. The
+    tasks share the partitions' arrays, so no candidate pairs are
+    copied per merge threshold. The native solvers release the GIL, so
+    a `ThreadPoolExecutor` runs the tasks in parallel.
+
+    The groups are those of `solve_f(candidate_pairs,
+    merge_threshold=merge_threshold, deduplicated=deduplicated)`.
+
+    :param candidate_pairs: The candidate pairs, as returned by
+        `find_candidate_pairs`.
+    :param merge_thresholds: The merge thresholds to solve for, each in
+        [0, 1].
+    :param deduplicated: Passed to `solve_f`. Default True.
+    :param solve_f: The solver. Default `probabilistic_greedy_solve`.
+    :param executor: A `concurrent.futures.Executor` to run the solver
+        on, as in `parallel_solve`. If omitted, a `ThreadPoolExecutor`
+        is created for the duration of the call.
+    :param partitions: The number of partitions to split the candidate
+        pairs into. Default four per CPU.
+
+    :return: A 2-tuple of the number of groups for every merge
+        threshold, and a 2D array where the element at [i, s] is the
+        number of groups of s records for the ith merge threshold.
+        Records that are not matched do not form groups.
+    """
+    merge_thresholds = list(map(float, merge_thresholds))
+    for merge_threshold in merge_thresholds:
+        if not 0 <= merge_threshold <= 1:
+            raise ValueError(f'merge thresholds must be in [0, 1] (got '
+                             f'{merge_threshold})')
+    if solve_f is None:
+        solve_f = _solving.probabilistic_greedy_solve
+    if executor is None:
+        with _futures.ThreadPoolExecutor() as executor:
+            return merge_threshold_sweep(
+                candidate_pairs, merge_thresholds,
+                deduplicated=deduplicated, solve_f=solve_f,
+                executor=executor, partitions=partitions)
+    if partitions is None:
+        partitions = 4 * (_os.cpu_count() or 1)
+
+    # Columns may be strided, e.g., those of memory-mapped candidate
+    # pairs. The native solvers need contiguous arrays.
+    sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = candidate_pairs
+    candidate_pairs = _typing.cast(_typechecking.CandidatePairs, (
+        _np.ascontiguousarray(sims, dtype=_np.float64),
+        (_np.ascontiguousarray(dset_is0, dtype=_np.uint32),
+         _np.ascontiguousarray(dset_is1, dtype=_np.uint32)),
+        (_np.ascontiguousarray(rec_is0, dtype=_np.uint32),
+         _np.ascontiguousarray(rec_is1, dtype=_np.uint32))))
+    parts = _solving.partition_candidates(candidate_pairs, partitions)
+    tasks = [(i, part)
+             for i in range(len(merge_thresholds))
+             for part in parts]
+    results = executor.map(
+        _functools.partial(_solved_group_sizes, solve_f),
+        (part for _, part in tasks),
+        (merge_thresholds[i] for i, _ in tasks),
+        _itertools.repeat(deduplicated))
+
+    size_counts = _np.zeros((len(merge_thresholds), 0), dtype=_np.int64)
+    for (i, _), part_size_counts in zip(tasks, results):
+        if part_size_counts.shape[0] > size_counts.shape[1]:
+            size_counts = _np.pad(
+                size_counts,
+                ((0, 0),
+                 (0, part_size_counts.shape[0] - size_counts.shape[1])))
+        size_counts[i, :part_size_counts.shape[0]] += part_size_counts
+    return size_counts.sum(axis=1), size_counts
@@ -0,0 +1,297 @@
+"""Tracing the time spent in the stages of a linkage.
+
+Candidate generation, chunk processing, merging, serialisation and the
+solvers report their stages to every active `Tracer`. A stage records
+its wall time, its CPU time, the number of items it processed and the
+peak resident set size of the process while it ran. When no tracer is
+active, reporting a stage costs one check of an empty list.
+
+Example::
+
+    with anonlink.tracing.Tracer() as tracer:
+        candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
+            datasets, similarity_f, threshold)
+        groups = anonlink.solving.greedy_solve(candidate_pairs)
+    print(tracer.summary())
+    with open('trace.json', 'w') as f:
+        tracer.dump_chrome_trace(f)
+
+Tracers are shared by all threads of the process, so stages run on a
+`ThreadPoolExecutor` are recorded. Stages run in other processes are
+not. The peak resident set size is that of the whole process, so it
+includes the memory of stages running at the same time.
+"""
+
+import json as _json
+import os as _os
+import sys as _sys
+import threading as _threading
+import time as _time
+import typing as _typing
+
+try:
+    import resource as _resource
+except ImportError:  # Not available on Windows.
+    _resource = None  # type: ignore
+
+Event = _typing.Dict[str, _typing.Any]
+
+# The active tracers. The list is replaced rather than modified, so
+# stages can read it without the lock.
+_tracers: _typing.List['Tracer'] = []
+_tracers_lock = _threading.Lock()
+
+
+def _peak_rss_bytes() -> _typing.Optional[int]:
+    # VmHWM can be reset, unlike ru_maxrss. Fall back to ru_maxrss where
+    # /proc is unavailable.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if _resource is None:
+        return None
+    peak_rss = _resource.getrusage(_resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes and macOS reports bytes.
+    return peak_rss if _sys.platform == 'darwin' else peak_rss * 1024
+
+
+def _reset_peak_rss() -> bool:
+    # Reset VmHWM to the current resident set size. Return whether it
+    # was reset; if not, the peak is that of the lifetime of the process.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+# The peaks of the stages in progress in every thread. Starting a stage
+# resets the peak of the process, so the peak up to then is first
+# folded into those of the stages that were already in progress.
+_open_peaks: _typing.Dict[int, _typing.Optional[int]] = {}
+_open_peaks_lock = _threading.Lock()
+
+
+def _fold_peak_rss() -> None:
+    # Must be called with _open_peaks_lock held.
+    peak = _peak_rss_bytes()
+    if peak is None:
+        return
+    for key, open_peak in _open_peaks.items():
+        if open_peak is not None:
+            _open_peaks[key] = max(open_peak, peak)
+
+
+class Span:
+    """A stage in progress.
+
+    :ivar items: The number of items the stage processed, or None. The
+        instrumented code may set this before the stage ends.
+    """
+
+    __slots__ = 'items',
+
+    def __init__(self) -> None:
+        self.items: _typing.Optional[int] = None
+
+
+class _NullStage:
+    # The stage reported when no tracer is active. Its span is shared,
+    # and whatever is set on it is ignored.
+    span = Span()
+
+    def __enter__(self) -> Span:
+        return self.span
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'args', 'tracers', 'span',
+                 'wall_start', 'cpu_start')
+
+    def __init__(self, name: str, args: _typing.Dict[str, _typing.Any],
+                 tracers: _typing.List['Tracer']) -> None:
+        self.name = name
+        self.args = args
+        self.tracers = tracers
+        self.span = Span()
+
+    def __enter__(self) -> Span:
+        with _open_peaks_lock:
+            _fold_peak_rss()
+            # Without a reset, the peak would be that of the process.
+            _open_peaks[id(self)] = (_peak_rss_bytes() if _reset_peak_rss()
+                                     else None)
+        self.cpu_start = _time.thread_time()
+        self.wall_start = _time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        wall_end = _time.perf_counter()
+        cpu_end = _time.thread_time()
+        with _open_peaks_lock:
+            _fold_peak_rss()
+            peak_rss = _open_peaks.pop(id(self))
+        event = {'name': self.name,
+                 'start': self.wall_start,
+                 'wallSeconds': wall_end - self.wall_start,
+                 'cpuSeconds': cpu_end - self.cpu_start,
+                 'items': self.span.items,
+                 'peakRssBytes': peak_rss,
+                 'pid': _os.getpid(),
+                 'threadId': _threading.get_ident(),
+                 'args': self.args}
+        if exc_type is not None:
+            event['error'] = exc_type.__name__
+        for tracer in self.tracers:
+            tracer.record(event)
+
+
+def stage(name: str, **args: _typing.Any) -> _typing.ContextManager[Span]:
+    """Report a stage to the active tracers.
+
+    Use as a context manager around the stage. It returns a `Span`,
+    whose `items` may be set to the number of items processed. Stages
+    may be nested.
+
+    :param name: The name of the stage.
+    :param args: JSON-serialisable details of the stage, e.g., its
+        parameters.
+
+    :return: A context manager.
+    """
+    tracers = _tracers
+    if not tracers:
+        return _NULL_STAGE
+    return _Stage(name, args, tracers)
+
+
+class Tracer:
+    """Record the stages reported while the tracer is active.
+
+    Activate the tracer by using it as a context manager. Tracers may
+    be active at the same time, in which case they all record every
+    stage. Subclasses may override `record` to handle the events as
+    they happen, e.g., to stream them to a log.
+
+    The events are dictionaries with the keys 'name', 'start' (in
+    seconds since the tracer was created), 'wallSeconds', 'cpuSeconds'
+    (the CPU time of the thread that ran the stage), 'items',
+    'peakRssBytes' (the peak resident set size of the process while the
+    stage ran, or None where the peak cannot be reset, e.g., outside
+    Linux), 'pid', 'threadId' and
+    'args', and 'error' with the name of the exception if the stage
+    raised one.
+    """
+
+    def __init__(self) -> None:
+        self.events: _typing.List[Event] = []
+        self._events_lock = _threading.Lock()
+        self._start = _time.perf_counter()
+
+    def __enter__(self) -> 'Tracer':
+        global _tracers
+        with _tracers_lock:
+            _tracers = _tracers + [self]
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _tracers
+        with _tracers_lock:
+            _tracers = [tracer for tracer in _tracers if tracer is not self]
+
+    def record(self, event: Event) -> None:
+        """Record the event of a stage that has ended.
+
+        :param event: The event. It must not be modified.
+        """
+        event = dict(event, start=event['start'] - self._start)
+        with self._events_lock:
+            self.events.append(event)
+
+    def summary(self) -> _typing.Dict[str, _typing.Dict[str, _typing.Any]]:
+        """Total the events of every stage.
+
+        Nested stages are counted in their own totals and in those of
+        the stages that contain them.
+
+        :return: A dictionary mapping the name of every stage to a
+            dictionary with the keys 'calls', 'wallSeconds',
+            'cpuSeconds', 'items' (the total of the events that set it)
+            and 'peakRssBytes' (the largest).
+        """
+        with self._events_lock:
+            events = list(self.events)
+        summary: _typing.Dict[str, _typing.Dict[str, _typing.Any]] = {}
+        for event in events:
+            totals = summary.setdefault(event['name'], {
+                'calls': 0, 'wallSeconds': 0., 'cpuSeconds': 0.,
+                'items': 0, 'peakRssBytes': None})
+            totals['calls'] += 1
+            totals['wallSeconds'] += event['wallSeconds']
+            totals['cpuSeconds'] += event['cpuSeconds']
+            if event['items'] is not None:
+                totals['items'] += event['items']
+            if event['peakRssBytes'] is not None:
+                totals['peakRssBytes'] = max(totals['peakRssBytes'] or 0,
+                                             event['peakRssBytes'])
+        return summary
+
+    def to_json(self) -> _typing.Dict[str, _typing.Any]:
+        """The events and their summary, as a JSON-serialisable dict."""
+        with self._events_lock:
+            events = list(self.events)
+        return {'events': events, 'summary': self.summary()}
+
+    def dump_json(self, f: _typing.TextIO) -> None:
+        """Write the events and their summary to a text stream as JSON.
+
+        :param f: The stream to write to.
+        """
+        _json.dump(self.to_json(), f)
+
+    def chrome_trace(self) -> _typing.Dict[str, _typing.Any]:
+        """The events in the Chrome trace event format.
+
+        The result can be loaded in chrome://tracing or Perfetto. Every
+        stage is a complete event; its CPU time, items and peak
+        resident set size are among its arguments.
+
+        :return: A JSON-serialisable dict.
+        """
+        with self._events_lock:
+            events = list(self.events)
+        trace_events = []
+        for event in events:
+            args = dict(event['args'],
+                        cpuSeconds=event['cpuSeconds'],
+                        items=event['items'],
+                        peakRssBytes=event['peakRssBytes'])
+            if 'error' in event:
+                args['error'] = event['error']
+            trace_events.append({'name': event['name'],
+                                 'cat': 'anonlink',
+                                 'ph': 'X',
+                                 'ts': event['start'] * 1e6,
+                                 'dur': event['wallSeconds'] * 1e6,
+                                 'pid': event['pid'],
+                                 'tid': event['threadId'],
+                                 'args': args})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def dump_chrome_trace(self, f: _typing.TextIO) -> None:
+        """Write the events to a text stream in the Chrome trace format.
+
+        :param f: The stream to write to.
+        """
+        _json.dump(self.chrome_trace(), f)
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3.4
 
+import io
+import json
 import unittest
 
 from anonlink import benchmark
@@ -12,3 +14,80 @@ class TestBenchmark(unittest.TestCase):
 
     def test_benchmark(self):
         benchmark.benchmark(1000)
+
+    def test_generate_candidate_graph(self):
+        sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = \
+            benchmark.generate_candidate_graph(200, 3, seed=0)
+        self.assertTrue(len(sims))
+        self.assertEqual(len({len(sims), len(dset_is0), len(dset_is1),
+                              len(rec_is0), len(rec_is1)}), 1)
+        self.assertTrue(all(0 <= d0 < d1 < 3
+                            for d0, d1 in zip(dset_is0, dset_is1)))
+        self.assertTrue(all(.5 <= s <= 1 for s in sims))
+        keys = [(-s, d0, d1, r0, r1) for s, d0, d1, r0, r1
+                in zip(sims, dset_is0, dset_is1, rec_is0, rec_is1)]
+        self.assertEqual(keys, sorted(set(keys)))
+
+    def test_solver_benchmark(self):
+        output = io.StringIO()
+        results = benchmark.solver_benchmark(
+            sizes=[100], parties_options=[2, 3], repeat=1, output=output)
+        self.assertEqual(json.loads(output.getvalue()), results)
+        solvers = {result['solver'] for result in results}
+        self.assertIn('greedy_solve_python', solvers)
+        self.assertIn('probabilistic_greedy_solve_python', solvers)
+        for result in results:
+            self.assertGreaterEqual(result['seconds'], 0)
+            self.assertGreater(result['candidates'], 0)
+
+    def test_scenarios_registered(self):
+        for name in ('dice_many_to_many', 'blocking',
+                     'merge_candidate_pairs', 'serialization_dump',
+                     'serialization_load', 'serialization_merge', 'solve',
+                     'stats'):
+            self.assertIn(name, benchmark.SCENARIOS)
+        for scenario in benchmark.SCENARIOS.values():
+            self.assertEqual(set(scenario.quick_params),
+                             set(scenario.params))
+            self.assertTrue(scenario.description)
+
+    def test_sweep(self):
+        self.assertEqual(benchmark.sweep({'a': [1, 2], 'b': ['x']}),
+                         [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'x'}])
+        self.assertEqual(benchmark.sweep({}), [{}])
+
+    def test_run_benchmarks(self):
+        output = io.StringIO()
+        report = benchmark.run_benchmarks(
+            ['serialization_dump', 'solve'], params={'entities': [50]},
+            repeat=2, warmup=1, quick=True, output=output)
+        self.assertEqual(json.loads(output.getvalue()), report)
+        results = report['results']
+        self.assertEqual({result['scenario'] for result in results},
+                         {'serialization_dump', 'solve'})
+        solvers = {result['params']['solver'] for result in results
+                   if result['scenario'] == 'solve'}
+        self.assertIn('greedy_solve_python', solvers)
+        for result in results:
+            self.assertEqual(result['params']['entities'], 50)
+            self.assertEqual(len(result['seconds']), 2)
+            self.assertEqual(result['best'], min(result['seconds']))
+            self.assertGreater(result['items'], 0)
+
+        with self.assertRaises(ValueError):
+            benchmark.run_benchmarks(['nonexistent'])
+
+    def test_compare_results(self):
+        def report(*bests):
+            return {'results': [
+                {'scenario': 'solve', 'params': {'entities': i},
+                 'best': best}
+                for i, best in enumerate(bests)]}
+        comparisons = benchmark.compare_results(
+            report(1., 1., 1.), report(1.05, 1.2, .5), tolerance=.1)
+        self.assertEqual([c['regression'] for c in comparisons],
+                         [False, True, False])
+        self.assertAlmostEqual(comparisons[1]['ratio'], 1.2)
+        self.assertEqual(
+            benchmark.compare_results(report(1.), report(1., 1.)),
+            benchmark.compare_results(report(1.), report(1.)))
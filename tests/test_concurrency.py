@@ -1,11 +1,22 @@
 import array
+import asyncio
+import io
+import json
+import os
+from concurrent import futures
 import itertools
 import random
+import threading
+import time
+from collections import Counter
 
+import bitarray
 import pytest
 
 import anonlink.blocking
 from anonlink import concurrency
+from anonlink.concurrency import _chunking, _parallel, _spilling
+from anonlink.candidate_generation import _enforce_k, find_candidate_pairs
 
 DATASET_SIZES = (0, 1, 100)
 DATASET_NUMS = (0, 1, 2, 3)
@@ -122,7 +133,7 @@ def test_process_chunk(dataset_size0, dataset_size1, k_, threshold_):
                          ((i, j)
                           for i in (0, 1, 2, 3, 5)
                           for j in (0, 1, 2, 3, 5)
-                          if i != 2 or j != 2))
+                          if i != j or i < 2))
 def test_process_chunk_nonmatching(
     threshold,
     k,
@@ -144,6 +155,50 @@ def test_process_chunk_nonmatching(
             chunk, datasets, similarity_f, threshold, k=k)
 
 
+@pytest.mark.parametrize('k_', (None, 1, 5))
+@pytest.mark.parametrize('threshold_', (0.5, 0.9))
+def test_process_chunk_multiparty(k_, threshold_):
+    rng = random.Random(SEED)
+    full_datasets = [[rng.random() for _ in range(size)]
+                     for size in (40, 30, 50, 20)]
+    chunk = [{'datasetIndex': 3, 'range': [5, 15]},
+             {'datasetIndex': 0, 'range': [10, 30]},
+             {'datasetIndex': 2, 'range': [0, 25]}]
+    datasets_ = [full_datasets[c['datasetIndex']][slice(*c['range'])]
+                 for c in chunk]
+
+    def similarity_f(datasets, threshold, k=None):
+        candidates = sorted(
+            ((1 - abs(record0 - record1), i, j)
+             for i, record0 in enumerate(datasets[0])
+             for j, record1 in enumerate(datasets[1])),
+            key=lambda c: -c[0])
+        candidates = [c for c in candidates if c[0] >= threshold]
+        return (array.array('d', (c[0] for c in candidates)),
+                (array.array('I', (c[1] for c in candidates)),
+                 array.array('I', (c[2] for c in candidates))))
+
+    sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = \
+        concurrency.process_chunk(
+            chunk, datasets_, similarity_f, threshold_, k=k_)
+
+    assert len(sims) > 0
+    assert list(sims) == sorted(sims, reverse=True)
+    dataset_pairs = set()
+    for sim, dset_i0, dset_i1, rec_i0, rec_i1 in zip(
+            sims, dset_is0, dset_is1, rec_is0, rec_is1):
+        dataset_pairs.add((dset_i0, dset_i1))
+        record0 = full_datasets[dset_i0][rec_i0]
+        record1 = full_datasets[dset_i1][rec_i1]
+        assert sim == 1 - abs(record0 - record1)
+        for dset_i, rec_i in ((dset_i0, rec_i0), (dset_i1, rec_i1)):
+            dataset_chunk, = (c for c in chunk
+                              if c['datasetIndex'] == dset_i)
+            a, b = dataset_chunk['range']
+            assert a <= rec_i < b
+    assert dataset_pairs == {(3, 0), (3, 2), (0, 2)}
+
+
 @pytest.mark.parametrize('threshold', (0.5, 0.9))
 @pytest.mark.parametrize('k', (None, 5))
 @pytest.mark.parametrize('difference0,difference1',
@@ -263,3 +318,800 @@ def test_process_chunk_with_blocking(dataset_size0, dataset_size1, k_, threshold
 
     assert len(sims_with_blocking) <= len(sims_without_blocking)
 
+
+
+@pytest.mark.parametrize('k', [None, 0, 1, 3])
+def test_merge_candidate_pairs(k):
+    rng = random.Random(SEED)
+    pairs = {(rng.randrange(2), rng.randrange(20), rng.randrange(20))
+             for _ in range(200)}
+    candidates = [(rng.choice([.5, .6, .7]), dset_i0, dset_i0 + 1,
+                   rec_i0, rec_i1)
+                  for dset_i0, rec_i0, rec_i1 in pairs]
+    candidates.sort(key=lambda x: (-x[0], *x[1:]))
+
+    results = []
+    for part in range(3):
+        part_candidates = candidates[part::3]
+        sims, dset_is0, dset_is1, rec_is0, rec_is1 = (
+            zip(*part_candidates) if part_candidates else ((),) * 5)
+        results.append((array.array('d', sims),
+                        (array.array('I', dset_is0),
+                         array.array('I', dset_is1)),
+                        (array.array('I', rec_is0),
+                         array.array('I', rec_is1))))
+
+    sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = \
+        concurrency.merge_candidate_pairs(results, k)
+    expected = candidates if k is None else list(_enforce_k(candidates, k))
+    assert list(zip(sims, dset_is0, dset_is1, rec_is0, rec_is1)) == expected
+
+
+@pytest.mark.parametrize('datasets_n', [0, 1, 2, 3])
+@pytest.mark.parametrize('k', [None, 2])
+@pytest.mark.parametrize('to_file', [False, True])
+@pytest.mark.parametrize('shared_memory', [None, False, True])
+def test_run_parallel(datasets_n, k, to_file, shared_memory):
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(64)])
+                 for _ in range(rng.randrange(20, 40))]
+                for _ in range(datasets_n)]
+    expected = find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6, k=k)
+
+    if to_file:
+        f = io.BytesIO()
+        bytes_written = concurrency.run_parallel(
+            datasets, anonlink.similarities.dice_coefficient, .6, k,
+            workers=2, chunk_size_aim=100, output=f,
+            shared_memory=shared_memory)
+        assert bytes_written == f.tell()
+        f.seek(0)
+        result = anonlink.serialization.load_candidate_pairs(f)
+    else:
+        result = concurrency.run_parallel(
+            datasets, anonlink.similarities.dice_coefficient, .6, k,
+            workers=2, chunk_size_aim=100, shared_memory=shared_memory)
+    assert result == expected
+
+
+def test_run_parallel_invalid_workers():
+    with pytest.raises(ValueError):
+        concurrency.run_parallel(
+            [[], []], anonlink.similarities.dice_coefficient, .6, workers=0)
+
+
+def _read_shared_datasets(info):
+    with concurrency.SharedDatasets.attach(info) as shared:
+        # Copy the records, since they must not outlive the attachment.
+        return ([[bitarray.bitarray(f) for f in shared.dataset(i)]
+                 for i in range(len(shared))],
+                [shared.popcounts(i).tolist() for i in range(len(shared))])
+
+
+def test_shared_datasets():
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(24)],
+                                   endian=endian)
+                 for _ in range(size)]
+                for size, endian in [(10, 'big'), (0, 'big'), (7, 'little')]]
+    with concurrency.SharedDatasets(datasets) as shared:
+        assert len(shared) == 3
+        assert list(shared.dataset(0)) == datasets[0]
+        assert list(shared.dataset(2, 2, 5)) == datasets[2][2:5]
+        assert list(shared.dataset(2)[2:5]) == datasets[2][2:5]
+        assert shared.dataset(2, 2, 5).popcounts.tolist() == [
+            f.count() for f in datasets[2][2:5]]
+        assert shared.filters(0).shape == (10, 3)
+        assert shared.filters(0).tobytes() == b''.join(
+            f.tobytes() for f in datasets[0])
+        assert shared.popcounts(2).tolist() == [f.count() for f in datasets[2]]
+        with pytest.raises(RuntimeError):
+            concurrency.SharedDatasets.attach(shared.info).unlink()
+
+        # Attach from another process.
+        with futures.ProcessPoolExecutor(1) as executor:
+            shared_datasets, popcounts = executor.submit(
+                _read_shared_datasets, shared.info).result()
+        assert shared_datasets == datasets
+        assert popcounts == [[f.count() for f in dataset]
+                             for dataset in datasets]
+
+
+def _record_types_similarity(datasets, threshold, k=None):
+    # A similarity function that only accepts bytes.
+    if not all(type(record) is bytes
+               for dataset in datasets for record in dataset):
+        raise TypeError('expected bytes')
+    return (array.array('d'), (array.array('I'), array.array('I')))
+
+
+def test_run_parallel_shared_memory_default():
+    # Records are only replaced by bitarrays in shared memory for the
+    # Dice coefficient kernel, unless asked for.
+    datasets = [[b'\x01\x03', b'\xff\x00'], [b'\x80\x80']]
+    result = concurrency.run_parallel(
+        datasets, _record_types_similarity, .6, workers=1)
+    assert result == (array.array('d'),
+                      (array.array('I'), array.array('I')),
+                      (array.array('I'), array.array('I')))
+    with pytest.raises(TypeError):
+        concurrency.run_parallel(datasets, _record_types_similarity, .6,
+                                 workers=1, shared_memory=True)
+
+
+@pytest.mark.skipif(_chunking.dice_coefficient_accelerated is None,
+                    reason='native Dice coefficient kernel not available')
+@pytest.mark.parametrize('k', [None, 2])
+def test_process_chunk_shared_datasets(k):
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(64)])
+                 for _ in range(size)]
+                for size in (30, 20)]
+    chunk = [{'datasetIndex': 0, 'range': [5, 25]},
+             {'datasetIndex': 1, 'range': [0, 20]}]
+    expected = concurrency.process_chunk(
+        chunk, [datasets[0][5:25], datasets[1]],
+        _chunking.dice_coefficient_accelerated, .5, k=k)
+    with concurrency.SharedDatasets(datasets) as shared:
+        shared_chunk = [shared.dataset(0, 5, 25), shared.dataset(1)]
+        result = concurrency.process_chunk(
+            chunk, shared_chunk, _chunking.dice_coefficient_accelerated, .5,
+            k=k)
+        assert result == expected
+
+        # The kernel reads the popcounts in shared memory: with popcounts
+        # too large for the threshold, every pair is pruned.
+        shared_chunk[1].popcounts[:] = 1 << 20
+        sims, _, _ = concurrency.process_chunk(
+            chunk, shared_chunk, _chunking.dice_coefficient_accelerated, .5,
+            k=k)
+        assert not sims
+        del shared_chunk
+
+
+def test_shared_datasets_bytes():
+    datasets = [[b'\x01\x03', b'\xff\x00'], [bytearray(b'\x80\x80')]]
+    with concurrency.SharedDatasets(datasets) as shared:
+        assert [f.tobytes() for f in shared.dataset(0)] == datasets[0]
+        assert shared.popcounts(0).tolist() == [3, 8]
+        assert shared.popcounts(1).tolist() == [2]
+
+
+@pytest.mark.parametrize('datasets', [
+    [[b'\x00', b'\x00\x00']],
+    [[bitarray.bitarray('101')]],
+])
+def test_shared_datasets_invalid_length(datasets):
+    with pytest.raises(ValueError):
+        concurrency.SharedDatasets(datasets)
+
+
+def test_shared_datasets_invalid_type():
+    with pytest.raises(TypeError):
+        concurrency.SharedDatasets([[1, 2]])
+
+
+def _chunk_pairs(chunks):
+    return Counter(
+        ((chunk[0]['datasetIndex'], i), (chunk[1]['datasetIndex'], j))
+        for chunk in chunks
+        for i in range(*chunk[0]['range'])
+        for j in range(*chunk[1]['range']))
+
+
+@pytest.mark.parametrize('datasets', DATASETS)
+@pytest.mark.parametrize('chunk_cost_aim', CHUNK_SIZE_AIMS)
+def test_split_to_chunks_by_cost_uniform(datasets, chunk_cost_aim):
+    # Without popcounts or blocks, every pair is covered exactly once.
+    chunks = list(concurrency.split_to_chunks_by_cost(
+        chunk_cost_aim, dataset_sizes=datasets))
+    json.dumps(chunks)
+    pairs = _chunk_pairs(chunks)
+    assert set(pairs.values()) <= {1}
+    assert len(pairs) == sum(size0 * size1 for size0, size1
+                             in itertools.combinations(datasets, 2))
+
+
+@pytest.mark.parametrize('threshold', [.5, .8])
+@pytest.mark.parametrize('use_blocks', [False, True])
+def test_split_to_chunks_by_cost(threshold, use_blocks):
+    rng = random.Random(SEED)
+    # Popcounts vary a lot, so many pairs can be rejected early.
+    datasets = [[bitarray.bitarray([rng.random() < density
+                                    for _ in range(64)])
+                 for density in (rng.random() for _ in range(size))]
+                for size in (150, 120, 90)]
+    popcounts = [[f.count() for f in dataset] for dataset in datasets]
+    blocks = [[(f[0], f[1]) for f in dataset] for dataset in datasets]
+    dataset_sizes = list(map(len, datasets))
+
+    chunks = list(concurrency.split_to_chunks_by_cost(
+        500, dataset_sizes=dataset_sizes, popcounts=popcounts,
+        threshold=threshold, blocks=blocks if use_blocks else None))
+    json.dumps(chunks)
+    assert set(_chunk_pairs(chunks).values()) <= {1}
+
+    def blocking_f(dataset_index, record_index, hash_):
+        return (hash_[0], hash_[1]),
+
+    # Processing the chunks finds every candidate pair.
+    blocking = blocking_f if use_blocks else None
+    results = [
+        concurrency.process_chunk(
+            chunk,
+            [datasets[c['datasetIndex']][slice(*c['range'])] for c in chunk],
+            anonlink.similarities.dice_coefficient, threshold,
+            blocking_f=blocking)
+        for chunk in chunks]
+    assert concurrency.merge_candidate_pairs(results) == find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, threshold,
+        blocking_f=blocking)
+
+
+def test_split_to_chunks_by_cost_balances_work():
+    # The first half of the records of dataset 0 can match nothing.
+    popcounts = [[0] * 500 + [32] * 500, [32] * 1000]
+    chunks = list(concurrency.split_to_chunks_by_cost(
+        50000, dataset_sizes=[1000, 1000], popcounts=popcounts,
+        threshold=.8, check_cost=.01))
+    rows = [chunk[0]['range'] for chunk in chunks]
+    # The expensive rows are split more finely than the cheap ones.
+    cheap = [b - a for a, b in rows if b <= 500]
+    expensive = [b - a for a, b in rows if a >= 500]
+    assert expensive and max(expensive) < min(cheap, default=1000)
+
+
+def test_split_to_chunks_by_cost_invalid():
+    with pytest.raises(ValueError):
+        list(concurrency.split_to_chunks_by_cost(0, dataset_sizes=[1, 1]))
+    with pytest.raises(ValueError):
+        list(concurrency.split_to_chunks_by_cost(
+            1, dataset_sizes=[1, 1], popcounts=[[1], []]))
+    with pytest.raises(ValueError):
+        list(concurrency.split_to_chunks_by_cost(
+            1, dataset_sizes=[1, 1], blocks=[[()]]))
+
+
+@pytest.mark.parametrize('datasets', DATASETS)
+@pytest.mark.parametrize('chunk_size_aim', CHUNK_SIZE_AIMS)
+@pytest.mark.parametrize('filter_bytes', [1, 16])
+def test_split_to_chunks_cache_budget(datasets, chunk_size_aim, filter_bytes):
+    cache_budget = 200
+    max_records1 = max(1, cache_budget // (filter_bytes + 4))
+    chunks = list(concurrency.split_to_chunks(
+        chunk_size_aim, dataset_sizes=datasets,
+        filter_bytes=filter_bytes, cache_budget=cache_budget))
+    json.dumps(chunks)
+    for _, (a, b) in ((c[1]['datasetIndex'], c[1]['range']) for c in chunks):
+        assert 0 < b - a <= max_records1
+    pairs = _chunk_pairs(chunks)
+    assert set(pairs.values()) <= {1}
+    assert len(pairs) == sum(size0 * size1 for size0, size1
+                             in itertools.combinations(datasets, 2))
+
+
+def test_detect_cache_sizes(tmp_path, monkeypatch):
+    for index, (level, type_, size) in enumerate([
+            (1, 'Data', '48K'), (1, 'Instruction', '32K'),
+            (2, 'Unified', '2048K'), (3, 'Unified', '30M')]):
+        path = tmp_path / f'index{index}'
+        path.mkdir()
+        (path / 'level').write_text(f'{level}\n')
+        (path / 'type').write_text(f'{type_}\n')
+        (path / 'size').write_text(f'{size}\n')
+    monkeypatch.setattr(_chunking, '_SYSFS_CACHE_PATH', str(tmp_path))
+    assert concurrency.detect_cache_sizes() == {
+        1: 48 << 10, 2: 2 << 20, 3: 30 << 20}
+    assert concurrency.default_cache_budget() == 1 << 20
+
+    monkeypatch.setattr(_chunking, '_SYSFS_CACHE_PATH',
+                        str(tmp_path / 'missing'))
+    assert concurrency.detect_cache_sizes() == {}
+    assert concurrency.default_cache_budget() > 0
+
+
+@pytest.mark.skipif(_chunking.dice_coefficient_accelerated is None,
+                    reason='accelerated Dice coefficient is unavailable')
+@pytest.mark.parametrize('k', [None, 0, 1, 3])
+@pytest.mark.parametrize('threshold', [.5, .6])
+@pytest.mark.parametrize('filter_bits', [64, 72, 512])
+def test_process_chunk_accelerated(k, threshold, filter_bits):
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5
+                                    for _ in range(filter_bits)])
+                 for _ in range(size)]
+                for size in (60, 45)]
+    chunk = [{'datasetIndex': 2, 'range': [10, 70]},
+             {'datasetIndex': 5, 'range': [3, 48]}]
+    similarity_f = _chunking.dice_coefficient_accelerated
+
+    def wrapped_similarity_f(*args, **kwargs):
+        # Not recognised by process_chunk, so it takes the generic path.
+        return similarity_f(*args, **kwargs)
+
+    result = concurrency.process_chunk(chunk, datasets, similarity_f,
+                                       threshold, k=k)
+    expected = concurrency.process_chunk(chunk, datasets,
+                                         wrapped_similarity_f, threshold, k=k)
+    assert result == expected
+
+
+@pytest.mark.parametrize('k', [None, 0, 2])
+@pytest.mark.parametrize('memory_budget', [1, 500, 1 << 20])
+@pytest.mark.parametrize('datasets_n', [2, 3])
+@pytest.mark.parametrize('blocked', [False, True])
+def test_process_chunk_to_file(tmp_path, k, memory_budget, datasets_n,
+                               blocked):
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(64)])
+                 for _ in range(size)]
+                for size in (30, 25, 20)[:datasets_n]]
+    chunk = [{'datasetIndex': i, 'range': [i, i + len(dataset)]}
+             for i, dataset in enumerate(datasets)]
+    blocking_f = ((lambda dataset_i, record_i, record: (record_i % 3,))
+                  if blocked else None)
+    expected = concurrency.process_chunk(
+        chunk, datasets, anonlink.similarities.dice_coefficient, .55, k=k,
+        blocking_f=blocking_f)
+
+    path = concurrency.process_chunk_to_file(
+        chunk, datasets, anonlink.similarities.dice_coefficient, .55, k=k,
+        blocking_f=blocking_f, memory_budget=memory_budget,
+        directory=str(tmp_path))
+    with open(path, 'rb') as f:
+        result = anonlink.serialization.load_candidate_pairs(f)
+    assert result == expected
+    # Only the result is left behind.
+    assert list(tmp_path.iterdir()) == [tmp_path / path.rsplit('/', 1)[-1]]
+
+
+def test_process_chunk_to_file_invalid_budget():
+    with pytest.raises(ValueError):
+        concurrency.process_chunk_to_file(
+            [{'datasetIndex': 0, 'range': [0, 0]},
+             {'datasetIndex': 1, 'range': [0, 0]}],
+            [[], []], anonlink.similarities.dice_coefficient, .6,
+            memory_budget=0)
+
+
+def test_run_parallel_memory_budget():
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(64)])
+                 for _ in range(30)]
+                for _ in range(2)]
+    expected = find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6, k=2)
+    f = io.BytesIO()
+    concurrency.run_parallel(
+        datasets, anonlink.similarities.dice_coefficient, .6, 2,
+        workers=2, chunk_size_aim=300, output=f, memory_budget=500)
+    f.seek(0)
+    assert anonlink.serialization.load_candidate_pairs(f) == expected
+
+
+def _covered_pairs(chunks):
+    return Counter(
+        (chunk[0]['datasetIndex'], chunk[1]['datasetIndex'], i0, i1)
+        for chunk in chunks
+        for i0 in range(*chunk[0]['range'])
+        for i1 in range(*chunk[1]['range']))
+
+
+@pytest.mark.parametrize('workers', [1, 2, 5])
+@pytest.mark.parametrize('piece_size_aim', [1, 40, 1000])
+def test_work_stealing_scheduler(workers, piece_size_aim):
+    chunks = list(concurrency.split_to_chunks(
+        300, dataset_sizes=[30, 25, 0, 12]))
+    scheduler = concurrency.WorkStealingScheduler(
+        chunks, workers, piece_size_aim=piece_size_aim)
+
+    # Worker 0 is slow: it gets one piece for every three of the others.
+    rng = random.Random(SEED)
+    pieces = []
+    active = list(range(workers))
+    while active:
+        weights = [1 if worker == 0 else 3 for worker in active]
+        worker, = rng.choices(active, weights)
+        piece = scheduler.next_chunk(worker)
+        if piece is None:
+            active.remove(worker)
+        else:
+            pieces.append(piece)
+
+    # The pieces cover every comparison exactly once.
+    assert _covered_pairs(pieces) == _covered_pairs(chunks)
+    assert max(_covered_pairs(pieces).values()) == 1
+    for piece in pieces:
+        a0, b0 = piece[0]['range']
+        a1, b1 = piece[1]['range']
+        assert b0 - a0 == 1 or (b0 - a0) * (b1 - a1) <= piece_size_aim
+    if workers > 1 and piece_size_aim < 1000:
+        assert scheduler.steals > 0
+
+
+def test_work_stealing_scheduler_steals_half():
+    chunk = [{'datasetIndex': 0, 'range': [0, 100]},
+             {'datasetIndex': 1, 'range': [0, 10]}]
+    scheduler = concurrency.WorkStealingScheduler(
+        [chunk], 2, piece_size_aim=100)
+    assert scheduler.next_chunk(0)[0]['range'] == [0, 10]
+    # Worker 1 has nothing, so it takes the second half of the rest.
+    assert scheduler.next_chunk(1)[0]['range'] == [55, 65]
+    assert scheduler.next_chunk(0)[0]['range'] == [10, 20]
+    assert scheduler.steals == 1
+
+
+def test_work_stealing_scheduler_invalid():
+    with pytest.raises(ValueError):
+        concurrency.WorkStealingScheduler([], 0, piece_size_aim=1)
+    with pytest.raises(ValueError):
+        concurrency.WorkStealingScheduler([], 1, piece_size_aim=0)
+    with pytest.raises(ValueError):
+        concurrency.WorkStealingScheduler(
+            [[{'datasetIndex': 0, 'range': [0, 1]}]], 1, piece_size_aim=1)
+
+
+@pytest.mark.parametrize('k', [None, 2])
+@pytest.mark.parametrize('to_file', [False, True])
+def test_run_parallel_work_stealing(k, to_file):
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(64)])
+                 for _ in range(rng.randrange(20, 40))]
+                for _ in range(3)]
+    expected = find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6, k=k)
+    if to_file:
+        f = io.BytesIO()
+        concurrency.run_parallel(
+            datasets, anonlink.similarities.dice_coefficient, .6, k,
+            workers=3, output=f, work_stealing=True)
+        f.seek(0)
+        result = anonlink.serialization.load_candidate_pairs(f)
+    else:
+        result = concurrency.run_parallel(
+            datasets, anonlink.similarities.dice_coefficient, .6, k,
+            workers=3, work_stealing=True)
+    assert result == expected
+
+
+class _RecordingExecutor(futures.ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(1)
+        self.chunks = []
+
+    def submit(self, fn, chunk, *args):
+        self.chunks.append(chunk)
+        return super().submit(fn, chunk, *args)
+
+
+def test_map_work_stealing_executors(monkeypatch):
+    # Every worker's pieces run on the executor of the same index.
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(64)])
+                 for _ in range(size)]
+                for size in (30, 10)]
+    monkeypatch.setattr(_parallel, '_worker_datasets', datasets)
+    chunks = [[{'datasetIndex': 0, 'range': [0, 20]},
+               {'datasetIndex': 1, 'range': [0, 10]}],
+              [{'datasetIndex': 0, 'range': [20, 30]},
+               {'datasetIndex': 1, 'range': [0, 10]}]]
+    scheduler = concurrency.WorkStealingScheduler(chunks, 2,
+                                                  piece_size_aim=20)
+    given = {0: [], 1: []}
+    next_chunk = scheduler.next_chunk
+
+    def recording_next_chunk(worker):
+        chunk = next_chunk(worker)
+        if chunk is not None:
+            given[worker].append(chunk)
+        return chunk
+    monkeypatch.setattr(scheduler, 'next_chunk', recording_next_chunk)
+
+    executors = [_RecordingExecutor(), _RecordingExecutor()]
+    with executors[0], executors[1]:
+        results = _parallel._map_work_stealing(
+            executors, scheduler, anonlink.similarities.dice_coefficient,
+            .6, None, None, None)
+    assert [executor.chunks for executor in executors] == [given[0],
+                                                           given[1]]
+    assert (concurrency.merge_candidate_pairs(results)
+            == find_candidate_pairs(
+                datasets, anonlink.similarities.dice_coefficient, .6))
+
+
+@pytest.mark.parametrize('k', [None, 2])
+@pytest.mark.parametrize('use_executor', [False, True])
+def test_run_resumable(tmp_path, k, use_executor):
+    rng = random.Random(SEED)
+    datasets = [[bitarray.bitarray([rng.random() < .5 for _ in range(64)])
+                 for _ in range(rng.randrange(20, 40))]
+                for _ in range(3)]
+    similarity_f = anonlink.similarities.dice_coefficient
+    expected = find_candidate_pairs(datasets, similarity_f, .6, k=k)
+    directory = str(tmp_path / 'run')
+
+    def run(similarity_f):
+        f = io.BytesIO()
+        with futures.ThreadPoolExecutor(2) as executor:
+            concurrency.run_resumable(
+                datasets, similarity_f, .6, k, directory=directory,
+                output=f, chunk_size_aim=200,
+                executor=executor if use_executor else None)
+        f.seek(0)
+        return anonlink.serialization.load_candidate_pairs(f)
+
+    # The first run dies after three chunks.
+    calls = 0
+
+    def failing_similarity_f(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        if calls > 3:
+            raise RuntimeError('worker died')
+        return similarity_f(*args, **kwargs)
+
+    with pytest.raises(RuntimeError):
+        run(failing_similarity_f)
+    manifest = concurrency.ChunkManifest.open(directory)
+    chunks_n = len(manifest.chunks)
+    assert len(manifest.pending()) < chunks_n
+    assert not manifest.is_complete
+
+    # The second run only processes the remaining chunks.
+    calls = 0
+
+    def counting_similarity_f(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return similarity_f(*args, **kwargs)
+
+    assert run(counting_similarity_f) == expected
+    assert calls == len(manifest.pending())
+    assert concurrency.ChunkManifest.open(directory).is_complete
+    assert run(similarity_f) == expected
+
+
+def test_run_resumable_different_parameters(tmp_path):
+    datasets = [[bitarray.bitarray('10' * 32)] * 3] * 2
+    concurrency.run_resumable(
+        datasets, anonlink.similarities.dice_coefficient, .6,
+        directory=str(tmp_path), output=io.BytesIO())
+    with pytest.raises(ValueError):
+        concurrency.run_resumable(
+            datasets, anonlink.similarities.dice_coefficient, .7,
+            directory=str(tmp_path), output=io.BytesIO())
+
+
+def test_chunk_manifest(tmp_path):
+    chunks = list(concurrency.split_to_chunks(10, dataset_sizes=[5, 4]))
+    manifest = concurrency.ChunkManifest.create(
+        str(tmp_path), chunks, threshold=.5, k=None, dataset_sizes=[5, 4])
+    with pytest.raises(FileExistsError):
+        concurrency.ChunkManifest.create(str(tmp_path), chunks,
+                                         threshold=.5)
+    with pytest.raises(ValueError):
+        manifest.merge(io.BytesIO())
+    with pytest.raises(IndexError):
+        manifest.record(len(chunks), concurrency.merge_candidate_pairs(()))
+
+    for i, chunk in enumerate(chunks):
+        sims = array.array('d', [1 - i / 100])
+        manifest.record(i, (sims,
+                            (array.array('I', [0]), array.array('I', [1])),
+                            (array.array('I', [chunk[0]['range'][0]]),
+                             array.array('I', [chunk[1]['range'][0]]))))
+        if i == 0:
+            # Completing a chunk appends to the log, and leaves the
+            # manifest as it is.
+            manifest_bytes = (tmp_path / 'manifest.json').read_bytes()
+    assert (tmp_path / 'manifest.json').read_bytes() == manifest_bytes
+    assert len((tmp_path / 'completed.log').read_bytes().splitlines()) \
+        == len(chunks)
+    reopened = concurrency.ChunkManifest.open(str(tmp_path))
+    assert reopened.chunks == chunks
+    assert reopened.is_complete
+    f = io.BytesIO()
+    reopened.merge(f)
+    f.seek(0)
+    sims, _, _ = anonlink.serialization.load_candidate_pairs(f)
+    assert list(sims) == [1 - i / 100 for i in range(len(chunks))]
+
+
+def test_chunk_manifest_partial_log(tmp_path):
+    # A crash while appending to the log leaves a partial line, which is
+    # ignored and then overwritten.
+    chunks = list(concurrency.split_to_chunks(10, dataset_sizes=[5, 4]))
+    manifest = concurrency.ChunkManifest.create(str(tmp_path), chunks,
+                                                threshold=.5)
+    empty = concurrency.merge_candidate_pairs(())
+    manifest.record(0, empty)
+    with open(tmp_path / 'completed.log', 'ab') as f:
+        f.write(b'{"chunk": 1, "fi')
+    reopened = concurrency.ChunkManifest.open(str(tmp_path))
+    assert [i for i, _ in reopened.pending()] == list(range(1, len(chunks)))
+    reopened.record(1, empty)
+    reopened = concurrency.ChunkManifest.open(str(tmp_path))
+    assert [i for i, _ in reopened.pending()] == list(range(2, len(chunks)))
+
+
+@pytest.mark.parametrize('k', [None, 1])
+@pytest.mark.parametrize('files_n', [1, 2, 3, 7, 10])
+def test_merge_files(tmp_path, k, files_n):
+    rng = random.Random(SEED)
+    results = []
+    for _ in range(files_n):
+        n = rng.randrange(5)
+        results.append(concurrency.merge_candidate_pairs([(
+            array.array('d', [rng.random() for _ in range(n)]),
+            (array.array('I', [0] * n), array.array('I', [1] * n)),
+            (array.array('I', [rng.randrange(3) for _ in range(n)]),
+             array.array('I', [rng.randrange(3) for _ in range(n)])))]))
+    paths = []
+    for i, result in enumerate(results):
+        path = str(tmp_path / f'{i}.bin')
+        with open(path, 'wb') as f:
+            anonlink.serialization.dump_candidate_pairs(result, f)
+        paths.append(path)
+
+    f = io.BytesIO()
+    _spilling._merge_files(paths, f, k, directory=str(tmp_path),
+                           max_open_files=2)
+    f.seek(0)
+    assert (anonlink.serialization.load_candidate_pairs(f)
+            == concurrency.merge_candidate_pairs(results, k))
+    # Only the input files are left.
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        f'{i}.bin' for i in range(files_n))
+
+
+def _random_datasets(sizes, bits=64):
+    rng = random.Random(SEED)
+    return [[bitarray.bitarray([rng.random() < .5 for _ in range(bits)])
+             for _ in range(size)]
+            for size in sizes]
+
+
+def test_process_chunk_async():
+    datasets = _random_datasets([30, 25])
+    chunk = [{'datasetIndex': 0, 'range': [5, 20]},
+             {'datasetIndex': 1, 'range': [0, 25]}]
+    chunk_datasets = [datasets[0][5:20], datasets[1]]
+    expected = concurrency.process_chunk(
+        chunk, chunk_datasets, anonlink.similarities.dice_coefficient, .6,
+        k=2)
+    result = asyncio.run(concurrency.process_chunk_async(
+        chunk, chunk_datasets, anonlink.similarities.dice_coefficient, .6,
+        k=2))
+    assert result == expected
+
+
+@pytest.mark.parametrize('k', [None, 2])
+def test_find_candidate_pairs_async(k):
+    datasets = _random_datasets([30, 25, 20])
+    expected = find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6, k=k)
+    with futures.ThreadPoolExecutor(2) as executor:
+        result = asyncio.run(concurrency.find_candidate_pairs_async(
+            datasets, anonlink.similarities.dice_coefficient, .6, k=k,
+            executor=executor))
+    assert result == expected
+
+
+@pytest.mark.parametrize('max_in_flight', [1, 2, 100])
+def test_process_chunks_async(max_in_flight):
+    datasets = _random_datasets([30, 25, 20])
+    chunks = list(concurrency.split_to_chunks(
+        100, dataset_sizes=[30, 25, 20]))
+    expected = find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6)
+
+    lock = threading.Lock()
+    running = max_running = 0
+
+    def similarity_f(*args, **kwargs):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(.001)
+        result = anonlink.similarities.dice_coefficient(*args, **kwargs)
+        with lock:
+            running -= 1
+        return result
+
+    async def consume(executor):
+        results = []
+        async for chunk, result in concurrency.process_chunks_async(
+                iter(chunks), datasets, similarity_f, .6,
+                executor=executor, max_in_flight=max_in_flight):
+            assert chunk in chunks
+            results.append(result)
+        return results
+
+    with futures.ThreadPoolExecutor(8) as executor:
+        results = asyncio.run(consume(executor))
+    assert len(results) == len(chunks)
+    assert concurrency.merge_candidate_pairs(results) == expected
+    assert max_running <= max_in_flight
+
+
+def test_process_chunks_async_cancel():
+    datasets = _random_datasets([30, 25])
+    chunks = list(concurrency.split_to_chunks(10, dataset_sizes=[30, 25]))
+    calls = 0
+
+    def similarity_f(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return anonlink.similarities.dice_coefficient(*args, **kwargs)
+
+    async def consume_one():
+        results = concurrency.process_chunks_async(
+            chunks, datasets, similarity_f, .6, max_in_flight=2)
+        async for _ in results:
+            break
+        await results.aclose()
+
+    asyncio.run(consume_one())
+    # The first two chunks, and the one submitted when the first result
+    # was taken.
+    assert calls <= 3 < len(chunks)
+
+
+def test_process_chunks_async_invalid_max_in_flight():
+    async def consume():
+        async for _ in concurrency.process_chunks_async(
+                [], [], anonlink.similarities.dice_coefficient, .6,
+                max_in_flight=0):
+            pass
+
+    with pytest.raises(ValueError):
+        asyncio.run(consume())
+
+
+def _chunk_cost(chunk):
+    (a0, b0), (a1, b1) = (dataset_chunk['range'] for dataset_chunk in chunk)
+    return (b0 - a0) * (b1 - a1)
+
+
+@pytest.mark.parametrize('workers', [1, 3, 8])
+@pytest.mark.parametrize('chunk_size_aim', [10, 1000])
+def test_plan_chunks(workers, chunk_size_aim):
+    rng = random.Random(SEED)
+    dataset_sizes = [rng.randrange(150) for _ in range(6)] + [0]
+    schedule = concurrency.plan_chunks(
+        chunk_size_aim, dataset_sizes=dataset_sizes, workers=workers)
+    assert len(schedule) == workers
+
+    # Every pair of records is covered exactly once.
+    chunks = [chunk for worker_chunks in schedule for chunk in worker_chunks]
+    expected = Counter(
+        (i0, i1, r0, r1)
+        for (i0, size0), (i1, size1)
+        in itertools.combinations(enumerate(dataset_sizes), 2)
+        for r0 in range(size0) for r1 in range(size1))
+    assert _covered_pairs(chunks) == expected
+    json.dumps(schedule)
+
+    # The work is balanced.
+    loads = [sum(map(_chunk_cost, worker_chunks))
+             for worker_chunks in schedule]
+    largest_chunk = max(map(_chunk_cost, chunks))
+    average = sum(loads) / workers
+    assert max(loads) <= average + average / 4 + 2 * largest_chunk
+
+    # Consecutive chunks of a worker share a slice, except between
+    # strips of different datasets.
+    transitions = [(chunk0, chunk1)
+                   for worker_chunks in schedule
+                   for chunk0, chunk1 in zip(worker_chunks,
+                                             worker_chunks[1:])]
+    shared = sum(chunk0[0] == chunk1[0] or chunk0[1] == chunk1[1]
+                 for chunk0, chunk1 in transitions)
+    assert shared >= len(transitions) - workers * len(dataset_sizes)
+
+
+def test_plan_chunks_invalid_workers():
+    with pytest.raises(ValueError):
+        concurrency.plan_chunks(10, dataset_sizes=[10, 10], workers=0)
@@ -11,6 +11,7 @@ import uuid
 import pytest
 
 from anonlink import serialization
+from anonlink.candidate_generation import _enforce_k
 
 FLOAT_SIZES = (4, 8)
 UINT_SIZES = (1, 2, 4, 8)
@@ -186,6 +187,50 @@ class TestLoadCandidatePairsToIterable:
                 assert p0 == p1
 
 
+class TestLoadToBlocks:
+    @pytest.mark.parametrize('block_entries', (1, 3, 1 << 16))
+    def test_general(self, cands_bytes_pair, new_file_function,
+                     block_entries):
+        candidate_pairs, bytes_, *_ = cands_bytes_pair
+        sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = candidate_pairs
+        with new_file_function() as f:
+            f.write(bytes_)
+            f.seek(0)
+            blocks = list(serialization.load_to_blocks(f, block_entries))
+        assert all(len(block_sims) <= block_entries
+                   for block_sims, _, _ in blocks)
+        loaded = [
+            (sim, dset_i0, dset_i1, rec_i0, rec_i1)
+            for block_sims, (block_dset_is0, block_dset_is1),
+                (block_rec_is0, block_rec_is1) in blocks
+            for sim, dset_i0, dset_i1, rec_i0, rec_i1
+            in zip(block_sims.tolist(), block_dset_is0.tolist(),
+                   block_dset_is1.tolist(), block_rec_is0.tolist(),
+                   block_rec_is1.tolist())]
+        assert loaded == list(zip(sims, dset_is0, dset_is1, rec_is0, rec_is1))
+
+    def test_incomplete_entry(self):
+        bytes_ = pairs_list_to_bytes([(.5, 0, 1, 2, 3)], 8, 4, 4)
+        f = io.BytesIO(bytes(bytes_[:-1]))
+        with pytest.raises(ValueError):
+            list(serialization.load_to_blocks(f))
+
+
+class TestLoadCandidatePairsMmap:
+    def test_general(self, cands_bytes_pair, tmpdir_path):
+        candidate_pairs, bytes_, *_ = cands_bytes_pair
+        path = tmpdir_path.join(str(uuid.uuid4()))
+        with open(path, 'wb') as f:
+            f.write(bytes_)
+        sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = \
+            serialization.load_candidate_pairs_mmap(path)
+        assert (sims.tolist(), (dset_is0.tolist(), dset_is1.tolist()),
+                (rec_is0.tolist(), rec_is1.tolist())) == (
+            candidate_pairs[0].tolist(),
+            tuple(a.tolist() for a in candidate_pairs[1]),
+            tuple(a.tolist() for a in candidate_pairs[2]))
+
+
 @pytest.mark.parametrize(
     'load_function',
     [serialization.load_candidate_pairs,
@@ -530,6 +575,23 @@ class TestMergeStreams:
                         merge_function(files, f_out)
 
 
+@pytest.mark.parametrize('k', (0, 1, 2))
+def test_merge_streams_k(k):
+    pairs0 = ((.9, 0, 1, 0, 0), (.7, 0, 1, 1, 0), (.5, 0, 1, 2, 1))
+    pairs1 = ((.8, 0, 1, 0, 1), (.6, 0, 1, 2, 0))
+    files = [io.BytesIO(pairs_list_to_bytes(pairs, 8, 4, 4))
+             for pairs in (pairs0, pairs1)]
+    f_out = io.BytesIO()
+    serialization.merge_streams(files, f_out, k=k)
+    f_out.seek(0)
+
+    expected = list(_enforce_k(sorted(pairs0 + pairs1, key=lambda x: -x[0]),
+                               k))
+    assert list(serialization.load_to_iterable(f_out)) == expected
+    if k == 1:
+        assert expected == [(.9, 0, 1, 0, 0)]
+
+
 @pytest.mark.parametrize('dump_function', [dump_to_file_stream,
                                            dump_iter_to_file])
 class TestIntegration:
@@ -70,6 +70,57 @@ class TestBloomFilterComparison:
             self.filters, self.default_threshold, self.default_k)
         self._check_proportion(similarity)
 
+    @pytest.mark.parametrize('k', [None, 1, 5])
+    @pytest.mark.parametrize('threshold', [.5, .8])
+    @pytest.mark.parametrize('bytes_n', [None, 9])
+    def test_accelerated_stats(self, k, threshold, bytes_n):
+        datasets = self.filters
+        if bytes_n is not None:
+            # Filters whose length is not a multiple of 64 bits.
+            datasets = tuple([f[:8 * bytes_n] for f in filters]
+                             for filters in datasets)
+        stats = {'comparisons': 1}
+        similarity = similarities.dice_coefficient_accelerated(
+            datasets, threshold, k, stats=stats)
+        self.assert_similarity_matrices_equal(
+            similarity,
+            similarities.dice_coefficient_accelerated(datasets, threshold, k))
+
+        pairs = len(datasets[0]) * len(datasets[1])
+        assert stats['comparisons'] == pairs + 1
+        assert stats['popcount_pruned'] + stats['computed'] == pairs
+        assert stats['popcount_pruned'] == round(
+            pairs * anonlink.stats.popcount_filter_pruning(datasets,
+                                                           threshold))
+        assert (stats['below_threshold'] + stats['dynamic_pruned']
+                + stats['heap_pushes'] == stats['computed'])
+        assert (stats['heap_pushes'] - stats['heap_pops']
+                == len(similarity[0]))
+        if k is None:
+            assert stats['dynamic_pruned'] == stats['heap_pops'] == 0
+        assert stats['kernel_seconds'] > 0
+        assert stats['popcount_seconds'] >= 0
+
+        # Counters aggregate over calls.
+        similarities.dice_coefficient_accelerated(
+            datasets, threshold, k, stats=stats)
+        assert stats['comparisons'] == 2 * pairs + 1
+
+    @pytest.mark.parametrize('k', [None, 2])
+    @pytest.mark.parametrize('threshold', [0., .3])
+    def test_accelerated_stats_empty_record(self, k, threshold):
+        # A record with no bits set scores 0 against every record.
+        datasets = ([bitarray('0' * 64), bitarray('1' * 64)],
+                    [bitarray('10' * 32)] * 5)
+        stats = {}
+        similarity = similarities.dice_coefficient_accelerated(
+            datasets, threshold, k, stats=stats)
+        assert stats['popcount_pruned'] + stats['computed'] == 10
+        assert (stats['below_threshold'] + stats['dynamic_pruned']
+                + stats['heap_pushes'] == stats['computed'])
+        assert (stats['heap_pushes'] - stats['heap_pops']
+                == len(similarity[0]))
+
     def test_python(self):
         similarity = similarities.dice_coefficient_python(
             self.filters, self.default_threshold, self.default_k)
@@ -1,4 +1,5 @@
 import itertools
+from concurrent import futures
 from array import array
 from collections import Counter
 
@@ -6,9 +7,11 @@ import pytest
 from hypothesis import given, strategies
 
 from anonlink.solving import (
-    greedy_solve, greedy_solve_python, greedy_solve_native, pairs_from_groups,
-    probabilistic_greedy_solve, probabilistic_greedy_solve_native,
-    probabilistic_greedy_solve_python)
+    bipartite_optimal_solve, connected_components_native, connected_components_python,
+    greedy_solve, greedy_solve_python, greedy_solve_native, matching_weight,
+    optimality_gap, pairs_from_groups, parallel_solve, partition_candidates,
+    probabilistic_greedy_solve,
+    probabilistic_greedy_solve_native, probabilistic_greedy_solve_python)
 from tests import UINT_MAX
 
 
@@ -389,6 +392,123 @@ def test_probabilistic_python_native_match_np_ndedup(
     assert solution_python == solution_native
 
 
+# Few enough datasets for the solver to track them in a bitmask.
+indices_12p = strategies.tuples(
+    strategies.integers(min_value=0, max_value=11),
+    strategies.integers(min_value=0, max_value=20))
+index_pair_12p = strategies.tuples(
+        indices_12p, indices_12p
+    ).filter(
+        lambda x: x[0] != x[1]
+    ).map(lambda x: tuple(sorted(x)))
+candidate_pairs_12p = strategies.dictionaries(
+        index_pair_12p,
+        strategies.floats(min_value=0, max_value=1)
+    ).map(dict_to_candidate_pairs)
+
+
+@given(candidate_pairs_12p,
+       strategies.floats(min_value=0, max_value=1),
+       strategies.booleans())
+def test_probabilistic_python_native_match_12p(
+    candidate_pairs,
+    merge_threshold,
+    deduplicated
+):
+    candidates = _zip_candidates(candidate_pairs)
+    solution_python = probabilistic_greedy_solve_python(
+        candidates, merge_threshold=merge_threshold, deduplicated=deduplicated)
+    solution_native = probabilistic_greedy_solve_native(
+        candidates, merge_threshold=merge_threshold, deduplicated=deduplicated)
+
+    # We don't care about the order
+    solution_python = frozenset(map(frozenset, solution_python))
+    solution_native = frozenset(map(frozenset, solution_native))
+
+    assert solution_python == solution_native
+
+
+@given(candidate_pairs_np,
+       strategies.floats(min_value=0, max_value=1),
+       strategies.booleans())
+def test_probabilistic_python_native_stats_match(
+    candidate_pairs,
+    merge_threshold,
+    deduplicated
+):
+    candidates = _zip_candidates(candidate_pairs)
+    stats_python = {}
+    stats_native = {}
+    probabilistic_greedy_solve_python(
+        candidates, merge_threshold=merge_threshold, deduplicated=deduplicated,
+        stats=stats_python)
+    probabilistic_greedy_solve_native(
+        candidates, merge_threshold=merge_threshold, deduplicated=deduplicated,
+        stats=stats_native)
+
+    assert stats_python == stats_native
+    assert set(stats_native) == {'peak_edges', 'pruned_edges'}
+    if not deduplicated:
+        assert stats_native['pruned_edges'] == 0
+
+
+@pytest.mark.parametrize("prob_greedy_solve", [probabilistic_greedy_solve_native, probabilistic_greedy_solve_python])
+def test_probabilistic_greedy_max_edges(prob_greedy_solve):
+    # (0, 0) and (1, 0) form a group. (2, 0) and (3, 0) each have one of
+    # two edges to it, so neither is merged and both edges are counted.
+    # Without deduplication, no edge counts are pruned.
+    candidates = _zip_candidates([(.9, ((0, 0), (1, 0))),
+                                  (.8, ((0, 0), (2, 0))),
+                                  (.7, ((1, 0), (3, 0)))])
+    stats = {}
+    result = prob_greedy_solve(candidates, merge_threshold=1.,
+                               deduplicated=False, max_edges=2,
+                               stats=stats)
+    _compare_matching(result, [{(0, 0), (1, 0)}])
+    assert stats == {'peak_edges': 2, 'pruned_edges': 0}
+
+    with pytest.raises(MemoryError):
+        prob_greedy_solve(candidates, merge_threshold=1.,
+                          deduplicated=False, max_edges=1)
+    with pytest.raises(ValueError):
+        prob_greedy_solve(candidates, max_edges=-1)
+
+
+def test_probabilistic_greedy_pruning():
+    # (0, 0) and (1, 0) form a group, as do (0, 1) and (1, 1). They can
+    # never be merged, so their edge is not counted.
+    candidates = _zip_candidates([(.9, ((0, 0), (1, 0))),
+                                  (.8, ((0, 1), (1, 1))),
+                                  (.7, ((0, 0), (1, 1)))])
+    for prob_greedy_solve in [probabilistic_greedy_solve_native,
+                              probabilistic_greedy_solve_python]:
+        stats = {}
+        result = prob_greedy_solve(candidates, merge_threshold=.5,
+                                   max_edges=0, stats=stats)
+        _compare_matching(result, [{(0, 0), (1, 0)}, {(0, 1), (1, 1)}])
+        assert stats == {'peak_edges': 0, 'pruned_edges': 1}
+
+
+@pytest.mark.parametrize("prob_greedy_solve", [probabilistic_greedy_solve_native, probabilistic_greedy_solve_python])
+def test_probabilistic_greedy_pruning_unreachable(prob_greedy_solve):
+    # (0, 0) and (1, 0) form a group. (2, 0) has one edge to it and none
+    # left. Even if (2, 0) were joined by (3, 0), the groups would have
+    # at most 3 of 4 pairs with edges, so they can never be merged.
+    candidates = _zip_candidates([(.9, ((0, 0), (1, 0))),
+                                  (.8, ((0, 0), (2, 0))),
+                                  (.7, ((1, 0), (3, 0)))])
+    stats = {}
+    result = prob_greedy_solve(candidates, merge_threshold=.8,
+                               max_edges=0, stats=stats)
+    _compare_matching(result, [{(0, 0), (1, 0)}])
+    assert stats == {'peak_edges': 0, 'pruned_edges': 2}
+
+    # With a lower threshold, the edges may still lead to a merge.
+    stats = {}
+    prob_greedy_solve(candidates, merge_threshold=.75, stats=stats)
+    assert stats['pruned_edges'] == 0
+
+
 @given(candidate_pairs_np)
 def test_probabilistic_nonprobabilistic_match(candidate_pairs):
     candidates = _zip_candidates(candidate_pairs)
@@ -457,3 +577,160 @@ def test_probabilistic_greedy():
     result = probabilistic_greedy_solve(
         _zip_candidates(candidates), merge_threshold=1, deduplicated=False)
     _compare_matching(result, [{(0,0), (0,1)}, {(1,0), (1,1)}])
+
+
+@given(candidate_pairs_np)
+def test_connected_components_python_native_match(candidate_pairs):
+    candidates = _zip_candidates(candidate_pairs)
+    components_python, labels_python = connected_components_python(candidates)
+    components_native, labels_native = connected_components_native(candidates)
+    assert components_python == components_native
+    assert list(labels_python) == list(labels_native)
+
+
+def test_connected_components():
+    candidates = [(.9, ((0, 0), (1, 0))),
+                  (.8, ((0, 1), (1, 1))),
+                  (.7, ((1, 0), (2, 0))),
+                  (.6, ((0, 2), (2, 1))),
+                  (.5, ((2, 0), (0, 1)))]
+    for connected_components in (connected_components_native,
+                                 connected_components_python):
+        components, labels = connected_components(
+            _zip_candidates(candidates))
+        assert components == 2
+        assert list(labels) == [0, 0, 0, 1, 0]
+
+        components, labels = connected_components(_zip_candidates([]))
+        assert components == 0
+        assert list(labels) == []
+
+
+@given(candidate_pairs_12p, strategies.integers(min_value=1, max_value=10))
+def test_partition_candidates(candidate_pairs, partitions):
+    candidates = _zip_candidates(candidate_pairs)
+    parts = partition_candidates(candidates, partitions)
+    assert len(parts) <= partitions
+    assert sum(len(sims) for sims, _, _ in parts) == len(candidate_pairs)
+
+    part_records = []
+    for sims, (dset_is0, dset_is1), (rec_is0, rec_is1) in parts:
+        assert len(sims)
+        assert list(sims) == sorted(sims, reverse=True)
+        part_records.append(set(zip(dset_is0, rec_is0))
+                            | set(zip(dset_is1, rec_is1)))
+    for records0, records1 in itertools.combinations(part_records, 2):
+        assert not records0 & records1
+
+
+@given(candidate_pairs_12p,
+       strategies.floats(min_value=0, max_value=1),
+       strategies.booleans(),
+       strategies.integers(min_value=1, max_value=10))
+def test_parallel_solve(
+    candidate_pairs,
+    merge_threshold,
+    deduplicated,
+    partitions
+):
+    candidates = _zip_candidates(candidate_pairs)
+    solution = probabilistic_greedy_solve(
+        candidates, merge_threshold=merge_threshold, deduplicated=deduplicated)
+    solution_parallel = parallel_solve(
+        candidates, probabilistic_greedy_solve,
+        partitions=partitions,
+        merge_threshold=merge_threshold, deduplicated=deduplicated)
+
+    # We don't care about the order
+    solution = frozenset(map(frozenset, solution))
+    solution_parallel = frozenset(map(frozenset, solution_parallel))
+
+    assert solution == solution_parallel
+
+
+def test_parallel_solve_default_solver():
+    candidates = _zip_candidates([(.8, ((0, 0), (1, 0))),
+                                  (.7, ((0, 1), (1, 0))),
+                                  (.6, ((0, 2), (1, 3)))])
+    result = parallel_solve(candidates)
+    _compare_matching(result, [{(0, 0), (1, 0)}, {(0, 2), (1, 3)}])
+
+    with pytest.raises(ValueError):
+        partition_candidates(candidates, 0)
+
+
+def _brute_force_matching_weight(candidate_pairs):
+    # Try every subset of pairs that does not reuse a record.
+    best = 0.
+    def search(i, used, weight):
+        nonlocal best
+        best = max(best, weight)
+        for j in range(i, len(candidate_pairs)):
+            sim, (r0, r1) = candidate_pairs[j]
+            if r0 not in used and r1 not in used:
+                search(j + 1, used | {r0, r1}, weight + sim)
+    search(0, frozenset(), 0.)
+    return best
+
+
+indices0_small = strategies.tuples(strategies.just(0),
+                                   strategies.integers(min_value=0, max_value=4))
+indices1_small = strategies.tuples(strategies.just(1),
+                                   strategies.integers(min_value=0, max_value=4))
+candidate_pairs_small = strategies.dictionaries(
+        strategies.tuples(indices0_small, indices1_small),
+        strategies.floats(min_value=0, max_value=1),
+        max_size=12
+    ).map(dict_to_candidate_pairs)
+
+
+@given(candidate_pairs_small)
+def test_bipartite_optimal(candidate_pairs):
+    candidates = _zip_candidates(candidate_pairs)
+    solution = bipartite_optimal_solve(candidates)
+
+    matched = Counter(itertools.chain.from_iterable(solution))
+    assert all(count == 1 for count in matched.values())
+    all_candidate_pairs = {x for _, x in candidate_pairs}
+    assert all(tuple(group) in all_candidate_pairs for group in solution)
+
+    weight = matching_weight(candidates, solution)
+    assert weight == pytest.approx(
+        _brute_force_matching_weight(candidate_pairs))
+    assert matching_weight(candidates, greedy_solve(candidates)) \
+        <= weight + 1e-9
+    assert -1e-9 <= optimality_gap(candidates, optimal_groups=solution) <= 1
+
+
+@given(candidate_pairs_2p)
+def test_bipartite_optimal_2p(candidate_pairs):
+    candidates = _zip_candidates(candidate_pairs)
+    solution = bipartite_optimal_solve(candidates)
+    assert matching_weight(candidates, greedy_solve(candidates)) \
+        <= matching_weight(candidates, solution) + 1e-9
+
+
+def test_bipartite_optimal_beats_greedy():
+    # Greedy takes the best pair, leaving two poor ones.
+    candidates = _zip_candidates([(.9, ((0, 0), (1, 0))),
+                                  (.8, ((0, 0), (1, 1))),
+                                  (.8, ((0, 1), (1, 0))),
+                                  (.6, ((0, 2), (1, 3)))])
+    solution = bipartite_optimal_solve(candidates)
+    _compare_matching(solution, [{(0, 0), (1, 1)}, {(0, 1), (1, 0)},
+                                 {(0, 2), (1, 3)}])
+    assert matching_weight(candidates, solution) == pytest.approx(2.2)
+    assert optimality_gap(candidates) == pytest.approx(1 - 1.5 / 2.2)
+
+    with futures.ThreadPoolExecutor(2) as executor:
+        solution_parallel = bipartite_optimal_solve(
+            candidates, executor=executor, partitions=2)
+    _compare_matching(solution_parallel, solution)
+
+
+def test_bipartite_optimal_nonbipartite():
+    candidates = _zip_candidates([(.9, ((0, 0), (1, 0))),
+                                  (.8, ((0, 0), (2, 1)))])
+    with pytest.raises(ValueError):
+        bipartite_optimal_solve(candidates)
+    assert bipartite_optimal_solve(_zip_candidates([])) == ()
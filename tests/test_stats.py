@@ -1,6 +1,11 @@
 import array
+import io
+import itertools
+import random
 
+import bitarray
 import hypothesis
+import numpy as np
 import pytest
 
 import anonlink
@@ -173,3 +178,461 @@ def test_nonmatch_index_score_exhaustive():
                       (array.array('I', [0]), array.array('I', [0]), array.array('I', [0])))
     with pytest.raises(ValueError):
         anonlink.stats.nonmatch_index_score(candidate_pairs, 1)
+
+
+def _greedy_matches_sequential(rec_is0, rec_is1):
+    matched0 = set()
+    matched1 = set()
+    is_match = []
+    for rec_i0, rec_i1 in zip(rec_is0, rec_is1):
+        is_match.append(rec_i0 not in matched0 and rec_i1 not in matched1)
+        if is_match[-1]:
+            matched0.add(rec_i0)
+            matched1.add(rec_i1)
+    return is_match
+
+
+@hypothesis.given(
+    hypothesis.strategies.lists(
+        hypothesis.strategies.tuples(
+            hypothesis.strategies.integers(min_value=0, max_value=20),
+            hypothesis.strategies.integers(min_value=0, max_value=20))),
+    hypothesis.strategies.integers(min_value=0, max_value=UINT_MAX))
+def test_greedy_matches(rec_pairs, offset):
+    rec_is0 = array.array('Q', (rec_i0 + offset for rec_i0, _ in rec_pairs))
+    rec_is1 = array.array('Q', (rec_i1 for _, rec_i1 in rec_pairs))
+    result = anonlink.stats._greedy_matches(rec_is0, rec_is1)
+    assert (result.tolist()
+            == _greedy_matches_sequential(rec_is0, rec_is1))
+
+
+def test_greedy_matches_chain():
+    # Every pair depends on the one before it, so the pairs are resolved
+    # one at a time.
+    n = 1000
+    rec_is0 = array.array('I', (i // 2 for i in range(n)))
+    rec_is1 = array.array('I', ((i + 1) // 2 for i in range(n)))
+    result = anonlink.stats._greedy_matches(rec_is0, rec_is1)
+    assert (result.tolist()
+            == _greedy_matches_sequential(rec_is0, rec_is1))
+
+
+def test_stats_mmap(tmp_path):
+    candidate_pairs = zip_candidates(dict_to_candidate_pairs({
+        ((0, i % 7), (1, i % 5)): i / 40 for i in range(35)}))
+    path = tmp_path / 'candidate_pairs.bin'
+    with open(path, 'wb') as f:
+        anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+    mapped = anonlink.serialization.load_candidate_pairs_mmap(path)
+
+    sims, (dset_is0, dset_is1), (rec_is0, rec_is1) = mapped
+    assert list(sims) == list(candidate_pairs[0])
+    assert list(rec_is0) == list(candidate_pairs[2][0])
+    assert list(rec_is1) == list(candidate_pairs[2][1])
+    for expected, result in zip(
+            anonlink.stats.matches_nonmatches_hist(candidate_pairs, 10),
+            anonlink.stats.matches_nonmatches_hist(mapped, 10)):
+        assert list(expected) == list(result)
+    assert (anonlink.stats.nonmatch_index_score(candidate_pairs, 3)
+            == anonlink.stats.nonmatch_index_score(mapped, 3))
+
+    with open(path, 'wb') as f:
+        anonlink.serialization.dump_candidate_pairs(
+            zip_candidates(()), f)
+    sims, _, _ = anonlink.serialization.load_candidate_pairs_mmap(path)
+    assert len(sims) == 0
+
+
+def _stream_sources(candidate_pairs):
+    f = io.BytesIO()
+    anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+    f.seek(0)
+    sims, _, _ = candidate_pairs
+    sim_range = (min(sims), max(sims)) if len(sims) else None
+    yield f, None
+    if sim_range is not None:
+        f = io.BytesIO(f.getvalue())
+        yield anonlink.serialization.load_to_iterable(f), sim_range
+
+
+@hypothesis.given(candidate_pairs_2p,
+                  hypothesis.strategies.integers(min_value=1, max_value=100),
+                  hypothesis.strategies.integers(min_value=1, max_value=10))
+@hypothesis.settings(deadline=None)
+def test_stats_stream(candidate_pairs, bins, block_entries):
+    expected_sims = anonlink.stats.similarities_hist(candidate_pairs, bins)
+    expected_hist = anonlink.stats.matches_nonmatches_hist(
+        candidate_pairs, bins)
+    expected_cumul = anonlink.stats.cumul_number_matches_vs_threshold(
+        candidate_pairs, bins)
+    for function, expected in [
+            (anonlink.stats.similarities_hist_stream, expected_sims),
+            (anonlink.stats.matches_nonmatches_hist_stream, expected_hist),
+            (anonlink.stats.cumul_number_matches_vs_threshold_stream,
+             expected_cumul)]:
+        for source, sim_range in _stream_sources(candidate_pairs):
+            result = function(source, bins, sim_range=sim_range,
+                              block_entries=block_entries)
+            assert len(result) == len(expected)
+            for expected_array, result_array in zip(expected, result):
+                assert list(expected_array) == list(result_array)
+
+
+def test_stats_stream_sim_range_required():
+    candidate_pairs = zip_candidates([(.5, ((0, 0), (1, 0)))])
+    with pytest.raises(ValueError):
+        anonlink.stats.similarities_hist_stream(iter([]))
+    f = io.BytesIO()
+    anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+    f.seek(0)
+    f.seekable = lambda: False
+    with pytest.raises(ValueError):
+        anonlink.stats.matches_nonmatches_hist_stream(f)
+
+
+def test_stats_stream_multiparty():
+    candidate_pairs = zip_candidates([(.5, ((0, 0), (2, 0)))])
+    f = io.BytesIO()
+    anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+    f.seek(0)
+    with pytest.raises(ValueError):
+        anonlink.stats.matches_nonmatches_hist_stream(f)
+
+
+def test_stats_stream_sparse_records(monkeypatch):
+    monkeypatch.setattr(anonlink.stats, '_MAX_DENSE_RECORDS', 10)
+    candidate_pairs = zip_candidates(dict_to_candidate_pairs({
+        ((0, i % 7 * 3), (1, i % 5)): i / 40 for i in range(35)}))
+    f = io.BytesIO()
+    anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+    f.seek(0)
+    result = anonlink.stats.matches_nonmatches_hist_stream(
+        f, 10, block_entries=4)
+    expected = anonlink.stats.matches_nonmatches_hist(candidate_pairs, 10)
+    for expected_array, result_array in zip(expected, result):
+        assert list(expected_array) == list(result_array)
+
+
+index_pair_mp = hypothesis.strategies.tuples(
+    hypothesis.strategies.integers(min_value=0, max_value=3),
+    hypothesis.strategies.integers(min_value=0, max_value=10),
+    hypothesis.strategies.integers(min_value=0, max_value=3),
+    hypothesis.strategies.integers(min_value=0, max_value=10)
+).filter(lambda t: t[0] < t[2]
+).map(lambda t: ((t[0], t[1]), (t[2], t[3])))
+candidate_pairs_mp = hypothesis.strategies.dictionaries(
+        index_pair_mp,
+        hypothesis.strategies.floats(min_value=0, max_value=1)
+    ).map(dict_to_candidate_pairs
+    ).map(zip_candidates)
+
+
+def _pairwise_greedy_matches_sequential(candidate_pairs):
+    _, (dset_is0, dset_is1), (rec_is0, rec_is1) = candidate_pairs
+    matched = set()
+    is_match = []
+    for dset_i0, dset_i1, rec_i0, rec_i1 in zip(
+            dset_is0, dset_is1, rec_is0, rec_is1):
+        key0 = dset_i0, dset_i1, rec_i0
+        key1 = dset_i1, dset_i0, rec_i1
+        is_match.append(key0 not in matched and key1 not in matched)
+        if is_match[-1]:
+            matched.add(key0)
+            matched.add(key1)
+    return is_match
+
+
+@hypothesis.given(candidate_pairs_mp,
+                  hypothesis.strategies.integers(min_value=1, max_value=20))
+def test_matches_nonmatches_hist_multiparty(candidate_pairs, bins):
+    matches_nums, nonmatches_nums, thresholds = \
+        anonlink.stats.matches_nonmatches_hist_multiparty(
+            candidate_pairs, bins)
+    assert len(matches_nums) == len(nonmatches_nums) == bins
+
+    sims, _, _ = candidate_pairs
+    is_match = _pairwise_greedy_matches_sequential(candidate_pairs)
+    bin_is = [min(max(i for i, t in enumerate(thresholds) if t <= sim),
+                  bins - 1)
+              for sim in sims]
+    assert list(matches_nums) == [
+        sum(m and b == i for m, b in zip(is_match, bin_is))
+        for i in range(bins)]
+    assert list(nonmatches_nums) == [
+        sum(not m and b == i for m, b in zip(is_match, bin_is))
+        for i in range(bins)]
+
+    counts, cumul_thresholds = \
+        anonlink.stats.cumul_number_matches_vs_threshold_multiparty(
+            candidate_pairs, bins)
+    assert list(cumul_thresholds) == list(thresholds)
+    for count, threshold in zip(counts, thresholds):
+        assert count == sum(m for m, sim in zip(is_match, sims)
+                            if sim >= threshold)
+
+
+@hypothesis.given(candidate_pairs_mp,
+                  hypothesis.strategies.integers(min_value=1, max_value=30))
+def test_nonmatch_index_score_multiparty(candidate_pairs, n):
+    nonmatch_is = [i for i, m in enumerate(
+        _pairwise_greedy_matches_sequential(candidate_pairs)) if not m]
+    if len(nonmatch_is) >= n:
+        assert (anonlink.stats.nonmatch_index_score_multiparty(
+                    candidate_pairs, n)
+                == nonmatch_is[n - 1])
+    else:
+        with pytest.raises(ValueError):
+            anonlink.stats.nonmatch_index_score_multiparty(
+                candidate_pairs, n)
+
+
+@hypothesis.given(candidate_pairs_2p,
+                  hypothesis.strategies.integers(min_value=1, max_value=20))
+def test_multiparty_stats_agree_2p(candidate_pairs, bins):
+    for expected, result in zip(
+            anonlink.stats.matches_nonmatches_hist(candidate_pairs, bins),
+            anonlink.stats.matches_nonmatches_hist_multiparty(
+                candidate_pairs, bins)):
+        assert list(expected) == list(result)
+
+
+def _estimation_datasets():
+    rng = random.Random(0)
+    dataset0 = [bitarray.bitarray([rng.random() < .5 for _ in range(128)])
+                for _ in range(400)]
+    dataset1 = [bitarray.bitarray([rng.random() < .5 for _ in range(128)])
+                for _ in range(300)]
+    # Plant some near-duplicates.
+    for i in range(100):
+        record = bitarray.bitarray(dataset0[i])
+        record[rng.randrange(128)] ^= True
+        dataset1[i] = record
+    return dataset0, dataset1
+
+
+def test_estimate_candidate_counts():
+    datasets = _estimation_datasets()
+    thresholds = [.5, .55, .6, .9]
+    exact = [len(anonlink.similarities.dice_coefficient(datasets, t)[0])
+             for t in thresholds]
+
+    # Sampling every record gives the exact counts.
+    estimates, lower, upper = anonlink.stats.estimate_candidate_counts(
+        datasets, thresholds, sample_rows=1000)
+    assert list(estimates) == list(lower) == list(upper) == exact
+
+    estimates, lower, upper = anonlink.stats.estimate_candidate_counts(
+        datasets, thresholds, sample_rows=200, seed=1)
+    assert all(lower <= exact) and all(exact <= upper)
+    assert all(lower <= estimates) and all(estimates <= upper)
+    assert list(estimates) == sorted(estimates, reverse=True)
+
+    estimates, lower, upper = anonlink.stats.estimate_candidate_counts(
+        datasets, thresholds, sample_rows=1, sample_columns=50, seed=1)
+    assert all(lower == 0) and all(upper == 400 * 300)
+
+    # Sampling only the second dataset still leaves an interval.
+    estimates, lower, upper = anonlink.stats.estimate_candidate_counts(
+        datasets, thresholds, sample_rows=1000, sample_columns=150, seed=1)
+    assert all(lower <= exact) and all(exact <= upper)
+    assert all(lower < upper)
+
+    with pytest.raises(ValueError):
+        anonlink.stats.estimate_candidate_counts(datasets, [0.])
+    with pytest.raises(ValueError):
+        anonlink.stats.estimate_candidate_counts(datasets, [.5],
+                                                 confidence=1)
+    with pytest.raises(ValueError):
+        anonlink.stats.estimate_candidate_counts(datasets[:1], [.5])
+
+
+def test_estimate_similarities_hist():
+    datasets = _estimation_datasets()
+    candidate_pairs = anonlink.similarities.dice_coefficient(datasets, .5)
+
+    counts, edges = anonlink.stats.estimate_similarities_hist(
+        datasets, 10, min_similarity=.5, sample_rows=1000)
+    assert len(counts) == 10
+    assert list(edges) == list(np.linspace(.5, 1, 11))
+    assert counts.sum() == len(candidate_pairs[0])
+
+    counts, _ = anonlink.stats.estimate_similarities_hist(
+        datasets, 10, min_similarity=.5, sample_rows=200,
+        sample_columns=150, seed=2)
+    assert counts.sum() == pytest.approx(len(candidate_pairs[0]), rel=.2)
+
+
+def test_estimate_linkage_cost():
+    datasets = _estimation_datasets()
+    threshold = .6
+    candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, threshold)
+    f = io.BytesIO()
+    anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+
+    # Sampling every record gives the exact counts.
+    cost = anonlink.stats.estimate_linkage_cost(datasets, threshold,
+                                                sample_rows=1000)
+    assert cost['comparisons'] == 400 * 300
+    assert 0 < cost['popcountFilteredComparisons'] <= 400 * 300
+    assert (cost['candidates'] == cost['candidatesLower']
+            == cost['candidatesUpper'] == len(candidate_pairs[0]))
+    assert cost['outputBytes'] == len(f.getvalue())
+    assert cost['seconds'] > 0
+
+    cost = anonlink.stats.estimate_linkage_cost(datasets, threshold,
+                                                sample_rows=100, seed=0)
+    assert (cost['candidatesLower'] <= len(candidate_pairs[0])
+            <= cost['candidatesUpper'])
+
+    # With k, only the records of the first dataset are capped.
+    cost = anonlink.stats.estimate_linkage_cost(datasets, threshold, k=1,
+                                                sample_rows=1000)
+    assert cost['candidates'] == len(set(candidate_pairs[2][0]))
+
+    def blocking_f(dataset_index, record_index, record):
+        return [record_index % 3]
+
+    candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, threshold,
+        blocking_f=blocking_f)
+    cost = anonlink.stats.estimate_linkage_cost(
+        datasets, threshold, blocking_f=blocking_f, sample_rows=1000)
+    assert cost['comparisons'] == sum(
+        sum(1 for i in range(400) if i % 3 == block)
+        * sum(1 for i in range(300) if i % 3 == block)
+        for block in range(3))
+    assert cost['candidates'] == len(candidate_pairs[0])
+
+    # The sample is compared in one call per block, and pairs of records
+    # in several blocks are counted once.
+    def overlapping_blocking_f(dataset_index, record_index, record):
+        return [('a', record_index % 3), ('b', record_index % 2)]
+
+    calls = 0
+
+    def counting_similarity_f(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return anonlink.similarities.dice_coefficient(*args, **kwargs)
+
+    candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, threshold,
+        blocking_f=overlapping_blocking_f)
+    cost = anonlink.stats.estimate_linkage_cost(
+        datasets, threshold, blocking_f=overlapping_blocking_f,
+        sample_rows=1000, similarity_f=counting_similarity_f)
+    assert calls == 5
+    assert cost['candidates'] == len(candidate_pairs[0])
+
+    with pytest.raises(ValueError):
+        anonlink.stats.estimate_linkage_cost(datasets, 0.)
+    with pytest.raises(ValueError):
+        anonlink.stats.estimate_linkage_cost(datasets, .5, sample_rows=0)
+
+
+def test_merge_threshold_sweep():
+    datasets = _estimation_datasets()
+    candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6)
+    merge_thresholds = [1., .75, .5, 0.]
+    group_counts, size_counts = anonlink.stats.merge_threshold_sweep(
+        candidate_pairs, merge_thresholds, partitions=3)
+    assert size_counts.shape[0] == len(merge_thresholds)
+    assert list(group_counts) == list(size_counts.sum(axis=1))
+    for i, merge_threshold in enumerate(merge_thresholds):
+        groups = anonlink.solving.probabilistic_greedy_solve(
+            candidate_pairs, merge_threshold=merge_threshold)
+        assert group_counts[i] == len(groups)
+        expected = np.bincount([len(group) for group in groups],
+                               minlength=size_counts.shape[1])
+        assert list(size_counts[i]) == list(expected)
+
+    group_counts, size_counts = anonlink.stats.merge_threshold_sweep(
+        candidate_pairs, [.5], deduplicated=False,
+        solve_f=anonlink.solving.probabilistic_greedy_solve_python)
+    groups = anonlink.solving.probabilistic_greedy_solve(
+        candidate_pairs, merge_threshold=.5, deduplicated=False)
+    assert list(group_counts) == [len(groups)]
+
+    group_counts, size_counts = anonlink.stats.merge_threshold_sweep(
+        candidate_pairs, [])
+    assert group_counts.shape == (0,)
+
+    with pytest.raises(ValueError):
+        anonlink.stats.merge_threshold_sweep(candidate_pairs, [1.5])
+
+
+def test_merge_threshold_sweep_mmap(tmp_path):
+    datasets = _estimation_datasets()
+    candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6)
+    path = tmp_path / 'candidate_pairs.bin'
+    with open(path, 'wb') as f:
+        anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+    mapped = anonlink.serialization.load_candidate_pairs_mmap(path)
+    merge_thresholds = [1., .5]
+    for expected, result in zip(
+            anonlink.stats.merge_threshold_sweep(
+                candidate_pairs, merge_thresholds, partitions=3),
+            anonlink.stats.merge_threshold_sweep(
+                mapped, merge_thresholds, partitions=3)):
+        assert expected.tolist() == result.tolist()
+
+
+def test_popcount_profile():
+    dataset, _ = _estimation_datasets()
+    popcount_counts, bit_frequencies = anonlink.stats.popcount_profile(
+        dataset)
+    assert len(popcount_counts) == 129
+    assert list(popcount_counts) == list(np.bincount(
+        [record.count() for record in dataset], minlength=129))
+    assert len(bit_frequencies) == 128
+    for i in (0, 1, 7, 8, 127):
+        assert bit_frequencies[i] == pytest.approx(
+            sum(record[i] for record in dataset) / len(dataset))
+
+    # Bytes and bitarrays of either endianness agree.
+    bytes_dataset = [record.tobytes() for record in dataset]
+    little_dataset = [bitarray.bitarray(record, endian='little')
+                      for record in dataset]
+    for other_dataset in (bytes_dataset, little_dataset):
+        other_counts, other_frequencies = anonlink.stats.popcount_profile(
+            other_dataset)
+        assert list(other_counts) == list(popcount_counts)
+        assert list(other_frequencies) == list(bit_frequencies)
+
+    popcount_counts, bit_frequencies = anonlink.stats.popcount_profile([])
+    assert len(popcount_counts) == len(bit_frequencies) == 0
+
+    with pytest.raises(ValueError):
+        anonlink.stats.popcount_profile([b'\x00', b'\x00\x00'])
+
+
+@pytest.mark.parametrize('threshold', [0., .5, .8, .95, 1.])
+def test_popcount_filter_pruning(threshold):
+    rng = random.Random(threshold)
+    datasets = [[bitarray.bitarray([rng.random() < p for _ in range(64)])
+                 for _ in range(size)]
+                for p, size in ((.1, 30), (.3, 20), (.5, 25))]
+    datasets[0][0] = bitarray.bitarray(64)
+    datasets[0][0].setall(False)
+
+    def skipped(a, b):
+        if threshold <= 0:
+            return False
+        return a == 0 or abs(a - b) > int(2 * a * (1 / threshold - 1))
+
+    expected_skipped = sum(
+        skipped(record0.count(), record1.count())
+        for dataset0, dataset1 in itertools.combinations(datasets, 2)
+        for record0 in dataset0
+        for record1 in dataset1)
+    pruning = anonlink.stats.popcount_filter_pruning(datasets, threshold)
+    assert pruning == pytest.approx(
+        expected_skipped / (30 * 20 + 30 * 25 + 20 * 25))
+
+    assert anonlink.stats.popcount_filter_pruning(datasets[:1],
+                                                  threshold) == 0
+    with pytest.raises(ValueError):
+        anonlink.stats.popcount_filter_pruning(datasets, 1.5)
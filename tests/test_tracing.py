@@ -0,0 +1,156 @@
+import concurrent.futures
+import io
+import json
+import random
+
+import bitarray
+import pytest
+
+import anonlink
+from anonlink import tracing
+
+
+def _datasets():
+    rng = random.Random(0)
+    return [[bitarray.bitarray([rng.random() < .5 for _ in range(128)])
+             for _ in range(size)]
+            for size in (40, 30)]
+
+
+def test_stage_without_tracer():
+    with tracing.stage('test', x=1) as span:
+        span.items = 3
+    with tracing.Tracer() as tracer:
+        pass
+    with tracing.stage('test') as span:
+        pass
+    assert tracer.events == []
+
+
+def test_stage():
+    with tracing.Tracer() as tracer:
+        with tracing.stage('outer', x=1) as span:
+            span.items = 3
+            with tracing.stage('inner'):
+                pass
+        with pytest.raises(KeyError):
+            with tracing.stage('failing'):
+                raise KeyError
+
+    inner, outer, failing = tracer.events
+    assert outer['name'] == 'outer'
+    assert outer['args'] == {'x': 1}
+    assert outer['items'] == 3
+    assert inner['items'] is None
+    assert outer['start'] <= inner['start']
+    assert (inner['start'] + inner['wallSeconds']
+            <= outer['start'] + outer['wallSeconds'])
+    assert outer['wallSeconds'] >= 0 and outer['cpuSeconds'] >= 0
+    assert failing['error'] == 'KeyError'
+    assert 'error' not in outer
+
+    summary = tracer.summary()
+    assert summary['outer']['calls'] == 1
+    assert summary['outer']['items'] == 3
+    assert summary['inner']['items'] == 0
+
+
+@pytest.mark.skipif(not tracing._reset_peak_rss(),
+                    reason='the peak resident set size cannot be reset')
+def test_stage_peak_rss():
+    size = 64 * 1024 * 1024
+    with tracing.Tracer() as tracer:
+        with tracing.stage('outer'):
+            with tracing.stage('large'):
+                data = bytearray(size)
+                data[::4096] = b'x' * len(data[::4096])
+                del data
+            with tracing.stage('small'):
+                pass
+
+    large, small, outer = tracer.events
+    # The peak of a stage is that while it ran, not of the process.
+    assert large['peakRssBytes'] >= size
+    assert small['peakRssBytes'] < large['peakRssBytes'] - size // 2
+    assert outer['peakRssBytes'] >= large['peakRssBytes']
+    assert not tracing._open_peaks
+
+
+def test_nested_tracers():
+    with tracing.Tracer() as tracer0:
+        with tracing.stage('first'):
+            pass
+        with tracing.Tracer() as tracer1:
+            with tracing.stage('second'):
+                pass
+        with tracing.stage('third'):
+            pass
+    assert [event['name'] for event in tracer0.events] \
+        == ['first', 'second', 'third']
+    assert [event['name'] for event in tracer1.events] == ['second']
+
+
+def test_pipeline():
+    datasets = _datasets()
+    with tracing.Tracer() as tracer:
+        candidate_pairs = (
+            anonlink.candidate_generation.find_candidate_pairs(
+                datasets, anonlink.similarities.dice_coefficient, .6))
+        f = io.BytesIO()
+        anonlink.serialization.dump_candidate_pairs(candidate_pairs, f)
+        f.seek(0)
+        anonlink.serialization.load_candidate_pairs(f)
+        anonlink.solving.greedy_solve(candidate_pairs)
+
+    summary = tracer.summary()
+    for name in ('find_candidate_pairs', 'blocking', 'similarity',
+                 'merging', 'dump_candidate_pairs', 'load_candidate_pairs',
+                 'probabilistic_greedy_solve'):
+        assert summary[name]['calls'] == 1
+    n = len(candidate_pairs[0])
+    assert summary['find_candidate_pairs']['items'] == n
+    assert summary['merging']['items'] == n
+    assert summary['blocking']['items'] == 1
+    assert summary['dump_candidate_pairs']['items'] == n
+    assert summary['load_candidate_pairs']['items'] == n
+    assert summary['probabilistic_greedy_solve']['items'] == n
+
+    f = io.StringIO()
+    tracer.dump_json(f)
+    assert json.loads(f.getvalue())['summary'] == json.loads(
+        json.dumps(summary))
+
+
+def test_threads():
+    datasets = _datasets()
+    candidate_pairs = anonlink.candidate_generation.find_candidate_pairs(
+        datasets, anonlink.similarities.dice_coefficient, .6)
+    with tracing.Tracer() as tracer:
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            anonlink.solving.parallel_solve(candidate_pairs,
+                                            executor=executor,
+                                            partitions=4)
+    summary = tracer.summary()
+    assert summary['parallel_solve']['calls'] == 1
+    assert summary['probabilistic_greedy_solve']['items'] \
+        == len(candidate_pairs[0])
+
+
+def test_chrome_trace():
+    with tracing.Tracer() as tracer:
+        process_chunk = anonlink.concurrency.process_chunk
+        chunk = [{'datasetIndex': 0, 'range': [0, 40]},
+                 {'datasetIndex': 1, 'range': [0, 30]}]
+        candidate_pairs = process_chunk(
+            chunk, _datasets(), anonlink.similarities.dice_coefficient, .6)
+
+    f = io.StringIO()
+    tracer.dump_chrome_trace(f)
+    trace = json.loads(f.getvalue())
+    events = {event['name']: event for event in trace['traceEvents']}
+    event = events['process_chunk']
+    assert event['ph'] == 'X'
+    assert event['args']['chunk'] == chunk
+    assert event['args']['items'] == len(candidate_pairs[0])
+    assert event['dur'] >= 0
+    assert 'cpuSeconds' in event['args']